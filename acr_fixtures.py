@@ -0,0 +1,96 @@
+# ACRCLOUD RESPONSE SHAPES SEEN IN PRODUCTION, WITH THE EXPECTED PARSE RESULT.
+# Used by acr_parser.benchmark(); add a new entry whenever ACR surprises us.
+
+
+def _song(title="Flowers", artists=("Miley Cyrus",), **extra):
+    song = {
+        "title": title,
+        "artists": [{"name": name} for name in artists],
+        "album": {"name": "Endless Summer Vacation"},
+        "duration_ms": 200455,
+        "play_offset_ms": 61320,
+        "external_ids": {"isrc": "USSM12209777"},
+    }
+    song.update(extra)
+    return song
+
+
+def _expected(artist, title, status, artists, is_music=True, play_offset_ms=61320, duration_ms=200455):
+    return {"artist": artist, "title": title, "status": status, "artists": list(artists), "is_music": is_music,
+            "play_offset_ms": play_offset_ms, "duration_ms": duration_ms}
+
+
+ACR_FIXTURES = [
+    (
+        "live data.metadata.music",
+        {"status": {"code": 0, "msg": "Success"},
+         "data": {"metadata": {"timestamp_utc": "2025-01-10 09:14:03", "music": [_song(acr_sync_level_status="playing")]}}},
+        _expected("Miley Cyrus", "Flowers", "playing", ["Miley Cyrus"]),
+    ),
+    (
+        "top level metadata.music",
+        {"status": {"code": 0}, "metadata": {"music": [_song(status="playing")]}},
+        _expected("Miley Cyrus", "Flowers", "playing", ["Miley Cyrus"]),
+    ),
+    (
+        "result.metadata.music",
+        {"result": {"metadata": {"music": [_song()]}}},
+        _expected("Miley Cyrus", "Flowers", "unknown", ["Miley Cyrus"]),
+    ),
+    (
+        "data list of results",
+        {"data": [{"metadata": {"music": [_song("Houdini", ("Dua Lipa",))]}},
+                  {"metadata": {"music": [_song()]}}]},
+        _expected("Dua Lipa", "Houdini", "unknown", ["Dua Lipa"]),
+    ),
+    (
+        "featured artists",
+        {"data": {"metadata": {"music": [_song("Cruel Summer", ("Taylor Swift", "Jack Antonoff"))]}}},
+        _expected("Taylor Swift", "Cruel Summer", "unknown", ["Taylor Swift", "Jack Antonoff"]),
+    ),
+    (
+        "non-music status (speech)",
+        {"data": {"metadata": {"music": [_song(acr_sync_level_status="speech")]}}},
+        _expected("Miley Cyrus", "Flowers", "speech", ["Miley Cyrus"], is_music=False),
+    ),
+    (
+        "offsets missing",
+        {"data": {"metadata": {"music": [{"title": "Flowers", "artists": [{"name": "Miley Cyrus"}]}]}}},
+        _expected("Miley Cyrus", "Flowers", "unknown", ["Miley Cyrus"], play_offset_ms=None, duration_ms=None),
+    ),
+    (
+        "empty music list",
+        {"data": {"metadata": {"music": []}}},
+        None,
+    ),
+    (
+        "music entry without artists",
+        {"data": {"metadata": {"music": [{"title": "Jingle", "artists": []}]}}},
+        None,
+    ),
+    (
+        "artist without a name",
+        {"data": {"metadata": {"music": [{"title": "Jingle", "artists": [{"id": 1}]}]}}},
+        None,
+    ),
+    (
+        "alarm callback (custom_files only)",
+        {"data": {"metadata": {"custom_files": [{"COMP_NAME": "Splash The Cash", "COMP_ID": "7", "ALARM_ID": "Alarm1"}]}}},
+        None,
+    ),
+    (
+        "no result",
+        {"status": {"code": 1001, "msg": "No Result"}},
+        None,
+    ),
+    (
+        "data is null",
+        {"data": None},
+        None,
+    ),
+    (
+        "not a dict",
+        ["unexpected"],
+        None,
+    ),
+]
@@ -0,0 +1,137 @@
+# ACRCLOUD RESPONSE PARSER.
+# Every ACR payload shape we have seen is described once in ACR_MUSIC_PATHS. The table
+# is compiled at import time into straight item lookups, so parsing a poll result is a
+# handful of dict/list indexing operations with no per-level isinstance checks.
+# Run `python acr_parser.py` to check the fixtures and benchmark the parser.
+
+import operator
+import timeit
+
+NON_MUSIC_STATUSES = frozenset({"silence", "noise", "no_signal", "speech", "no_result", "error"})
+
+# Paths (from the top of the response) to the list of music results, in lookup order.
+ACR_MUSIC_PATHS = (
+    ("data", "metadata", "music"),          # live results API
+    ("metadata", "music"),                  # identify API / callbacks
+    ("result", "metadata", "music"),        # wrapped callbacks
+    ("data", 0, "metadata", "music"),       # list of results, newest first
+)
+STATUS_KEYS = ("acr_sync_level_status", "status")
+
+_LOOKUP_ERRORS = (KeyError, IndexError, TypeError, AttributeError)
+
+
+class TrackInfo:
+    """The parsed current track. Kept tiny because one is built for every poll."""
+
+    __slots__ = ("artist", "title", "status", "artists", "play_offset_ms", "duration_ms")
+
+    def __init__(self, artist, title, status, artists, play_offset_ms=None, duration_ms=None):
+        self.artist = artist
+        self.title = title
+        self.status = status
+        self.artists = artists
+        self.play_offset_ms = play_offset_ms
+        self.duration_ms = duration_ms
+
+    @property
+    def is_music(self):
+        return self.status.lower() not in NON_MUSIC_STATUSES
+
+    @property
+    def remaining_seconds(self):
+        """Seconds of the track left when ACR sampled it, or None if ACR did not say."""
+        if self.play_offset_ms is None or self.duration_ms is None:
+            return None
+        return max(self.duration_ms - self.play_offset_ms, 0) / 1000.0
+
+    def to_dict(self):
+        return {
+            "artist": self.artist,
+            "title": self.title,
+            "status": self.status,
+            "artists": self.artists,
+            "is_music": self.is_music,
+            "play_offset_ms": self.play_offset_ms,
+            "duration_ms": self.duration_ms,
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, TrackInfo) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return (f"TrackInfo(artist={self.artist!r}, title={self.title!r}, status={self.status!r}, "
+                f"artists={self.artists!r}, play_offset_ms={self.play_offset_ms}, duration_ms={self.duration_ms})")
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _compile_path(path):
+    """Turn a path tuple into a function returning the first music entry (or raising)."""
+    getters = tuple(operator.itemgetter(key) for key in path) + (operator.itemgetter(0),)
+
+    def lookup(live_data):
+        node = live_data
+        for getter in getters:
+            node = getter(node)
+        return node
+
+    return lookup
+
+
+# (top level key, lookup) pairs; the key check skips shapes that cannot match cheaply.
+_COMPILED_PATHS = tuple((path[0], _compile_path(path)) for path in ACR_MUSIC_PATHS)
+
+
+def parse_live_data(live_data):
+    """
+    Parse any ACR response into a TrackInfo.
+
+    Returns:
+        TrackInfo: for the first path that holds a music entry with at least one named
+        artist, otherwise None.
+    """
+    if not isinstance(live_data, dict):
+        return None
+    for top_key, lookup in _COMPILED_PATHS:
+        if top_key not in live_data:
+            continue
+        try:
+            song = lookup(live_data)
+            names = [artist["name"] for artist in song["artists"] if artist.get("name")]
+        except _LOOKUP_ERRORS:
+            continue
+        if not names:
+            continue
+        status = song.get(STATUS_KEYS[0]) or song.get(STATUS_KEYS[1]) or "unknown"
+        return TrackInfo(names[0], song.get("title", "N/A"), str(status), names,
+                         _as_int(song.get("play_offset_ms")), _as_int(song.get("duration_ms")))
+    return None
+
+
+def _check_fixtures():
+    from acr_fixtures import ACR_FIXTURES
+    for name, payload, expected in ACR_FIXTURES:
+        result = parse_live_data(payload)
+        result = result.to_dict() if result else None
+        if result != expected:
+            raise AssertionError(f"Fixture '{name}': expected {expected}, got {result}")
+    return ACR_FIXTURES
+
+
+def benchmark(number=100000):
+    """Check every fixture, then print the parse time per response shape."""
+    fixtures = _check_fixtures()
+    print(f"All {len(fixtures)} ACR fixtures parsed as expected.")
+    for name, payload, _ in fixtures:
+        seconds = timeit.timeit(lambda: parse_live_data(payload), number=number)
+        print(f"{name:<36} {seconds / number * 1e6:8.2f} us/parse")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,320 @@
+# SHARED ACRCLOUD LIVE-METADATA POLLER.
+# One elected worker polls the ACR live results API and publishes the parsed current
+# track to Redis (a key plus a pub/sub channel). Comps no longer poll ACR themselves;
+# they read the key or subscribe and react as soon as a new result is published.
+# The schedule is relaxed when nothing is happening and tightens after an alarm.
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+
+import requests
+
+from acr_parser import parse_live_data
+from comp_runtime import get_runtime
+from constants import ACR_API_URL, ACR_API_KEY
+from logger import logger
+from redis_cache import RedisContactManager
+
+CURRENT_TRACK_KEY = "acr:current_track"       # JSON of the last parsed result (expires when polling stops)
+TRACK_CHANNEL = "acr:track_updates"           # every parsed result is published here
+CONTROL_CHANNEL = "acr:poller_control"        # wakes the poller when the schedule changes
+BOOST_UNTIL_KEY = "acr:boost_until"           # epoch seconds until which fast polling is on
+LEADER_KEY = "acr:poller_leader"              # Redis lock held by the polling worker
+
+IDLE_POLL_SECONDS = 20
+ALARM_POLL_SECONDS = 3
+ALARM_BOOST_SECONDS = 180
+BOUNDARY_POLL_SECONDS = 2         # poll interval right after a predicted track change
+BOUNDARY_WINDOW_SECONDS = 20      # how long after the predicted change to keep polling fast
+MIN_POLL_SECONDS = 0.5
+
+NOT_MODIFIED = object()           # fetch() result for a 304 answer
+LEADER_TTL_SECONDS = 60
+CURRENT_TRACK_TTL_SECONDS = 3 * IDLE_POLL_SECONDS   # a few missed polls and the result is stale
+REQUEST_TIMEOUT_SECONDS = 10
+
+
+class ACRLivePoller(threading.Thread):
+    """Background thread; only the worker holding LEADER_KEY actually polls ACR."""
+
+    def __init__(self, redis_client=None):
+        super().__init__(name="acr-live-poller", daemon=True)
+        self.redis_client = redis_client or RedisContactManager().redis_client
+        self.session = requests.Session()
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.leader_lock = self.redis_client.lock(LEADER_KEY, timeout=LEADER_TTL_SECONDS)
+        self.is_leader = False
+        self.last_track = None
+        self.last_published = None
+        self.predicted_change_at = None
+        self.etag = None
+        self.last_modified = None
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+        self.redis_client.publish(CONTROL_CHANNEL, "stop")
+
+    def run(self):
+        if not ACR_API_KEY or not ACR_API_URL:
+            logger.warning("CRITICAL: ACR_API_URL or ARC_API_BEARER_TOKEN are not set. ACR live polling is disabled.")
+            return
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(CONTROL_CHANNEL)
+        logger.info(f"ACR live poller started in worker {self.worker_id}")
+        try:
+            while not self.stopped.is_set():
+                try:
+                    if self._hold_leadership():
+                        self.poll_once()
+                except Exception as e:
+                    logger.error(f"ACR poller error: {e}")
+                self._wait(self.next_interval(), pubsub)
+        finally:
+            pubsub.close()
+            if self.is_leader:
+                try:
+                    self.leader_lock.release()
+                except Exception:
+                    pass
+
+    def _hold_leadership(self):
+        if self.is_leader:
+            try:
+                self.leader_lock.reacquire()
+                return True
+            except Exception:
+                logger.warning("ACR poller lost leadership")
+                self.is_leader = False
+        if self.leader_lock.acquire(blocking=False):
+            self.is_leader = True
+            logger.info(f"Worker {self.worker_id} is now the ACR poller leader")
+        return self.is_leader
+
+    def next_interval(self):
+        """
+        Seconds until the next poll.
+
+        The base interval is IDLE_POLL_SECONDS, or ALARM_POLL_SECONDS while an alarm boost
+        is active. When ACR told us how much of the current track is left, the next poll
+        lands exactly on the predicted change and polling stays at BOUNDARY_POLL_SECONDS
+        for BOUNDARY_WINDOW_SECONDS after it, since ACR needs a few seconds of the new
+        track before it can identify it.
+        """
+        now = time.time()
+        boost_until = self.redis_client.get(BOOST_UNTIL_KEY)
+        base = ALARM_POLL_SECONDS if boost_until and float(boost_until) > now else IDLE_POLL_SECONDS
+
+        change_at = self.predicted_change_at
+        if change_at is None or now >= change_at + BOUNDARY_WINDOW_SECONDS:
+            return base
+        if now >= change_at:
+            return min(base, BOUNDARY_POLL_SECONDS)
+        return max(min(base, change_at - now), MIN_POLL_SECONDS)
+
+    def _wait(self, seconds, pubsub):
+        """Sleep for the poll interval, waking early when a control message arrives."""
+        deadline = time.monotonic() + seconds
+        while not self.stopped.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if pubsub.get_message(timeout=remaining):
+                return
+
+    def fetch(self):
+        """
+        Fetch the live results. Sends the last ETag/Last-Modified so an unchanged result
+        comes back as a cheap 304, which is returned as NOT_MODIFIED.
+        """
+        headers = {
+            "Authorization": f"Bearer {ACR_API_KEY}",
+            "Accept": "application/json"
+        }
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        try:
+            response = self.session.get(ACR_API_URL, headers=headers, timeout=REQUEST_TIMEOUT_SECONDS)
+            if response.status_code == 304:
+                return NOT_MODIFIED
+            response.raise_for_status()
+            self.etag = response.headers.get("ETag")
+            self.last_modified = response.headers.get("Last-Modified")
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error fetching ACR live data: {e}")
+        except ValueError as e:
+            logger.error(f"Error decoding ACR live data: {e}")
+        return None
+
+    def poll_once(self):
+        live_data = self.fetch()
+        if live_data is None:
+            return None
+        now = time.time()
+        if live_data is NOT_MODIFIED:
+            if not self.last_published:
+                # Nothing to reuse (e.g. we just became leader); ask for a full answer next time.
+                self.etag = self.last_modified = None
+                return None
+            track = dict(self.last_published)
+            if track["play_offset_ms"] is not None:
+                track["play_offset_ms"] += int((now - track["fetched_at"]) * 1000)
+        else:
+            track_info = parse_live_data(live_data)
+            track = track_info.to_dict() if track_info else {
+                "artist": None, "title": None, "status": "no_result", "artists": [], "is_music": False,
+                "play_offset_ms": None, "duration_ms": None,
+            }
+
+        identity = (track["artist"], track["title"], track["status"])
+        changed = self.last_track is None or identity != self.last_track[0]
+        if changed:
+            self.last_track = (identity, now)
+            logger.info(f"ACR track changed: artist='{track['artist']}', title='{track['title']}', status='{track['status']}'")
+        track["fetched_at"] = now
+        track["changed_at"] = self.last_track[1]
+        track["changed"] = changed
+
+        # When did this track start and when should the next one begin?
+        if track["play_offset_ms"] is not None:
+            track["started_at"] = now - track["play_offset_ms"] / 1000.0
+        else:
+            track["started_at"] = track["changed_at"]
+        if track["is_music"] and track["play_offset_ms"] is not None and track["duration_ms"]:
+            track["predicted_end_at"] = now + max(track["duration_ms"] - track["play_offset_ms"], 0) / 1000.0
+        else:
+            track["predicted_end_at"] = None
+        self.predicted_change_at = track["predicted_end_at"]
+        self.last_published = track
+
+        payload = json.dumps(track)
+        pipeline = self.redis_client.pipeline()
+        pipeline.set(CURRENT_TRACK_KEY, payload, ex=CURRENT_TRACK_TTL_SECONDS)
+        pipeline.publish(TRACK_CHANNEL, payload)
+        pipeline.execute()
+        return track
+
+
+_poller = None
+_poller_lock = threading.Lock()
+_redis_client = None
+
+
+def _client():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = RedisContactManager().redis_client
+    return _redis_client
+
+
+def start_acr_poller():
+    """Start the poller thread for this worker (idempotent)."""
+    global _poller
+    with _poller_lock:
+        if _poller is None or not _poller.is_alive():
+            _poller = ACRLivePoller()
+            _poller.start()
+    return _poller
+
+
+def request_fast_polling(seconds=ALARM_BOOST_SECONDS):
+    """Tighten the poll schedule for the next `seconds`, e.g. right after an alarm."""
+    client = _client()
+    client.set(BOOST_UNTIL_KEY, time.time() + seconds, ex=seconds)
+    client.publish(CONTROL_CHANNEL, "boost")
+    logger.info(f"ACR fast polling requested for {seconds}s")
+
+
+async def request_fast_polling_async(seconds=ALARM_BOOST_SECONDS):
+    """request_fast_polling() for coroutines on the comp runtime."""
+    client = get_runtime().redis()
+    await client.set(BOOST_UNTIL_KEY, time.time() + seconds, ex=seconds)
+    await client.publish(CONTROL_CHANNEL, "boost")
+    logger.info(f"ACR fast polling requested for {seconds}s")
+
+
+def get_current_track():
+    """Return the last track published by the poller, or None."""
+    payload = _client().get(CURRENT_TRACK_KEY)
+    return json.loads(payload) if payload else None
+
+
+def _matches(track, predicate, since, started_since):
+    return (track is not None
+            and (since is None or track["fetched_at"] >= since)
+            and (started_since is None or track["started_at"] >= started_since)
+            and predicate(track))
+
+
+def wait_for_track(predicate, timeout, since=None, started_since=None):
+    """
+    Block until the poller publishes a track that satisfies predicate.
+
+    Args:
+        predicate (callable): Called with the track dict.
+        timeout (float): Maximum seconds to wait.
+        since (float): Only accept results fetched at or after this epoch time. Every poll
+            refetches the playing track, so this asks for a fresh result, not a new track.
+        started_since (float): Only accept tracks that started at or after this epoch time
+            (from ACR's play offset, else when the poller saw the track change).
+
+    Returns:
+        dict: The matching track, or None on timeout.
+    """
+    def matches(track):
+        return _matches(track, predicate, since, started_since)
+
+    deadline = time.monotonic() + timeout
+    pubsub = _client().pubsub(ignore_subscribe_messages=True)
+    # Subscribe before reading the key so nothing published in between is missed.
+    pubsub.subscribe(TRACK_CHANNEL)
+    try:
+        track = get_current_track()
+        if matches(track):
+            return track
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            message = pubsub.get_message(timeout=remaining)
+            if message is None:
+                continue
+            track = json.loads(message["data"])
+            if matches(track):
+                return track
+    finally:
+        pubsub.close()
+
+
+async def wait_for_track_async(predicate, timeout, since=None, started_since=None):
+    """wait_for_track() for coroutines on the comp runtime; waiting costs no thread."""
+    client = get_runtime().redis()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    # Subscribe before reading the key so nothing published in between is missed.
+    await pubsub.subscribe(TRACK_CHANNEL)
+    try:
+        payload = await client.get(CURRENT_TRACK_KEY)
+        track = json.loads(payload) if payload else None
+        if _matches(track, predicate, since, started_since):
+            return track
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            message = await pubsub.get_message(timeout=remaining)
+            if message is None:
+                continue
+            track = json.loads(message["data"])
+            if _matches(track, predicate, since, started_since):
+                return track
+    finally:
+        await pubsub.aclose()
@@ -0,0 +1,315 @@
+# LOCAL ALARM DETECTION ON THE LIVE STREAM.
+# ACRCloud's /callback arrives seconds after an alarm jingle plays on air, and that lag
+# comes out of the comps' "GO time" budget. The detector listens to the shared capture
+# (capture_hub.py) and matches the known jingles against it with FFT cross-correlation:
+# each template is the start of a jingle, zero-mean and unit-norm, and the stream is
+# scored with normalised cross-correlation every HOP_SECONDS. A match builds the same
+# payload ACRCloud would POST (the template's custom file fields) and hands it to
+# process_alarm; the later ACRCloud callback is then only a confirmation (its lead time
+# is recorded) and is dropped by process_alarm's per-comp dedupe. Only one worker runs
+# the detector, like the ACR poller.
+#
+# Templates live in ALARM_TEMPLATE_DIR next to a manifest.json:
+#   [{"file": "Alarm1.wav", "COMP_NAME": "...", "COMP_ID": "...", "ALARM_ID": "Alarm1"}, ...]
+# Every key except "file" is copied into the emitted custom file.
+#
+# Offline check against a recording:  python alarm_detector.py recording.mp3
+
+import argparse
+import json
+import os
+import subprocess
+import threading
+import time
+import uuid
+import wave
+
+import numpy as np
+
+import metrics
+from audio_profile import FFMPEG_PATH
+from capture_hub import SAMPLE_RATE, get_capture_hub
+from constants import ALARM_DETECTOR_ENABLED, ALARM_TEMPLATE_DIR, ALARM_MATCH_THRESHOLD, LIVE_STREAM_URL
+from logger import logger
+from redis_cache import RedisContactManager
+
+LOCAL_SOURCE = "local_alarm_detector"
+LEADER_KEY = "alarm_detector:leader"
+DETECTED_KEY = "alarm_detector:detected:{comp_name}"    # epoch of the last local detection per comp
+DETECTED_TTL_SECONDS = 180
+TEMPLATE_MAX_SECONDS = 2.0        # only the start of each jingle is matched
+HOP_SECONDS = 0.25
+REFIRE_SECONDS = 60               # ignore the same template for this long after a match
+LEADER_TTL_SECONDS = 60
+LEADER_CHECK_SECONDS = 10
+READ_TIMEOUT_SECONDS = 30
+
+
+def load_pcm(path):
+    """Audio file as float32 samples at SAMPLE_RATE mono (16-bit mono WAVs are read directly)."""
+    try:
+        with wave.open(path, "rb") as wav:
+            if wav.getframerate() == SAMPLE_RATE and wav.getnchannels() == 1 and wav.getsampwidth() == 2:
+                return np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2").astype(np.float32) / 32768.0
+    except (wave.Error, EOFError):
+        pass
+    result = subprocess.run(
+        [FFMPEG_PATH, "-v", "error", "-i", path, "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-"],
+        capture_output=True, check=True)
+    return pcm_to_float(result.stdout)
+
+
+def pcm_to_float(pcm):
+    return np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+
+
+class AlarmTemplate:
+    """The start of one jingle, zero-mean and unit-norm, plus the fields to emit on a match."""
+
+    def __init__(self, name, samples, fields):
+        samples = np.asarray(samples[:int(TEMPLATE_MAX_SECONDS * SAMPLE_RATE)], dtype=np.float64)
+        samples = samples - samples.mean()
+        norm = np.linalg.norm(samples)
+        if norm == 0:
+            raise ValueError(f"Alarm template {name} is silent")
+        self.name = name
+        self.samples = samples / norm
+        self.fields = fields
+
+    def __len__(self):
+        return len(self.samples)
+
+
+def load_templates(template_dir=ALARM_TEMPLATE_DIR):
+    with open(os.path.join(template_dir, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    templates = []
+    for entry in manifest:
+        fields = {key: value for key, value in entry.items() if key != "file"}
+        name = fields.get("ALARM_ID") or fields.get("alarm_id") or entry["file"]
+        templates.append(AlarmTemplate(name, load_pcm(os.path.join(template_dir, entry["file"])), fields))
+    return templates
+
+
+class AlarmDetector:
+    """
+    Streaming matcher: feed() PCM as it is captured and get back the matches it completed.
+
+    The last (longest template + one hop) of audio is kept; every hop the window is
+    correlated with each template in the frequency domain and scored at the hop's new
+    positions as corr / (template norm * window norm), i.e. normalised cross-correlation.
+    """
+
+    def __init__(self, templates, threshold=ALARM_MATCH_THRESHOLD, hop_seconds=HOP_SECONDS):
+        if not templates:
+            raise ValueError("AlarmDetector needs at least one template")
+        self.templates = templates
+        self.threshold = threshold
+        self.hop = int(hop_seconds * SAMPLE_RATE)
+        self.window_size = max(len(template) for template in templates) + self.hop
+        self.fft_size = 1 << (self.window_size - 1).bit_length()
+        self.template_spectra = [np.conj(np.fft.rfft(template.samples, self.fft_size)) for template in templates]
+        self.buffer = np.zeros(self.window_size, dtype=np.float64)
+        self.filled = 0
+        self.pending = np.zeros(0, dtype=np.float64)
+        self.samples_seen = 0                          # stream position of the buffer's end
+        self.last_fired = {}
+
+    def feed(self, samples):
+        """
+        Add captured samples (float, SAMPLE_RATE mono).
+
+        Returns:
+            list: (template, score, offset seconds into the fed audio where the match starts)
+        """
+        self.pending = np.concatenate([self.pending, samples])
+        matches = []
+        while len(self.pending) >= self.hop:
+            hop, self.pending = self.pending[:self.hop], self.pending[self.hop:]
+            self.buffer = np.concatenate([self.buffer[self.hop:], hop])
+            self.filled = min(self.filled + self.hop, self.window_size)
+            self.samples_seen += self.hop
+            if self.filled == self.window_size:
+                matches.extend(self._score())
+        return matches
+
+    def _score(self):
+        window = self.buffer
+        spectrum = np.fft.rfft(window, self.fft_size)
+        squares = np.concatenate([[0.0], np.cumsum(window * window)])
+        sums = np.concatenate([[0.0], np.cumsum(window)])
+        matches = []
+        for template, template_spectrum in zip(self.templates, self.template_spectra):
+            length = len(template)
+            last = self.window_size - length               # last start position in the window
+            first = max(0, last - self.hop + 1)            # positions completed by this hop
+            correlation = np.fft.irfft(spectrum * template_spectrum, self.fft_size)[first:last + 1]
+            starts = np.arange(first, last + 1)
+            segment_sums = sums[starts + length] - sums[starts]
+            energy = squares[starts + length] - squares[starts] - segment_sums * segment_sums / length
+            scores = correlation / np.sqrt(np.maximum(energy, 1e-12))
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+            if score < self.threshold:
+                continue
+            start = self.samples_seen - self.window_size + starts[best]
+            offset = float(start) / SAMPLE_RATE
+            if offset - self.last_fired.get(template.name, -REFIRE_SECONDS) < REFIRE_SECONDS:
+                continue
+            self.last_fired[template.name] = offset
+            matches.append((template, score, offset))
+        return matches
+
+
+def detection_payload(template, score):
+    """The callback body process_alarm expects, as ACRCloud would send it for this jingle."""
+    custom_file = dict(template.fields, score=round(score, 3), detected_at=time.time())
+    return {"source": LOCAL_SOURCE, "data": {"metadata": {"custom_files": [custom_file]}}}
+
+
+def confirm_detection(comp_name, redis_client=None):
+    """
+    Record an ACRCloud callback against the local detection of the same comp, if any.
+
+    Returns:
+        float: Seconds the local detection was ahead of the callback, or None.
+    """
+    if not ALARM_DETECTOR_ENABLED or not comp_name:
+        return None
+    client = redis_client or _client()
+    detected_at = client.get(DETECTED_KEY.format(comp_name=comp_name))
+    if detected_at is None:
+        metrics.incr("alarm_detector.missed")
+        logger.info(f"ACRCloud alarm for {comp_name} was not detected locally")
+        return None
+    lead = time.time() - float(detected_at)
+    metrics.incr("alarm_detector.confirmed")
+    metrics.observe("alarm_detector.lead_seconds", round(lead, 3))
+    logger.info(f"ACRCloud confirmed the local {comp_name} alarm detection {lead:.2f}s later")
+    return lead
+
+
+class AlarmDetectorThread(threading.Thread):
+    """Background thread; only the worker holding LEADER_KEY listens to the stream."""
+
+    def __init__(self, on_detect, stream_url=None, redis_client=None):
+        super().__init__(name="alarm-detector", daemon=True)
+        self.on_detect = on_detect
+        self.stream_url = stream_url or LIVE_STREAM_URL
+        self.redis_client = redis_client or RedisContactManager().redis_client
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.leader_lock = self.redis_client.lock(LEADER_KEY, timeout=LEADER_TTL_SECONDS)
+        self.is_leader = False
+        self.subscription = None
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        try:
+            detector = AlarmDetector(load_templates())
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            logger.error(f"Alarm detector disabled: could not load templates from {ALARM_TEMPLATE_DIR}: {e}")
+            return
+        logger.info(f"Alarm detector started in worker {self.worker_id} "
+                    f"({len(detector.templates)} templates, threshold {detector.threshold})")
+        last_check = 0.0
+        try:
+            while not self.stopped.is_set():
+                if time.monotonic() - last_check >= LEADER_CHECK_SECONDS:
+                    last_check = time.monotonic()
+                    if not self._hold_leadership():
+                        self._close_subscription()
+                        self.stopped.wait(LEADER_CHECK_SECONDS)
+                        continue
+                if self.subscription is None:
+                    self.subscription = get_capture_hub(self.stream_url).subscribe("alarm-detector")
+                pcm = self.subscription.read_seconds(HOP_SECONDS, timeout=READ_TIMEOUT_SECONDS)
+                for template, score, _ in detector.feed(pcm_to_float(pcm)):
+                    self._emit(template, score)
+        finally:
+            self._close_subscription()
+            if self.is_leader:
+                try:
+                    self.leader_lock.release()
+                except Exception:
+                    pass
+
+    def _hold_leadership(self):
+        if self.is_leader:
+            try:
+                self.leader_lock.reacquire()
+                return True
+            except Exception:
+                logger.warning("Alarm detector lost leadership")
+                self.is_leader = False
+        if self.leader_lock.acquire(blocking=False):
+            self.is_leader = True
+            logger.info(f"Worker {self.worker_id} is now the alarm detector")
+        return self.is_leader
+
+    def _close_subscription(self):
+        if self.subscription is not None:
+            self.subscription.close()
+            self.subscription = None
+
+    def _emit(self, template, score):
+        logger.info(f"Local alarm detection: {template.name} (score {score:.2f})")
+        metrics.incr("alarm_detector.detections")
+        comp_name = template.fields.get("COMP_NAME")
+        if comp_name:
+            self.redis_client.set(DETECTED_KEY.format(comp_name=comp_name), time.time(), ex=DETECTED_TTL_SECONDS)
+        try:
+            self.on_detect(detection_payload(template, score))
+        except Exception as e:
+            logger.error(f"Alarm detection handler failed for {template.name}: {e}")
+
+
+_detector = None
+_detector_lock = threading.Lock()
+_redis_client = None
+
+
+def _client():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = RedisContactManager().redis_client
+    return _redis_client
+
+
+def start_alarm_detector(on_detect):
+    """
+    Start the detector thread for this worker (idempotent; no-op unless ALARM_DETECTOR_ENABLED).
+
+    Args:
+        on_detect (callable): Called with the callback-style payload of every detection.
+    """
+    global _detector
+    if not ALARM_DETECTOR_ENABLED:
+        return None
+    if not LIVE_STREAM_URL:
+        logger.warning("CRITICAL: LIVE_STREAM_URL is not set. Local alarm detection is disabled.")
+        return None
+    with _detector_lock:
+        if _detector is None or not _detector.is_alive():
+            _detector = AlarmDetectorThread(on_detect)
+            _detector.start()
+    return _detector
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find alarm jingles in a recording")
+    parser.add_argument("recording")
+    parser.add_argument("--templates", default=ALARM_TEMPLATE_DIR)
+    parser.add_argument("--threshold", type=float, default=ALARM_MATCH_THRESHOLD)
+    args = parser.parse_args()
+
+    detector = AlarmDetector(load_templates(args.templates), threshold=args.threshold)
+    samples = load_pcm(args.recording)
+    for template, score, offset in detector.feed(samples):
+        print(f"{offset:9.2f}s  {template.name:12s} score {score:.3f}")
+
+
+if __name__ == "__main__":
+    main()
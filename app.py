@@ -12,17 +12,42 @@ import markdown
 from utilites import get_compname_alerts
 from handle_comp import run_comp
 from threading import Thread
+import uuid
+import metrics
+from llm_client import parse_failure_rates
+from client_cache import get_client_cache
+from acr_poller import start_acr_poller, request_fast_polling
+from outbox import start_outbox_delivery, dead_letters
+from alarm_detector import start_alarm_detector, confirm_detection, LOCAL_SOURCE
+from audio_archive import start_audio_archive
+from storage_manager import start_storage_manager
+from timing_history import TimingTuner, get_timing_history
+from comps.splash_sessions import get_session_manager
 
 
 # Initialize the RedisContactManager
 contact_manager = RedisContactManager()
 
+# Shared ACR live-metadata poller (only one worker actually polls)
+start_acr_poller()
+
+# Messaging server delivery from the Redis outbox (only one worker delivers)
+start_outbox_delivery()
+
+# Rolling on-disk archive of the live stream (only one worker writes it)
+start_audio_archive()
+
+# Retention and cleanup of recorded audio (only one worker sweeps)
+start_storage_manager()
+
 # Set up Flask app and ThreadPoolExecutor
 app = Flask(__name__)
 
 
 def process_alarm(data):
     logger.info(f"Started COMP PROCESSING")
+    # Tighten the shared ACR poll schedule right away; song based comps need it next.
+    request_fast_polling()
     logger.info(f"Received callback data: {data}")
     alert_data = get_compname_alerts(data)
     logger.info(f"Alert data: {alert_data}")
@@ -31,19 +56,27 @@ def process_alarm(data):
         return
     comp_alert = (alert_data["comp_name"], alert_data["alarm_id"])
     logger.info(f"Received callback data for comp: {comp_alert[0]}")
+    if isinstance(data, dict) and data.get("source") != LOCAL_SOURCE:
+        # An ACRCloud callback; record how far ahead the local detector was.
+        confirm_detection(comp_alert[0])
     logger.info(f"Alert type: {comp_alert[1]}")
     # SAVE THE COMP NAME SO THE ALARMS WONT PROCESSED AGAIN.
-    if contact_manager.redis_client.exists(comp_alert[0]):
+    # The key holds the id of the trigger that won it; comps dedupe their own work on that id.
+    trigger_id = uuid.uuid4().hex
+    if not contact_manager.redis_client.set(comp_alert[0], trigger_id, nx=True, ex=180):
         logger.info("This comp has already been processed cannot process process the comp after 120s")
         return
-    else:
-        contact_manager.redis_client.set(comp_alert[0],"processing",ex=180)
     if comp_alert[0] and comp_alert[1]:
-        run_comp(comp_name=comp_alert[0], alert_type=comp_alert[1])
+        run_comp(comp_name=comp_alert[0], alert_type=comp_alert[1], trigger_id=trigger_id)
     else:
         logger.error("Comp data is missing in the callback")
     logger.info(f"COMP PROCESSING COMPLETED")
 
+
+# Local alarm-jingle detection on the live stream (only one worker listens). It starts the
+# comp itself; the ACRCloud callback that follows confirms it and is deduplicated above.
+start_alarm_detector(lambda payload: Thread(target=process_alarm, args=(payload,)).start())
+
 @app.route('/')
 def test_route():
     logs_test_path = LOG_FILE_PATH
@@ -63,6 +96,54 @@ def test_route():
     return render_template('test.html', notes_html=notes_html, log_content=log_content)
 
 
+@app.route('/metrics')
+def metrics_route():
+    return jsonify(metrics.snapshot())
+
+
+@app.route('/metrics/llm')
+def llm_metrics_route():
+    return jsonify({"parse_failure_rate": parse_failure_rates()})
+
+
+@app.route('/metrics/cache')
+def client_cache_metrics_route():
+    return jsonify(get_client_cache().stats())
+
+
+@app.route('/metrics/timing')
+def timing_recommendations_route():
+    tuner = TimingTuner(get_timing_history())
+    return jsonify({comp: tuner.recommend(comp) for comp in get_timing_history().comps()})
+
+
+@app.route('/outbox/dead')
+def outbox_dead_letters_route():
+    return jsonify({"dead_letters": dead_letters(request.args.get("limit", 50, type=int))})
+
+
+@app.route('/splash/sessions')
+def splash_sessions_route():
+    manager = get_session_manager()
+    return jsonify({
+        "sessions": manager.list_sessions(limit=request.args.get("limit", 20, type=int)),
+        "active_in_worker": manager.active_sessions(),
+    })
+
+
+@app.route('/splash/sessions/<session_id>')
+def splash_session_route(session_id):
+    status = get_session_manager().get_status(session_id)
+    if not status:
+        return jsonify({'status': 'error', 'message': 'Unknown session'}), 404
+    return jsonify(status)
+
+
+@app.route('/splash/sessions/<session_id>/transcript')
+def splash_session_transcript_route(session_id):
+    return jsonify({"session_id": session_id, "segments": get_session_manager().get_transcript(session_id)})
+
+
 @app.route('/callback', methods=['POST'])
 def handle_callback():
     data = request.json
@@ -0,0 +1,298 @@
+# ROLLING AUDIO ARCHIVE OF THE LIVE STREAM.
+# One worker (leader-elected, like the ACR poller) writes the shared capture
+# (capture_hub.py) to disk as fixed-length raw PCM segments (16 kHz mono s16le) named
+# after the wall-clock time of their first sample, and deletes segments older than
+# AUDIO_ARCHIVE_RETENTION_MINUTES. The file names are the index: any worker on the host
+# can read the audio of a wall-clock range [t0, t1) by memory-mapping the segments that
+# overlap it, so a comp gets the pre-roll before its trigger instantly instead of only
+# hearing what plays after it starts its own recording.
+#
+# Dump a range (seconds ago) to a WAV:  python audio_archive.py 120 60 out.wav
+
+import argparse
+import bisect
+import mmap
+import os
+import threading
+import time
+import uuid
+import wave
+
+from capture_hub import SAMPLE_RATE, BYTES_PER_SECOND, get_capture_hub
+from constants import (AUDIO_ARCHIVE_ENABLED, AUDIO_ARCHIVE_DIR, AUDIO_ARCHIVE_RETENTION_MINUTES,
+                       AUDIO_ARCHIVE_PREROLL_SECONDS, LIVE_STREAM_URL)
+from logger import logger
+from redis_cache import RedisContactManager
+
+SEGMENT_SECONDS = 10
+SEGMENT_EXTENSION = ".pcm"
+BLOCK_SECONDS = 1.0
+MAX_DRIFT_SECONDS = 2.0          # start a new segment when sample time and wall clock disagree by more
+LEADER_KEY = "audio_archive:leader"
+LEADER_TTL_SECONDS = 60
+LEADER_CHECK_SECONDS = 10
+READ_TIMEOUT_SECONDS = 30
+WAIT_POLL_SECONDS = 0.5
+
+
+def segment_path(directory, start):
+    return os.path.join(directory, f"{int(round(start * 1000))}{SEGMENT_EXTENSION}")
+
+
+class AudioArchive:
+    """Read side of the archive: segments on disk, looked up by wall-clock time."""
+
+    def __init__(self, directory=AUDIO_ARCHIVE_DIR):
+        self.directory = directory
+
+    def segments(self):
+        """
+        Segments currently on disk, oldest first.
+
+        Returns:
+            list: (start epoch, end epoch, path) tuples; the newest may still be growing.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        segments = []
+        for name in names:
+            stem, extension = os.path.splitext(name)
+            if extension != SEGMENT_EXTENSION or not stem.isdigit():
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue            # pruned between listdir and stat
+            start = int(stem) / 1000
+            segments.append((start, start + (size // 2) / SAMPLE_RATE, path))
+        segments.sort()
+        return segments
+
+    def covered_until(self):
+        """Wall-clock end of the archived audio (0 if the archive is empty)."""
+        segments = self.segments()
+        return max((end for _, end, _ in segments), default=0.0)
+
+    def covers(self, t):
+        """True if audio from time t is on disk."""
+        segments = self.segments()
+        index = bisect.bisect_right([start for start, _, _ in segments], t) - 1
+        return index >= 0 and segments[index][1] > t
+
+    def read(self, t0, t1):
+        """
+        PCM for [t0, t1) as bytes; gaps (stream outages, not yet captured audio) are silence.
+        """
+        total = int((t1 - t0) * SAMPLE_RATE)
+        if total <= 0:
+            return b""
+        out = bytearray(total * 2)
+        for start, end, path in self.segments():
+            if end <= t0 or start >= t1:
+                continue
+            first = max(0, int(round((t0 - start) * SAMPLE_RATE)))
+            last = min(int(round((end - start) * SAMPLE_RATE)), int(round((t1 - start) * SAMPLE_RATE)))
+            target = int(round((start - t0) * SAMPLE_RATE)) + first
+            if target < 0:
+                first, target = first - target, 0
+            last = min(last, first + total - target)
+            if last <= first:
+                continue
+            try:
+                with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    chunk = mapped[first * 2:last * 2]
+            except (OSError, ValueError):
+                continue            # pruned or still empty
+            out[target * 2:target * 2 + len(chunk)] = chunk
+        return bytes(out)
+
+    def wait_until(self, t, timeout):
+        """Block until audio up to time t is archived; False on timeout."""
+        deadline = time.monotonic() + timeout
+        while self.covered_until() < t:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(WAIT_POLL_SECONDS)
+        return True
+
+    def save_wav(self, t0, t1, output_path, timeout=None):
+        """
+        Write [t0, t1) to a 16 kHz mono WAV, waiting up to timeout seconds (default: until
+        t1 plus READ_TIMEOUT_SECONDS) for audio that has not been captured yet.
+
+        Returns:
+            bool: True if the whole range was archived, False if it was padded with silence.
+        """
+        if timeout is None:
+            timeout = max(0.0, t1 - time.time()) + READ_TIMEOUT_SECONDS
+        complete = self.wait_until(t1, timeout)
+        with wave.open(output_path, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(SAMPLE_RATE)
+            wav.writeframes(self.read(t0, t1))
+        return complete
+
+
+def record_with_preroll(trigger_time, duration, output_path, preroll=AUDIO_ARCHIVE_PREROLL_SECONDS):
+    """
+    Save [trigger_time - preroll, trigger_time + duration) from the archive to a WAV.
+
+    Returns False (nothing written) if the archive does not hold the pre-roll, so the caller
+    can fall back to recording the stream itself.
+    """
+    if not AUDIO_ARCHIVE_ENABLED:
+        return False
+    archive = AudioArchive()
+    if not archive.covers(trigger_time - preroll):
+        logger.info("Audio archive does not cover the pre-roll; recording the stream directly")
+        return False
+    if not archive.save_wav(trigger_time - preroll, trigger_time + duration, output_path):
+        logger.warning(f"Audio archive fell behind; {output_path} is padded with silence")
+    return True
+
+
+class ArchiveWriter(threading.Thread):
+    """Background thread; only the worker holding LEADER_KEY writes the archive."""
+
+    def __init__(self, stream_url=None, directory=AUDIO_ARCHIVE_DIR, redis_client=None):
+        super().__init__(name="audio-archive", daemon=True)
+        self.stream_url = stream_url or LIVE_STREAM_URL
+        self.directory = directory
+        self.redis_client = redis_client or RedisContactManager().redis_client
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.leader_lock = self.redis_client.lock(LEADER_KEY, timeout=LEADER_TTL_SECONDS)
+        self.is_leader = False
+        self.subscription = None
+        self.segment = None            # open file of the current segment
+        self.segment_start = 0.0
+        self.segment_bytes = 0
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        logger.info(f"Audio archive writer started in worker {self.worker_id} ({self.directory})")
+        last_check = 0.0
+        try:
+            while not self.stopped.is_set():
+                if time.monotonic() - last_check >= LEADER_CHECK_SECONDS:
+                    last_check = time.monotonic()
+                    if not self._hold_leadership():
+                        self._close_subscription()
+                        self.stopped.wait(LEADER_CHECK_SECONDS)
+                        continue
+                if self.subscription is None:
+                    self.subscription = get_capture_hub(self.stream_url).subscribe("audio-archive")
+                pcm = self.subscription.read_seconds(BLOCK_SECONDS, timeout=READ_TIMEOUT_SECONDS)
+                if pcm:
+                    self.write(pcm, time.time())
+                else:
+                    self._close_segment()      # outage: the next audio starts a fresh segment
+        finally:
+            self._close_subscription()
+            if self.is_leader:
+                try:
+                    self.leader_lock.release()
+                except Exception:
+                    pass
+
+    def write(self, pcm, received_at):
+        """Append a block whose last sample was captured at received_at."""
+        block_start = received_at - len(pcm) / BYTES_PER_SECOND
+        if self.segment is not None:
+            expected = self.segment_start + self.segment_bytes / BYTES_PER_SECOND
+            if abs(expected - block_start) > MAX_DRIFT_SECONDS:
+                self._close_segment()          # stream reconnected or the reader stalled
+        while pcm:
+            if self.segment is None:
+                self._open_segment(block_start)
+            room = SEGMENT_SECONDS * BYTES_PER_SECOND - self.segment_bytes
+            self.segment.write(pcm[:room])
+            self.segment.flush()
+            self.segment_bytes += len(pcm[:room])
+            block_start += len(pcm[:room]) / BYTES_PER_SECOND
+            pcm = pcm[room:]
+            if self.segment_bytes >= SEGMENT_SECONDS * BYTES_PER_SECOND:
+                self._close_segment()
+
+    def _open_segment(self, start):
+        self.segment = open(segment_path(self.directory, start), "wb")
+        self.segment_start = start
+        self.segment_bytes = 0
+        self.prune()
+
+    def _close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def prune(self):
+        """Delete segments that ended before the retention window."""
+        cutoff = time.time() - AUDIO_ARCHIVE_RETENTION_MINUTES * 60
+        for _, end, path in AudioArchive(self.directory).segments():
+            if end < cutoff:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _hold_leadership(self):
+        if self.is_leader:
+            try:
+                self.leader_lock.reacquire()
+                return True
+            except Exception:
+                logger.warning("Audio archive writer lost leadership")
+                self.is_leader = False
+                self._close_segment()
+        if self.leader_lock.acquire(blocking=False):
+            self.is_leader = True
+            logger.info(f"Worker {self.worker_id} is now the audio archive writer")
+        return self.is_leader
+
+    def _close_subscription(self):
+        self._close_segment()
+        if self.subscription is not None:
+            self.subscription.close()
+            self.subscription = None
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def start_audio_archive():
+    """Start the archive writer thread for this worker (idempotent; no-op unless AUDIO_ARCHIVE_ENABLED)."""
+    global _writer
+    if not AUDIO_ARCHIVE_ENABLED:
+        return None
+    if not LIVE_STREAM_URL:
+        logger.warning("CRITICAL: LIVE_STREAM_URL is not set. The audio archive is disabled.")
+        return None
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = ArchiveWriter()
+            _writer.start()
+    return _writer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a range of the audio archive to a WAV file")
+    parser.add_argument("seconds_ago", type=float, help="start of the range, in seconds before now")
+    parser.add_argument("duration", type=float)
+    parser.add_argument("output")
+    parser.add_argument("--directory", default=AUDIO_ARCHIVE_DIR)
+    args = parser.parse_args()
+    t0 = time.time() - args.seconds_ago
+    complete = AudioArchive(args.directory).save_wav(t0, t0 + args.duration, args.output, timeout=0)
+    print(f"Wrote {args.output}" + ("" if complete else " (partly silence: range not fully archived)"))
+
+
+if __name__ == "__main__":
+    main()
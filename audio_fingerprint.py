@@ -0,0 +1,212 @@
+# LANDMARK FINGERPRINTS FOR RECURRING STATION AUDIO (BEDS, STINGS).
+# A fingerprint is a pair of spectral peaks (f1, f2, frames between them) packed into one
+# integer. Reference recordings (e.g. the bed music and stings that open a comp segment)
+# are fingerprinted once into an index file; live audio is fingerprinted in short windows
+# and looked up in the index. A reference is recognised when many fingerprints agree on
+# the same time alignment, which holds up to talk-over and stream encoding far better than
+# comparing raw samples, and costs a few milliseconds per window.
+#
+#   python audio_fingerprint.py build segment_markers/splash segment_markers/splash_index.npz
+#   python audio_fingerprint.py match segment_markers/splash_index.npz recording.mp3
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from alarm_detector import load_pcm
+from capture_hub import SAMPLE_RATE
+
+FRAME_SIZE = 1024
+FRAME_HOP = 512                    # 32 ms per frame at 16 kHz
+PEAK_BINS = (8, 256)               # FFT bins searched for peaks: 125 Hz to 4 kHz
+PEAK_TIME_RADIUS = 5               # a peak is the maximum of +-5 frames ...
+PEAK_FREQ_RADIUS = 10              # ... and +-10 bins around it
+PEAK_MIN_RATIO = 4.0               # and this many times its frame's median magnitude
+TARGET_FRAMES = 32                 # pair each peak with peaks up to ~1 s later
+FAN_OUT = 5
+MIN_ALIGNED = 12                   # fingerprints agreeing on one alignment needed for a match
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac")
+
+
+def frame_seconds(frames):
+    return frames * FRAME_HOP / SAMPLE_RATE
+
+
+def fingerprints(samples):
+    """
+    Fingerprints of mono float samples at SAMPLE_RATE.
+
+    Returns:
+        tuple: (hashes uint32 array, anchor frame int array)
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if len(samples) < FRAME_SIZE:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int64)
+    count = 1 + (len(samples) - FRAME_SIZE) // FRAME_HOP
+    frames = np.lib.stride_tricks.as_strided(
+        samples, shape=(count, FRAME_SIZE), strides=(samples.strides[0] * FRAME_HOP, samples.strides[0]))
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE).astype(np.float32), axis=1))
+    spectrum = spectrum[:, PEAK_BINS[0]:PEAK_BINS[1]]
+    floor = np.median(spectrum, axis=1, keepdims=True) * PEAK_MIN_RATIO + 1e-9
+
+    # Local maxima of the spectrogram (separable max filter); sustained tones give one
+    # peak per neighbourhood instead of one per frame.
+    neighbourhood = _max_filter(_max_filter(spectrum, PEAK_FREQ_RADIUS, axis=1), PEAK_TIME_RADIUS, axis=0)
+    peak_frames, peak_bins = np.nonzero((spectrum == neighbourhood) & (spectrum > floor))
+    peak_bins = peak_bins + PEAK_BINS[0]
+
+    hashes, anchors = [], []
+    for i in range(len(peak_frames)):
+        paired = 0
+        for j in range(i + 1, len(peak_frames)):
+            dt = peak_frames[j] - peak_frames[i]
+            if dt == 0:
+                continue
+            if dt > TARGET_FRAMES or paired == FAN_OUT:
+                break
+            hashes.append((int(peak_bins[i]) << 18) | (int(peak_bins[j]) << 9) | int(dt))
+            anchors.append(peak_frames[i])
+            paired += 1
+    return np.asarray(hashes, dtype=np.uint32), np.asarray(anchors, dtype=np.int64)
+
+
+def _max_filter(values, radius, axis):
+    padded = np.moveaxis(values, axis, 0)
+    result = padded.copy()
+    for shift in range(1, radius + 1):
+        result[shift:] = np.maximum(result[shift:], padded[:-shift])
+        result[:-shift] = np.maximum(result[:-shift], padded[shift:])
+    return np.moveaxis(result, 0, axis)
+
+
+class FingerprintIndex:
+    """Fingerprints of the reference recordings, sorted by hash for lookup."""
+
+    def __init__(self, names, hashes, references, frames):
+        self.names = list(names)
+        order = np.argsort(hashes, kind="stable")
+        self.hashes = np.asarray(hashes, dtype=np.uint32)[order]
+        self.references = np.asarray(references, dtype=np.int32)[order]
+        self.frames = np.asarray(frames, dtype=np.int64)[order]
+
+    @classmethod
+    def build(cls, recordings):
+        """recordings: {name: float samples}."""
+        names, hashes, references, frames = [], [], [], []
+        for reference, (name, samples) in enumerate(recordings.items()):
+            reference_hashes, reference_frames = fingerprints(samples)
+            names.append(name)
+            hashes.append(reference_hashes)
+            references.append(np.full(len(reference_hashes), reference))
+            frames.append(reference_frames)
+        return cls(names, np.concatenate(hashes), np.concatenate(references), np.concatenate(frames))
+
+    @classmethod
+    def build_from_directory(cls, directory):
+        recordings = {}
+        for filename in sorted(os.listdir(directory)):
+            if filename.lower().endswith(AUDIO_EXTENSIONS):
+                recordings[os.path.splitext(filename)[0]] = load_pcm(os.path.join(directory, filename))
+        if not recordings:
+            raise ValueError(f"No reference recordings in {directory}")
+        return cls.build(recordings)
+
+    def save(self, path):
+        np.savez_compressed(path, names=json.dumps(self.names), hashes=self.hashes,
+                            references=self.references, frames=self.frames)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(json.loads(str(data["names"])), data["hashes"], data["references"], data["frames"])
+
+    def match(self, samples):
+        """
+        Best reference in samples.
+
+        Returns:
+            tuple: (name, aligned fingerprint count, seconds into samples where the
+            reference starts; negative if it started before them), or None.
+        """
+        query_hashes, query_frames = fingerprints(samples)
+        if not len(query_hashes):
+            return None
+        left = np.searchsorted(self.hashes, query_hashes, side="left")
+        right = np.searchsorted(self.hashes, query_hashes, side="right")
+        hits = right - left
+        if not hits.any():
+            return None
+        positions = np.concatenate([np.arange(l, r) for l, r in zip(left, right) if r > l])
+        query_at = np.repeat(query_frames, hits)
+        alignment = query_at - self.frames[positions]
+        keys, counts = np.unique(np.stack([self.references[positions], alignment]), axis=1, return_counts=True)
+        best = int(np.argmax(counts))
+        if counts[best] < MIN_ALIGNED:
+            return None
+        reference, frame = keys[:, best]
+        return self.names[int(reference)], int(counts[best]), frame_seconds(int(frame))
+
+
+class SegmentStartDetector:
+    """
+    Streaming recogniser: feed() captured audio, get the first reference heard.
+
+    Audio is matched in windows of window_seconds every step_seconds.
+    """
+
+    def __init__(self, index, window_seconds=6.0, step_seconds=1.0):
+        self.index = index
+        self.window = int(window_seconds * SAMPLE_RATE)
+        self.step = int(step_seconds * SAMPLE_RATE)
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.samples_seen = 0
+        self.since_match = 0
+
+    def feed(self, samples):
+        """
+        Returns:
+            tuple: (name, score, stream seconds where the reference starts) or None.
+        """
+        self.buffer = np.concatenate([self.buffer, samples])[-self.window:]
+        self.samples_seen += len(samples)
+        self.since_match += len(samples)
+        if self.since_match < self.step:
+            return None
+        self.since_match = 0
+        match = self.index.match(self.buffer)
+        if match is None:
+            return None
+        name, score, offset = match
+        window_start = (self.samples_seen - len(self.buffer)) / SAMPLE_RATE
+        return name, score, window_start + offset
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query a fingerprint index of reference recordings")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build")
+    build.add_argument("directory")
+    build.add_argument("index")
+    match = commands.add_parser("match")
+    match.add_argument("index")
+    match.add_argument("recording")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = FingerprintIndex.build_from_directory(args.directory)
+        index.save(args.index)
+        print(f"Indexed {len(index.names)} recordings ({len(index.hashes)} fingerprints) into {args.index}")
+        return
+    detector = SegmentStartDetector(FingerprintIndex.load(args.index))
+    samples = load_pcm(args.recording)
+    for start in range(0, len(samples), detector.step):
+        found = detector.feed(samples[start:start + detector.step])
+        if found:
+            print(f"{found[2]:9.2f}s  {found[0]} (score {found[1]})")
+            detector.since_match = -int(30 * SAMPLE_RATE)    # report each occurrence once
+
+
+if __name__ == "__main__":
+    main()
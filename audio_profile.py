@@ -0,0 +1,107 @@
+# AUDIO PROFILES USED BY EVERY RECORDER.
+# Whisper resamples everything to 16 kHz mono internally, so recording 44.1 kHz stereo
+# only makes the uploads bigger. A profile decides the sample rate, channels and codec
+# used when capturing and encoding, selected with AUDIO_PROFILE.
+
+import subprocess
+
+from constants import AUDIO_PROFILE
+from logger import logger
+
+FFMPEG_PATH = "/usr/bin/ffmpeg"
+
+
+class AudioProfile:
+    def __init__(self, name, sample_rate, channels, codec, bitrate, extension):
+        self.name = name
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.codec = codec
+        self.bitrate = bitrate
+        self.extension = extension
+
+    @property
+    def bytes_per_second(self):
+        """Bytes per second of raw 16 bit PCM at this profile's rate and channels."""
+        return self.sample_rate * self.channels * 2
+
+    def capture_args(self):
+        """ffmpeg output arguments for a raw PCM WAV capture."""
+        return [
+            "-acodec", "pcm_s16le",
+            "-ar", str(self.sample_rate),
+            "-ac", str(self.channels),
+        ]
+
+    def encode_args(self):
+        """ffmpeg output arguments for the compressed upload format."""
+        return [
+            "-codec:a", self.codec,
+            "-b:a", self.bitrate,
+            "-ar", str(self.sample_rate),
+            "-ac", str(self.channels),
+        ]
+
+    def __repr__(self):
+        return f"AudioProfile({self.name}: {self.sample_rate}Hz, {self.channels}ch, {self.codec} {self.bitrate})"
+
+
+PROFILES = {
+    # Default: what Whisper actually uses, at a speech friendly bitrate.
+    "speech_mp3": AudioProfile("speech_mp3", 16000, 1, "libmp3lame", "32k", "mp3"),
+    "speech_opus": AudioProfile("speech_opus", 16000, 1, "libopus", "24k", "ogg"),
+    # The original recording settings, kept for comparison and debugging.
+    "broadcast": AudioProfile("broadcast", 44100, 2, "libmp3lame", "128k", "mp3"),
+}
+DEFAULT_PROFILE = "speech_mp3"
+
+
+def get_audio_profile(name=None):
+    """Return the named profile, or the one configured with AUDIO_PROFILE."""
+    name = name or AUDIO_PROFILE or DEFAULT_PROFILE
+    profile = PROFILES.get(name)
+    if profile is None:
+        logger.warning(f"Unknown audio profile '{name}', using {DEFAULT_PROFILE}")
+        profile = PROFILES[DEFAULT_PROFILE]
+    return profile
+
+
+def record_stream(stream_url, duration, output_path, profile=None, raw=False, timeout=None):
+    """
+    Record a live stream straight into the profile's format.
+
+    Args:
+        stream_url (str): Stream to capture.
+        duration (int): Seconds to record.
+        output_path (str): Destination file.
+        raw (bool): Capture raw PCM WAV instead of the compressed format.
+        timeout (int): subprocess timeout, defaults to duration + 60.
+
+    Returns:
+        subprocess.CompletedProcess
+    """
+    profile = profile or get_audio_profile()
+    command = [
+        FFMPEG_PATH, "-y",
+        "-i", stream_url,
+        "-t", str(duration),
+        *(profile.capture_args() if raw else profile.encode_args()),
+        "-loglevel", "error",
+        output_path,
+    ]
+    logger.info(f"Running ffmpeg command: {' '.join(command)}")
+    return subprocess.run(command, capture_output=True, text=True, timeout=timeout or duration + 60)
+
+
+def encode_file(source_path, output_path, profile=None):
+    """Encode an existing recording into the profile's upload format."""
+    profile = profile or get_audio_profile()
+    command = [
+        FFMPEG_PATH, "-y",
+        "-i", source_path,
+        *profile.encode_args(),
+        "-loglevel", "error",
+        output_path,
+    ]
+    subprocess.run(command, check=True, capture_output=True)
+    return output_path
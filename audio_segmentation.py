@@ -0,0 +1,249 @@
+# SPEECH / MUSIC SEGMENTATION USED BEFORE TRANSCRIPTION.
+# Radio audio is mostly music and adverts; only the presenter's speech matters to the
+# comps, so we classify the captured PCM frame by frame and cut out the speech regions
+# before anything is uploaded to Whisper.
+
+import os
+import subprocess
+
+import numpy as np
+
+from audio_profile import FFMPEG_PATH, get_audio_profile
+from comp_runtime import run_process
+from constants import SPEECH_FILTER_ENABLED
+from logger import logger
+
+SAMPLE_RATE = 16000
+FRAME_MS = 25                 # analysis frame length
+HOP_MS = 10                   # analysis frame hop
+WINDOW_SECONDS = 1.0          # context window used for the speech/music features
+
+SILENCE_DB = -50.0            # frames quieter than this (dBFS) are never speech
+LSTER_THRESHOLD = 0.15        # low short-time energy ratio typical for speech
+HZCRR_THRESHOLD = 0.10        # high zero-crossing rate ratio typical for speech
+SPEECH_SCORE_THRESHOLD = 1.0  # combined score above which a frame counts as speech
+
+MIN_SPEECH_SECONDS = 0.6      # drop speech islands shorter than this
+MERGE_GAP_SECONDS = 0.8       # join speech regions separated by less than this
+PAD_SECONDS = 0.3             # keep a little context around every region
+
+
+class SpeechRegions:
+    """
+    Speech regions found in an audio file, in seconds of the original audio.
+
+    The speech-only file is the regions concatenated back to back, so offsets in
+    that file can be mapped back to the original recording with to_source_time().
+    """
+
+    def __init__(self, regions, source_duration):
+        self.regions = [(float(start), float(end)) for start, end in regions]
+        self.source_duration = float(source_duration)
+        durations = np.array([end - start for start, end in self.regions], dtype=np.float64)
+        # Output time at which each region starts in the speech-only file.
+        self.output_starts = np.concatenate(([0.0], np.cumsum(durations)[:-1])) if len(durations) else np.array([])
+        self.speech_duration = float(durations.sum()) if len(durations) else 0.0
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __iter__(self):
+        return iter(self.regions)
+
+    @property
+    def speech_ratio(self):
+        if not self.source_duration:
+            return 0.0
+        return self.speech_duration / self.source_duration
+
+    def to_source_time(self, output_seconds):
+        """Map a time in the speech-only audio back to the original recording."""
+        if not self.regions:
+            return None
+        index = int(np.searchsorted(self.output_starts, output_seconds, side="right")) - 1
+        index = max(index, 0)
+        start, end = self.regions[index]
+        return min(start + (output_seconds - self.output_starts[index]), end)
+
+    def __repr__(self):
+        return (f"SpeechRegions({len(self.regions)} regions, {self.speech_duration:.1f}s speech "
+                f"of {self.source_duration:.1f}s)")
+
+
+def decode_pcm(file_path, sample_rate=SAMPLE_RATE):
+    """Decode any audio file to mono int16 PCM at sample_rate using ffmpeg."""
+    command = [
+        FFMPEG_PATH,
+        "-i", file_path,
+        "-f", "s16le",
+        "-acodec", "pcm_s16le",
+        "-ac", "1",
+        "-ar", str(sample_rate),
+        "-loglevel", "error",
+        "pipe:1",
+    ]
+    result = subprocess.run(command, capture_output=True, check=True)
+    return np.frombuffer(result.stdout, dtype=np.int16)
+
+
+def _encode_pcm_command(file_path, sample_rate, profile):
+    return [
+        FFMPEG_PATH, "-y",
+        "-f", "s16le",
+        "-ac", "1",
+        "-ar", str(sample_rate),
+        "-i", "pipe:0",
+        *profile.encode_args(),
+        "-loglevel", "error",
+        file_path,
+    ]
+
+
+def encode_pcm(samples, file_path, sample_rate=SAMPLE_RATE, profile=None):
+    """Encode mono int16 samples straight to the upload profile without a temporary WAV."""
+    command = _encode_pcm_command(file_path, sample_rate, profile or get_audio_profile())
+    subprocess.run(command, input=np.ascontiguousarray(samples, dtype=np.int16).tobytes(),
+                   capture_output=True, check=True)
+
+
+async def encode_pcm_async(samples, file_path, sample_rate=SAMPLE_RATE, profile=None):
+    """encode_pcm() for the comp runtime: ffmpeg runs without blocking the event loop."""
+    command = _encode_pcm_command(file_path, sample_rate, profile or get_audio_profile())
+    returncode, _, stderr = await run_process(*command, input=np.ascontiguousarray(samples, dtype=np.int16).tobytes())
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, stderr=stderr)
+
+
+def _frame(samples, frame_length, hop_length):
+    """Return a (n_frames, frame_length) strided view over the samples."""
+    if len(samples) < frame_length:
+        samples = np.pad(samples, (0, frame_length - len(samples)))
+    return np.lib.stride_tricks.sliding_window_view(samples, frame_length)[::hop_length]
+
+
+def _windowed(values, window_frames):
+    """(n_frames, window_frames) view of a per-frame feature centred on each frame."""
+    half = window_frames // 2
+    padded = np.pad(values, (half, window_frames - half - 1), mode="edge")
+    return np.lib.stride_tricks.sliding_window_view(padded, window_frames)
+
+
+def classify_frames(samples, sample_rate=SAMPLE_RATE):
+    """
+    Classify every analysis frame as speech (True) or not speech (False).
+
+    Uses the classic speech/music discriminators computed over a one second context:
+    the low short-time energy ratio (speech has frequent pauses between syllables) and
+    the high zero-crossing rate ratio (speech alternates voiced and unvoiced sounds),
+    boosted by spectral flux variance. Everything is vectorised over frames.
+
+    Returns:
+        np.ndarray: boolean array with one entry per hop.
+    """
+    frame_length = int(sample_rate * FRAME_MS / 1000)
+    hop_length = int(sample_rate * HOP_MS / 1000)
+    frames = _frame(samples.astype(np.float32) / 32768.0, frame_length, hop_length)
+
+    energy = np.mean(frames ** 2, axis=1) + 1e-10
+    energy_db = 10.0 * np.log10(energy)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frame_length
+
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(frame_length), axis=1))
+    spectrum /= spectrum.sum(axis=1, keepdims=True) + 1e-10
+    flux = np.concatenate(([0.0], np.sum(np.diff(spectrum, axis=0) ** 2, axis=1)))
+
+    window_frames = max(int(WINDOW_SECONDS * 1000 / HOP_MS), 1)
+    energy_windows = _windowed(energy, window_frames)
+    zcr_windows = _windowed(zcr, window_frames)
+    flux_windows = _windowed(flux, window_frames)
+
+    lster = np.mean(energy_windows < 0.5 * energy_windows.mean(axis=1, keepdims=True), axis=1)
+    hzcrr = np.mean(zcr_windows > 1.5 * zcr_windows.mean(axis=1, keepdims=True), axis=1)
+    flux_var = flux_windows.std(axis=1)
+    flux_boost = flux_var / (np.median(flux_var) + 1e-10)
+
+    score = (lster / LSTER_THRESHOLD + hzcrr / HZCRR_THRESHOLD) / 2.0
+    score *= np.clip(flux_boost, 0.5, 1.5)
+    return (score >= SPEECH_SCORE_THRESHOLD) & (energy_db > SILENCE_DB)
+
+
+def frames_to_regions(is_speech, hop_seconds=HOP_MS / 1000.0, total_seconds=None):
+    """Turn a per-frame boolean mask into merged, padded (start, end) regions in seconds."""
+    edges = np.diff(np.concatenate(([0], is_speech.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * hop_seconds
+    ends = np.flatnonzero(edges == -1) * hop_seconds
+    if not len(starts):
+        return []
+
+    # Merge regions separated by short gaps, then drop islands that are too short.
+    keep_gap = (starts[1:] - ends[:-1]) >= MERGE_GAP_SECONDS
+    group_starts = starts[np.concatenate(([True], keep_gap))]
+    group_ends = ends[np.concatenate((keep_gap, [True]))]
+    long_enough = (group_ends - group_starts) >= MIN_SPEECH_SECONDS
+    group_starts = np.maximum(group_starts[long_enough] - PAD_SECONDS, 0.0)
+    group_ends = group_ends[long_enough] + PAD_SECONDS
+    if total_seconds is not None:
+        group_ends = np.minimum(group_ends, total_seconds)
+
+    regions = []
+    for start, end in zip(group_starts, group_ends):
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    return regions
+
+
+def find_speech_regions(samples, sample_rate=SAMPLE_RATE):
+    """Return SpeechRegions for mono int16 samples."""
+    total_seconds = len(samples) / sample_rate
+    is_speech = classify_frames(samples, sample_rate)
+    regions = frames_to_regions(is_speech, HOP_MS / 1000.0, total_seconds)
+    return SpeechRegions(regions, total_seconds)
+
+
+def extract_speech(file_path, output_path=None, sample_rate=SAMPLE_RATE):
+    """
+    Cut the speech regions out of an audio file.
+
+    Args:
+        file_path (str): Recorded audio chunk.
+        output_path (str): Where to write the speech-only audio. Defaults to
+            '<file_path without extension>_speech.<profile extension>'.
+
+    Returns:
+        tuple: (speech_file_path or None when no speech was found, SpeechRegions)
+    """
+    samples = decode_pcm(file_path, sample_rate)
+    regions = find_speech_regions(samples, sample_rate)
+    if not len(regions):
+        return None, regions
+
+    pieces = [samples[int(start * sample_rate):int(end * sample_rate)] for start, end in regions]
+    profile = get_audio_profile()
+    output_path = output_path or f"{os.path.splitext(file_path)[0]}_speech.{profile.extension}"
+    encode_pcm(np.concatenate(pieces), output_path, sample_rate, profile)
+
+    logger.info(f"Speech segmentation for {os.path.basename(file_path)}: {regions!r}, "
+                f"kept {regions.speech_ratio:.0%}, {os.path.getsize(output_path)} bytes "
+                f"(source {os.path.getsize(file_path)} bytes)")
+    return output_path, regions
+
+
+def prepare_for_transcription(file_path):
+    """
+    Pick the file that should actually be transcribed for a recorded chunk.
+
+    Returns:
+        tuple: (path, SpeechRegions or None). path is None when the chunk holds no
+        speech at all. When segmentation is disabled or fails the original file is
+        returned unchanged so transcription never gets worse than before.
+    """
+    if not SPEECH_FILTER_ENABLED:
+        return file_path, None
+    try:
+        return extract_speech(file_path)
+    except Exception as e:
+        logger.warning(f"Speech segmentation failed for {file_path}, using full audio: {e}")
+        return file_path, None
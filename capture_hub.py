@@ -0,0 +1,188 @@
+# SHARED LIVE-STREAM CAPTURE.
+# One ffmpeg process per stream decodes the live audio to 16 kHz mono PCM and a reader
+# thread fans every block out to the subscribed sessions. Overlapping detection
+# sessions therefore share one connection to the stream instead of each running their
+# own ffmpeg, and a session never misses audio while it is busy transcribing: blocks
+# queue up in its subscription until it reads them.
+
+import asyncio
+import queue
+import subprocess
+import threading
+import time
+
+from audio_profile import FFMPEG_PATH
+from logger import logger
+
+SAMPLE_RATE = 16000
+BYTES_PER_SECOND = SAMPLE_RATE * 2            # mono int16
+BLOCK_BYTES = BYTES_PER_SECOND // 10          # 100 ms per block
+RESTART_DELAY_SECONDS = 2                     # pause before reconnecting after the stream drops
+
+
+class CaptureSubscription:
+    """One session's view of a CaptureHub: a queue of PCM blocks."""
+
+    def __init__(self, hub, name):
+        self.hub = hub
+        self.name = name
+        self.blocks = queue.Queue()
+        self._pending = b""
+        self.closed = False
+
+    def read_seconds(self, seconds, timeout=None):
+        """
+        Return the next `seconds` of PCM as bytes, blocking until it has been captured.
+
+        Returns fewer bytes if nothing arrives for `timeout` seconds (default: the
+        requested duration + 60) or the subscription is closed.
+        """
+        wanted = int(seconds * BYTES_PER_SECOND) & ~1
+        timeout = timeout if timeout is not None else seconds + 60
+        parts, size = [self._pending], len(self._pending)
+        while size < wanted and not self.closed:
+            try:
+                block = self.blocks.get(timeout=timeout)
+            except queue.Empty:
+                logger.warning(f"Capture subscription '{self.name}' got no audio for {timeout}s")
+                break
+            if block is None:
+                break
+            parts.append(block)
+            size += len(block)
+        data = b"".join(parts)
+        self._pending = data[wanted:]
+        return data[:wanted]
+
+    def put(self, block):
+        """Called from the hub's reader thread for every captured block."""
+        self.blocks.put(block)
+
+    def close(self):
+        self.closed = True
+        self.hub.unsubscribe(self)
+        self.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncCaptureSubscription(CaptureSubscription):
+    """A subscription read from coroutines on an event loop (see comp_runtime.py)."""
+
+    def __init__(self, hub, name, loop):
+        super().__init__(hub, name)
+        self.loop = loop
+        self.blocks = asyncio.Queue()
+
+    async def read_seconds(self, seconds, timeout=None):
+        wanted = int(seconds * BYTES_PER_SECOND) & ~1
+        timeout = timeout if timeout is not None else seconds + 60
+        parts, size = [self._pending], len(self._pending)
+        while size < wanted and not self.closed:
+            try:
+                block = await asyncio.wait_for(self.blocks.get(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Capture subscription '{self.name}' got no audio for {timeout}s")
+                break
+            if block is None:
+                break
+            parts.append(block)
+            size += len(block)
+        data = b"".join(parts)
+        self._pending = data[wanted:]
+        return data[:wanted]
+
+    def put(self, block):
+        self.loop.call_soon_threadsafe(self.blocks.put_nowait, block)
+
+
+class CaptureHub:
+    """Runs ffmpeg for one stream while at least one subscription is open."""
+
+    def __init__(self, stream_url):
+        self.stream_url = stream_url
+        self.subscriptions = []
+        self.process = None
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, name, loop=None):
+        """Open a subscription; pass the event loop to read it from coroutines."""
+        if loop is not None:
+            subscription = AsyncCaptureSubscription(self, name, loop)
+        else:
+            subscription = CaptureSubscription(self, name)
+        with self._lock:
+            self.subscriptions.append(subscription)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="capture-hub", daemon=True)
+                self.thread.start()
+        logger.info(f"Capture subscription '{name}' added ({len(self.subscriptions)} active) for {self.stream_url}")
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+            if not self.subscriptions and self.process:
+                # Last listener gone: stop capturing.
+                self.process.terminate()
+        logger.info(f"Capture subscription '{subscription.name}' removed ({len(self.subscriptions)} active)")
+
+    def _start_process(self):
+        command = [
+            FFMPEG_PATH,
+            "-i", self.stream_url,
+            "-f", "s16le",
+            "-acodec", "pcm_s16le",
+            "-ac", "1",
+            "-ar", str(SAMPLE_RATE),
+            "-loglevel", "error",
+            "pipe:1",
+        ]
+        logger.info(f"Starting shared capture: {' '.join(command)}")
+        return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self.subscriptions:
+                    self.process = self.thread = None
+                    return
+                self.process = self._start_process()
+                process = self.process
+            try:
+                while True:
+                    block = process.stdout.read(BLOCK_BYTES)
+                    if not block:
+                        break
+                    with self._lock:
+                        subscriptions = list(self.subscriptions)
+                    for subscription in subscriptions:
+                        subscription.put(block)
+            finally:
+                process.stdout.close()
+                process.wait()
+            with self._lock:
+                if not self.subscriptions:
+                    self.process = self.thread = None
+                    return
+            logger.warning(f"Shared capture of {self.stream_url} stopped (code {process.returncode}). Reconnecting.")
+            time.sleep(RESTART_DELAY_SECONDS)
+
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def get_capture_hub(stream_url):
+    """Return the process-wide hub for a stream."""
+    with _hubs_lock:
+        hub = _hubs.get(stream_url)
+        if hub is None:
+            hub = _hubs[stream_url] = CaptureHub(stream_url)
+        return hub
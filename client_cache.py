@@ -0,0 +1,222 @@
+# IN-PROCESS CACHE FOR HOT REDIS READS.
+# The alarm path keeps re-reading the same few small keys (comp state, timestamps).
+# ClientCache serves them from a bounded per-worker LRU and relies on Redis
+# to say when an entry went stale: with server-assisted client tracking (Redis 6+,
+# CLIENT TRACKING ... BCAST) Redis publishes every change to a cached prefix on
+# __redis__:invalidate, whoever made it. On servers without tracking it falls back to
+# an application channel that only writes made through ClientCache publish to; entry
+# TTLs bound staleness in that mode. Until the invalidation listener is connected all
+# reads go straight to Redis. Contacts are deliberately not cached: with BCAST every
+# write under a cached prefix is pushed to every worker, and a bulk contact load would
+# flood the listeners with invalidations for keys nobody reads twice.
+
+import threading
+import time
+
+import redis
+
+import metrics
+from logger import logger
+from redis_cache import RedisContactManager
+from utilites import LRUCache
+
+TRACKING_CHANNEL = "__redis__:invalidate"
+FALLBACK_CHANNEL = "cache:invalidate"
+CACHED_PREFIXES = ("xcraker:", "current_artist_name", "last_processed_")
+CACHE_MAX_KEYS = 10000
+CACHE_TTL_SECONDS = 60
+METRICS_FLUSH_SECONDS = 30
+RECONNECT_SECONDS = 5
+LISTEN_POLL_SECONDS = 1
+HEALTH_CHECK_SECONDS = 15         # PING the tracking connection; if it died, nothing is invalidated
+
+
+class ClientCache:
+    """
+    Read-through cache for GET, HGET and HGETALL on keys under prefixes.
+
+    Writes made through set()/hset()/delete() go to Redis first and then drop the local
+    entry, so the writing worker never reads its own stale value.
+    """
+
+    def __init__(self, redis_client, prefixes=CACHED_PREFIXES, max_keys=CACHE_MAX_KEYS, ttl=CACHE_TTL_SECONDS):
+        self.redis_client = redis_client
+        self.prefixes = tuple(prefixes)
+        self.entries = LRUCache(max_size=max_keys, ttl=ttl)
+        self.mode = None              # "tracking" or "pubsub" once the listener is connected
+        self.hits = self.misses = self.invalidations = 0
+        self._flushed = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._epoch = 0               # bumped on every invalidation; guards reads in flight
+        self._listener = None
+        self._tracking_connection = None
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._listen, name="client-cache", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    # ---- reads -------------------------------------------------------------------------
+
+    def _cacheable(self, key):
+        return self._ready.is_set() and key.startswith(self.prefixes)
+
+    def _read(self, key, op, arg, fetch):
+        if not self._cacheable(key):
+            return fetch()
+        entry = self.entries.get(key)
+        if entry is not None and (op, arg) in entry:
+            self.hits += 1
+            return entry[(op, arg)]
+        self.misses += 1
+        epoch = self._epoch
+        value = fetch()
+        # Don't cache a value an invalidation may have overtaken while it was read.
+        if epoch == self._epoch and self._ready.is_set():
+            entry = self.entries.get(key) or {}
+            entry[(op, arg)] = value
+            self.entries.set(key, entry)
+        return value
+
+    def get(self, key):
+        return self._read(key, "get", None, lambda: self.redis_client.get(key))
+
+    def hget(self, key, field):
+        return self._read(key, "hget", field, lambda: self.redis_client.hget(key, field))
+
+    def hgetall(self, key):
+        return self._read(key, "hgetall", None, lambda: self.redis_client.hgetall(key))
+
+    # ---- writes ------------------------------------------------------------------------
+
+    def _written(self, key):
+        self.invalidate([key])
+        if self.mode == "pubsub" and key.startswith(self.prefixes):
+            self.redis_client.publish(FALLBACK_CHANNEL, key)
+
+    def set(self, key, value, **options):
+        result = self.redis_client.set(key, value, **options)
+        self._written(key)
+        return result
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        result = self.redis_client.hset(key, field, value, mapping=mapping)
+        self._written(key)
+        return result
+
+    def delete(self, key):
+        result = self.redis_client.delete(key)
+        self._written(key)
+        return result
+
+    def invalidate(self, keys=None):
+        """Drop keys (all entries if None) from the local cache."""
+        self._epoch += 1
+        self.invalidations += 1
+        if keys is None:
+            self.entries.clear()
+            return
+        for key in keys:
+            self.entries.delete(key.decode("utf-8") if isinstance(key, bytes) else key)
+
+    def stats(self):
+        reads = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "keys": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / reads, 3) if reads else None,
+        }
+
+    # ---- invalidation listener ---------------------------------------------------------
+
+    def _connect(self):
+        """Open the invalidation connection (and tracking connection); returns the mode."""
+        kwargs = self.redis_client.connection_pool.connection_kwargs
+        listener = redis.Connection(**kwargs)
+        listener.send_command("CLIENT", "ID")
+        listener_id = listener.read_response()
+        tracking = redis.Connection(**kwargs)
+        try:
+            prefixes = [part for prefix in self.prefixes for part in ("PREFIX", prefix)]
+            tracking.send_command("CLIENT", "TRACKING", "on", "REDIRECT", listener_id, "BCAST", *prefixes)
+            tracking.read_response()
+            channel, mode = TRACKING_CHANNEL, "tracking"
+        except redis.exceptions.ResponseError as e:
+            logger.warning(f"Redis client tracking unavailable ({e}); using pub/sub cache invalidation")
+            tracking.disconnect()
+            tracking, channel, mode = None, FALLBACK_CHANNEL, "pubsub"
+        listener.send_command("SUBSCRIBE", channel)
+        listener.read_response()
+        self._listener, self._tracking_connection = listener, tracking
+        return mode
+
+    def _disconnect(self):
+        self._ready.clear()
+        self.mode = None
+        self.invalidate()
+        for connection in (self._listener, self._tracking_connection):
+            if connection is not None:
+                connection.disconnect()
+        self._listener = self._tracking_connection = None
+
+    def _check_tracking(self):
+        """Raise ConnectionError if the tracking connection is gone (Redis drops its tracking with it)."""
+        if self._tracking_connection is not None:
+            self._tracking_connection.send_command("PING")
+            self._tracking_connection.read_response()
+
+    def _listen(self):
+        last_flush = last_check = time.monotonic()
+        while not self._stopped.is_set():
+            try:
+                if self._listener is None:
+                    self.mode = self._connect()
+                    self.invalidate()
+                    self._ready.set()
+                    last_check = time.monotonic()
+                    logger.info(f"Client cache enabled ({self.mode} invalidation)")
+                if time.monotonic() - last_check >= HEALTH_CHECK_SECONDS:
+                    self._check_tracking()
+                    last_check = time.monotonic()
+                if self._listener.can_read(timeout=LISTEN_POLL_SECONDS):
+                    message = self._listener.read_response()
+                    if isinstance(message, list) and len(message) == 3 and message[0] in (b"message", "message"):
+                        payload = message[2]
+                        # Tracking sends a list of keys, or nil when Redis flushed everything.
+                        self.invalidate(None if payload is None else payload if isinstance(payload, list) else [payload])
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError, OSError) as e:
+                logger.warning(f"Client cache invalidation connection lost ({e}); bypassing cache")
+                self._disconnect()
+                self._stopped.wait(RECONNECT_SECONDS)
+            if time.monotonic() - last_flush >= METRICS_FLUSH_SECONDS:
+                self._flush_metrics()
+                last_flush = time.monotonic()
+        self._disconnect()
+
+    def _flush_metrics(self):
+        """Add this worker's counts since the last flush to the shared metrics."""
+        for name in ("hits", "misses", "invalidations"):
+            value = getattr(self, name)
+            if value > self._flushed[name]:
+                metrics.incr(f"client_cache.{name}", value - self._flushed[name])
+                self._flushed[name] = value
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_client_cache():
+    """The worker's ClientCache over the RedisContactManager connection (started on first use)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ClientCache(RedisContactManager().redis_client).start()
+    return _cache
@@ -0,0 +1,112 @@
+# ASYNCIO RUNTIME FOR COMPS.
+# Comps spend nearly all their time waiting: on the stream, on Whisper/GPT, on ACR.
+# Instead of a thread per waiting session, every worker runs one event loop on a
+# background thread and comps submit coroutines to it. Waiting sessions then cost a
+# few KB each. The runtime owns the shared aiohttp session and async Redis client, and
+# provides the async ffmpeg helper.
+
+import asyncio
+import threading
+
+import aiohttp
+import redis.asyncio as redis_async
+
+from logger import logger
+
+HTTP_CONNECTION_LIMIT = 100
+PROCESS_KILL_GRACE_SECONDS = 5
+
+
+class CompRuntime:
+    """An event loop on a daemon thread plus the clients shared by all comps on it."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name="comp-runtime", daemon=True)
+        self._http = None
+        self._redis = None
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        logger.info("Comp runtime event loop started")
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        """
+        Schedule a coroutine on the runtime from any thread.
+
+        Returns:
+            concurrent.futures.Future: resolves with the coroutine's result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the runtime and block the calling thread for its result."""
+        return self.submit(coroutine).result(timeout)
+
+    def task_count(self):
+        """Coroutines currently scheduled on the runtime."""
+        return len(asyncio.all_tasks(self.loop))
+
+    async def http(self):
+        """The shared aiohttp session (created on first use, inside the loop)."""
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=HTTP_CONNECTION_LIMIT))
+        return self._http
+
+    def redis(self):
+        """The shared async Redis client; only use it from coroutines on this runtime."""
+        if self._redis is None:
+            self._redis = redis_async.Redis(host='localhost', port=6379, db=0)
+        return self._redis
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime():
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = CompRuntime()
+    return _runtime
+
+
+async def run_process(*command, input=None, timeout=None):
+    """
+    Run a subprocess (ffmpeg) without blocking the loop.
+
+    Returns:
+        tuple: (returncode, stdout bytes, stderr bytes)
+
+    Raises:
+        asyncio.TimeoutError: after killing the process, if it ran longer than timeout.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(input), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await asyncio.wait_for(process.wait(), PROCESS_KILL_GRACE_SECONDS)
+        raise
+    return process.returncode, stdout, stderr
+
+
+async def post_json(url, payload, headers=None, timeout=60):
+    """
+    POST a JSON body with the shared session.
+
+    Returns:
+        tuple: (status code, response text)
+    """
+    session = await get_runtime().http()
+    async with session.post(url, json=payload, headers=headers,
+                            timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+        return response.status, await response.text()
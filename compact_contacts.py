@@ -0,0 +1,192 @@
+# COMPACT CONTACT STORAGE (CONTACT_STORAGE=compact).
+# Instead of one Redis hash per contact (every field name repeated in every key), each
+# contact is packed into a single blob: a msgpack array (JSON when msgpack is not
+# installed) of its values in a shared field order. Blobs live in bucket hashes of
+# ~BUCKET_SIZE contacts each (crc32(id) % CONTACT_BUCKETS), small enough for Redis to
+# keep them listpack encoded. Blobs are unpacked when a contact is first read and each
+# field is decoded to str only when it is accessed. Sent flags live in delivery_state.py,
+# so marking or resetting them never rewrites a contact.
+
+import importlib.util
+import json
+import zlib
+from collections.abc import Mapping
+
+from constants import CONTACT_BUCKETS
+
+BUCKET_KEY_PREFIX = "contacts:b:"          # hash per bucket: contact id -> packed values
+FIELDS_KEY = "contacts:compact:fields"     # hash: field name -> position in the packed array
+FIELD_SEQ_KEY = "contacts:compact:field_seq"
+BUCKET_SIZE = 100                          # contacts per bucket the default CONTACT_BUCKETS aims for
+SCAN_BATCH = 500
+
+_msgpack = None
+if importlib.util.find_spec("msgpack") is not None:
+    import msgpack as _msgpack
+
+
+def pack(values):
+    """Pack a list of field values into one blob."""
+    if _msgpack is not None:
+        return _msgpack.packb(values, use_bin_type=True)
+    return json.dumps(values, separators=(",", ":")).encode("utf-8")
+
+
+def unpack(blob):
+    """Inverse of pack(); strings packed with msgpack come back as undecoded bytes."""
+    if blob[:1] == b"[":
+        return json.loads(blob)
+    return _msgpack.unpackb(blob, raw=True)
+
+
+def bucket_key(contact_id):
+    return f"{BUCKET_KEY_PREFIX}{zlib.crc32(str(contact_id).encode('utf-8')) % CONTACT_BUCKETS}"
+
+
+class LazyContact(Mapping):
+    """
+    Read-only contact backed by a packed blob.
+
+    The blob is unpacked on first access and each value is decoded when its field is read,
+    so listing a million contacts to look at one field does not build a million dicts.
+    Reading a field the contact does not have costs no Redis round trip: the shared field
+    names are only re-read (once) when the blob has positions this process does not know.
+    """
+
+    __slots__ = ("_id", "_blob", "_names", "_values", "_sent")
+
+    def __init__(self, contact_id, blob, names, sent):
+        self._id = contact_id
+        self._blob = blob
+        self._names = names
+        self._values = None
+        self._sent = sent
+
+    def _unpacked(self):
+        if self._values is None:
+            self._values = unpack(self._blob)
+            self._blob = None
+            if not self._names.covers(len(self._values)):
+                # Packed by a loader that added fields after our last refresh.
+                self._names.refresh()
+        return self._values
+
+    def __getitem__(self, field):
+        if field == "message_sent":
+            return "1" if self._sent else "0"
+        if field == "id":
+            return self._id
+        values = self._unpacked()
+        index = self._names.index_of(field)
+        if index is None or index >= len(values) or values[index] is None:
+            raise KeyError(field)
+        value = values[index]
+        return value.decode("utf-8", "replace") if isinstance(value, bytes) else value
+
+    def _present(self):
+        values = self._unpacked()
+        return [self._names.name_of(index) for index, value in enumerate(values)
+                if value is not None and self._names.name_of(index) not in (None, "id")]
+
+    def __iter__(self):
+        yield "id"
+        yield from self._present()
+        yield "message_sent"
+
+    def __len__(self):
+        return len(self._present()) + 2
+
+    def __repr__(self):
+        return f"LazyContact({dict(self)!r})"
+
+
+class FieldNames:
+    """Shared field name <-> array position mapping, cached per process."""
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self._positions = {}
+        self._names = []
+
+    def refresh(self):
+        raw = self.redis_client.hgetall(FIELDS_KEY)
+        self._positions = {name.decode("utf-8"): int(index) for name, index in raw.items()}
+        self._names = [None] * (max(self._positions.values(), default=-1) + 1)
+        for name, index in self._positions.items():
+            self._names[index] = name
+
+    def covers(self, length):
+        """True if every position of a blob with length values has a known name."""
+        return length <= len(self._names)
+
+    def index_of(self, field, create=False):
+        """Position of field; unknown fields are only looked up in Redis when create is set."""
+        if field not in self._positions and create:
+            self.refresh()
+            if field not in self._positions:
+                # HSETNX keeps the first position if two loaders add the same field at once;
+                # the loser's sequence number is simply never used.
+                self.redis_client.hsetnx(FIELDS_KEY, field, self.redis_client.incr(FIELD_SEQ_KEY) - 1)
+                self.refresh()
+        return self._positions.get(field)
+
+    def name_of(self, index):
+        return self._names[index] if index < len(self._names) else None
+
+
+class CompactContactStore:
+    """Contact reads and writes in compact mode, used by RedisContactManager."""
+
+    def __init__(self, redis_client, delivery):
+        self.redis_client = redis_client
+        self.delivery = delivery
+        self.names = FieldNames(redis_client)
+
+    def encode(self, contact):
+        """Pack a contact dict (not modified) into its blob."""
+        values = []
+        for field, value in contact.items():
+            if field in ("id", "message_sent"):
+                continue
+            index = self.names.index_of(field, create=True)
+            if index >= len(values):
+                values.extend([None] * (index + 1 - len(values)))
+            values[index] = value
+        return pack(values)
+
+    def queue_store(self, pipeline, contact_id, contact):
+        pipeline.hset(bucket_key(contact_id), contact_id, self.encode(contact))
+
+    def queue_delete(self, pipeline, contact_id):
+        pipeline.hdel(bucket_key(contact_id), contact_id)
+
+    def get(self, contact_id):
+        return self.get_many([str(contact_id)])[0]
+
+    def get_many(self, contact_ids):
+        """Contacts for contact_ids in one round trip (None for IDs not stored)."""
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for contact_id in contact_ids:
+            pipeline.hget(bucket_key(contact_id), contact_id)
+        blobs = pipeline.execute()
+        sent = self.delivery.sent_many(contact_ids)
+        return [None if blob is None else LazyContact(contact_id, blob, self.names, flag)
+                for contact_id, blob, flag in zip(contact_ids, blobs, sent)]
+
+    def iter_all(self):
+        """Yield every stored contact, one bucket pipeline batch at a time."""
+        is_sent = self.delivery.sent_lookup()
+        for start in range(0, CONTACT_BUCKETS, SCAN_BATCH):
+            pipeline = self.redis_client.pipeline(transaction=False)
+            for bucket in range(start, min(start + SCAN_BATCH, CONTACT_BUCKETS)):
+                pipeline.hgetall(f"{BUCKET_KEY_PREFIX}{bucket}")
+            for entries in pipeline.execute():
+                for contact_id, blob in entries.items():
+                    contact_id = contact_id.decode("utf-8")
+                    yield LazyContact(contact_id, blob, self.names, is_sent(contact_id))
+
+    def delete_all(self):
+        for start in range(0, CONTACT_BUCKETS, SCAN_BATCH):
+            self.redis_client.unlink(*[f"{BUCKET_KEY_PREFIX}{bucket}"
+                                       for bucket in range(start, min(start + SCAN_BATCH, CONTACT_BUCKETS))])
+        self.redis_client.delete(FIELDS_KEY, FIELD_SEQ_KEY)
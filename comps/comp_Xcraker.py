@@ -5,9 +5,14 @@ from datetime import datetime, timedelta
 import pytz
 from logger import logger
 from redis_cache import RedisContactManager
+from client_cache import get_client_cache
+from transcription import get_transcription_backend
+from audio_profile import get_audio_profile, record_stream, encode_file
+from audio_archive import record_with_preroll
+from audio_segmentation import decode_pcm, find_speech_regions
+from timing_history import timing_profile, record_timings, recording_timings
 import os
 import requests
-import subprocess
 from datetime import datetime
 from constants import *
 import time
@@ -30,11 +35,11 @@ recent_answers_key = "xcraker:recent_answers"  # Redis hash
 def store_timestamp(redis_key):
     """Store current timestamp in Redis as ISO8601 string."""
     now = datetime.now(TIME_ZONE).isoformat()
-    contact_manager.redis_client.set(redis_key, now)
+    get_client_cache().set(redis_key, now)
 
 def get_timestamp(redis_key):
     """Get timestamp from Redis and return as datetime object or None."""
-    ts = contact_manager.redis_client.get(redis_key)
+    ts = get_client_cache().get(redis_key)
     if ts:
         return datetime.fromisoformat(ts.decode('utf-8'))
     return None
@@ -120,39 +125,29 @@ class AudioProcessor:
         return True
 
     def process_trigger(self, alarm_id,auio_path = None):
+        trigger_time = time.time()
         timestamp = datetime.now(TIME_ZONE).strftime("%Y%m%d_%H%M%S")
         logger.info(f"\n=== Processing trigger for {alarm_id} at {timestamp} ===\n")
         
+        profile = get_audio_profile()
         file_paths = {
             'wav': os.path.join(OUTPUT_DIR, f"{alarm_id}_{timestamp}.wav"),
-            'mp3': os.path.join(OUTPUT_DIR, f"{alarm_id}_{timestamp}.mp3")
+            'mp3': os.path.join(OUTPUT_DIR, f"{alarm_id}_{timestamp}.{profile.extension}")
         }
+        recording_duration = timing_profile("xcraker", {"RECORDING_DURATION": RECORDING_DURATION})["RECORDING_DURATION"]
+        from_archive = False
 
         try:
             if not auio_path:
-                logger.info(f"Starting {RECORDING_DURATION} seconds recording...")
-                command = [
-                    "/usr/bin/ffmpeg", "-y",
-                    "-i", LIVE_STREAM_URL,
-                    "-t", str(RECORDING_DURATION),
-                    "-acodec", "pcm_s16le",
-                    "-ar", "44100",
-                    "-ac", "2",
-                    file_paths['wav']
-                ]
-                subprocess.run(command, check=True, capture_output=True)
+                logger.info(f"Starting {recording_duration} seconds recording...")
+                from_archive = record_with_preroll(trigger_time, recording_duration, file_paths['wav'])
+                if not from_archive:
+                    record_stream(LIVE_STREAM_URL, recording_duration, file_paths['wav'], profile=profile, raw=True).check_returncode()
                 logger.info("Recording completed successfully")
 
-                logger.info("Converting WAV to MP3...")
-                command = [
-                    "/usr/bin/ffmpeg", "-y",
-                    "-i", file_paths['wav'],
-                    "-codec:a", "libmp3lame",
-                    "-qscale:a", "2",
-                    file_paths['mp3']
-                ]
-                subprocess.run(command, check=True, capture_output=True)
-                logger.info(f"MP3 conversion completed: {file_paths['mp3']}")
+                logger.info(f"Converting WAV to {profile.name}...")
+                encode_file(file_paths['wav'], file_paths['mp3'], profile)
+                logger.info(f"Conversion completed: {file_paths['mp3']} ({os.path.getsize(file_paths['mp3'])} bytes)")
 
             logger.info("Starting Whisper transcription...")
             if auio_path:
@@ -197,6 +192,15 @@ class AudioProcessor:
                 
                             
 
+            if not auio_path:
+                # Off the answer's critical path: where the comp's speech ended, for the timing tuner
+                try:
+                    regions = find_speech_regions(decode_pcm(file_paths['wav']))
+                    preroll = AUDIO_ARCHIVE_PREROLL_SECONDS if from_archive else 0
+                    record_timings("xcraker", f"{alarm_id}_{timestamp}", trigger_time, **recording_timings(regions, preroll))
+                except Exception as e:
+                    logger.warning(f"Could not measure recording timings: {e}")
+
             if os.path.exists(file_paths['wav']):
                 os.remove(file_paths['wav'])
                 logger.info(f"Cleaned up WAV file: {file_paths['wav']}")
@@ -213,21 +217,7 @@ class AudioProcessor:
     def transcribe_audio(self, file_path):
         try:
             logger.info(f"Starting Whisper transcription for: {file_path}")
-            headers = {"Authorization": f"Bearer {OPENAI_API_KEY.strip()}"}
-            
-            with open(file_path, "rb") as audio_file:
-                response = requests.post(
-                    "https://api.openai.com/v1/audio/transcriptions",
-                    headers=headers,
-                    files={"file": audio_file},
-                    data={"model": "whisper-1"},
-                    timeout=30
-                )
-                if response.status_code != 200:
-                    logger.error(f"OpenAI API Error: {response.status_code}")
-                    logger.error(f"Response content: {response.text}")
-                response.raise_for_status()
-                return response.json().get("text")
+            return get_transcription_backend().transcribe(file_path, timeout=30) or None
         except Exception as e:
             logger.error(f"Transcription failed: {str(e)}")
             logger.exception("Full transcription error traceback:")
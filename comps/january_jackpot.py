@@ -1,12 +1,12 @@
 from datetime import datetime, timedelta
-import requests
 import json
 import time
 import os
 import pytz
 from logger import logger
-from base64 import b64encode
-from constants import TIME_ZONE, SPOTIFY_API_URL, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_TOKEN_URL, ACR_API_KEY, ACR_API_URL
+from constants import TIME_ZONE
+from acr_poller import request_fast_polling, wait_for_track
+from spotify_client import get_token_manager, search_track
 
 # Valid alarm IDs
 VALID_ALARMS = ["Alarm1", "Alarm2", "Alarm3", "Alarm4", "Alarm5"]
@@ -33,36 +33,17 @@ def is_processing():
     return datetime.now() < PROCESSING_UNTIL
 
 def get_spotify_token():
-    """Get Spotify access token"""
-    auth = b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
-    headers = {
-        "Authorization": f"Basic {auth}",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    data = {"grant_type": "client_credentials"}
-    response = requests.post(SPOTIFY_TOKEN_URL, headers=headers, data=data)
-    return response.json()["access_token"]
-
-def search_spotify(query, token, search_type="track"):
-    """Search Spotify API"""
-    headers = {"Authorization": f"Bearer {token}"}
-    params = {
-        "q": query,
-        "type": search_type,
-        "limit": 1
-    }
-    response = requests.get(f"{SPOTIFY_API_URL}/search", headers=headers, params=params)
-    return response.json()
+    """Get a shared, proactively refreshed Spotify access token"""
+    return get_token_manager().get_token()
 
 def verify_with_spotify(track_data):
     """Verify track data with Spotify"""
     try:
         logger.info(f"Verifying track data with Spotify: {track_data}")
-        spotify_token = get_spotify_token()
         title = track_data.get('title', '')
         artist = track_data.get('artists', [{}])[0].get('name', '')
         
-        result = search_spotify(f"track:{title} artist:{artist}", spotify_token)
+        result = search_track(title, artist)
         if result and result.get('tracks', {}).get('items'):
             spotify_track = result['tracks']['items'][0]
             return {
@@ -71,6 +52,7 @@ def verify_with_spotify(track_data):
             }
         return None
     except Exception as e:
+        logger.info(f"Spotify verification failed: {str(e)}")
         return None
 
 def format_artists(track_data):
@@ -86,40 +68,23 @@ def format_artists(track_data):
         return f"{main_artist} feat. {', '.join(featured_artists)}"
     return main_artist
 
-def fetch_live_data():
-    """Fetch live data from ACRCloud API"""
-    headers = {
-        "Authorization": f"Bearer {ACR_API_KEY}",
-        "Accept": "application/json"
-    }
-    try:
-        response = requests.get(ACR_API_URL, headers=headers)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        logger.info(f"Error fetching live data: {str(e)}")
-        return None
-
 def get_artist_name(max_retries=5, retry_delay=5):
-    """Get artist name with retries"""
-    for attempt in range(max_retries):
-        api_data = fetch_live_data()
-        logger.info(f"API data for artist: {api_data}")
-        if not api_data:
-            logger.info(f"Retry {attempt + 1}/{max_retries}: No data received")
-            time.sleep(retry_delay)
-            continue
-
-        music_data = api_data.get('data', {}).get('metadata', {}).get('music', [])
-        if music_data:
-            track = music_data[0]
-            verified_data = verify_with_spotify(track)
-            if verified_data:
-                return verified_data['artists']
-        
-        if attempt < max_retries - 1:
-            logger.info(f"Retry {attempt + 1}/{max_retries}: No artist found")
-            time.sleep(retry_delay)
+    """Get the Spotify verified artist of the track the shared ACR poller reports"""
+    deadline = time.time() + max_retries * retry_delay
+    since = time.time()
+    while time.time() < deadline:
+        track = wait_for_track(lambda t: bool(t["title"] and t["artists"]), timeout=deadline - time.time(), since=since)
+        if not track:
+            break
+        logger.info(f"ACR track for artist: {track}")
+        verified_data = verify_with_spotify({
+            'title': track['title'],
+            'artists': [{'name': name} for name in track['artists']]
+        })
+        if verified_data:
+            return verified_data['artists']
+        logger.info("No verified artist for this result. Waiting for the next ACR result.")
+        since = track['fetched_at'] + 0.001
     
     return None
 
@@ -127,6 +92,7 @@ def get_artist_name(max_retries=5, retry_delay=5):
 def process_alarm(alarm_id):
     """Process alarm trigger and get artist"""
     logger.info(f"🚨 ALARM TRIGGERED: {alarm_id} 🚨")
+    request_fast_polling()
     
     time.sleep(WAIT_TIME)
     
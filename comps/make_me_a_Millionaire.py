@@ -1,11 +1,18 @@
 import os
 import requests
-import subprocess
 from datetime import datetime
 from logger import logger
-from constants import OPENAI_API_KEY, BEARER_TOKEN, LIVE_STREAM_URL,TIME_ZONE
+from constants import OPENAI_API_KEY, BEARER_TOKEN, LIVE_STREAM_URL,TIME_ZONE, OUTPUT_DIR, PROCESSED_DIR, AUDIO_ARCHIVE_PREROLL_SECONDS
 from redis_cache import RedisContactManager
+from transcription import get_transcription_backend
+from audio_profile import get_audio_profile, record_stream, encode_file
+from audio_archive import record_with_preroll
+from timing_history import timing_profile, record_timings, recording_timings
+from audio_segmentation import prepare_for_transcription
+from llm_client import Schema, get_llm_client
+from prompts import Prompt
 import re
+import time
 
 
 # Environment variables and constants
@@ -16,12 +23,68 @@ if not OPENAI_API_KEY or not BEARER_TOKEN:
     raise ValueError("Missing required environment variables. Check .env file.")
 
 
-OUTPUT_DIR = "output_segments"
-PROCESSED_DIR = os.path.join(OUTPUT_DIR, "processed_segments")
 RECORDING_DURATION = 200
 COOLDOWN_DURATION = 300
 VALID_ALARMS = ["Alarm1", "Alarm2", "Alarm3", "Alarm4", "Alarm5"]
 
+CONVERSATION_SYSTEM_MESSAGE = (
+    "You are analyzing a Heart Radio competition transcript to determine content type and intent.\n\n"
+
+    "IMPORTANT: Distinguish between CURRENT events and REPLAYS of previous events.\n\n"
+
+    "KEY PATTERNS TO RECOGNIZE:\n"
+    "1. REPLAY of previous winner (NOT a current winner):\n"
+    "   - Past tense references: 'earlier today', 'this morning', 'has won', etc.\n"
+    "   - Named contestants discussed in third person ('she decided', 'he chose')\n"
+    "   - Presenter asking listeners to imagine themselves in the situation\n"
+    "   - Transitions like 'Do you know what your decision would be?'\n"
+    "   - Invitation to listeners to participate ('come and make the decision for real')\n\n"
+
+    "2. CURRENT winner conversation (happening now):\n"
+    "   - Direct real-time interaction between presenter and contestant\n"
+    "   - Present tense dialogue ('What's your decision?', 'I choose...')\n"
+    "   - Contestant responding directly to questions in first person\n"
+    "   - No references suggesting this is a replay or example\n"
+    "   - Spontaneous emotional reactions from the current contestant\n\n"
+
+    "3. Question announcement (needs processing):\n"
+    "   - Clear A/B question format presented to listeners\n"
+    "   - Instructions for entry (texting, calling, etc.)\n"
+    "   - Often follows examples of previous winners\n"
+    "   - May contain entry deadline information\n"
+    "   - Repeated for clarity\n\n"
+
+    "REPORT YOUR ANALYSIS BY CALLING THE FUNCTION WITH:\n"
+    "- current_winner_conversation: true/false\n"
+    "- evidence: time references, interaction type and named individuals that decided it\n"
+    "- question_present: true/false\n"
+    "- question: the actual question if present, otherwise null\n"
+    "- final_decision: WINNER/REPLAY_WITH_QUESTION/QUESTION_ONLY/NEITHER\n\n"
+
+    "IMPORTANT NOTES:\n"
+    "- A transcript can contain BOTH a replay AND a new question\n"
+    "- Prioritize identifying new questions even if replays are present\n"
+    "- Look for clear transitions between replay examples and new questions\n"
+    "- Do NOT classify replays of previous winners as current winners"
+)
+
+# Static prefix reused on every call; see prompts.py
+CONVERSATION_PROMPT = Prompt("millionaire_conversation", CONVERSATION_SYSTEM_MESSAGE,
+                             max_prompt_tokens=7000)   # gpt-4 (8k), leaving room for the answer
+
+# Structured answer of analyze_conversation (see llm_client.py)
+CONVERSATION_ANALYSIS_SCHEMA = Schema({
+    "type": "object",
+    "properties": {
+        "current_winner_conversation": {"type": "boolean"},
+        "evidence": {"type": "string"},
+        "question_present": {"type": "boolean"},
+        "question": {"type": ["string", "null"]},
+        "final_decision": {"type": "string", "enum": ["WINNER", "REPLAY_WITH_QUESTION", "QUESTION_ONLY", "NEITHER"]},
+    },
+    "required": ["current_winner_conversation", "question_present", "final_decision"],
+})
+
 audio_processor = None
 last_processed_alarm_time = None
 
@@ -44,26 +107,15 @@ class AudioProcessor:
         
 
     def transcribe_audio(self, file_path):
-        """Transcribes audio using OpenAI Whisper API."""
+        """Transcribes audio using the configured transcription backend."""
         try:
             logger.info(f"Starting Whisper transcription for: {file_path}")
-            headers = {"Authorization": f"Bearer {OPENAI_API_KEY.strip()}"}
-
-            with open(file_path, "rb") as audio_file:
-                response = requests.post(
-                    "https://api.openai.com/v1/audio/transcriptions",
-                    headers=headers,
-                    files={"file": audio_file},
-                    data={"model": "whisper-1"},
-                    timeout=30
-                )
-                response.raise_for_status()
-                transcription = response.json().get("text", None)
-                if transcription:
-                    logger.info(f"Transcription result: {transcription}")
-                else:
-                    logger.error("No transcription text returned by the Whisper API.")
-                return transcription
+            transcription = get_transcription_backend().transcribe(file_path, timeout=30)
+            if transcription:
+                logger.info(f"Transcription result: {transcription}")
+            else:
+                logger.error("No transcription text returned by the transcription backend.")
+            return transcription or None
         except Exception as e:
             logger.error(f"❌ Transcription failed: {str(e)}")
             logger.exception("Full transcription error traceback:")
@@ -73,74 +125,22 @@ class AudioProcessor:
         """Analyzes transcript to detect if it contains a winning conversation, replay, or question."""
         try:
             logger.info("Beginning conversation analysis...")
-            system_message = (
-                "You are analyzing a Heart Radio competition transcript to determine content type and intent.\n\n"
-                
-                "IMPORTANT: Distinguish between CURRENT events and REPLAYS of previous events.\n\n"
-                
-                "KEY PATTERNS TO RECOGNIZE:\n"
-                "1. REPLAY of previous winner (NOT a current winner):\n"
-                "   - Past tense references: 'earlier today', 'this morning', 'has won', etc.\n"
-                "   - Named contestants discussed in third person ('she decided', 'he chose')\n"
-                "   - Presenter asking listeners to imagine themselves in the situation\n"
-                "   - Transitions like 'Do you know what your decision would be?'\n"
-                "   - Invitation to listeners to participate ('come and make the decision for real')\n\n"
-                
-                "2. CURRENT winner conversation (happening now):\n"
-                "   - Direct real-time interaction between presenter and contestant\n"
-                "   - Present tense dialogue ('What's your decision?', 'I choose...')\n"
-                "   - Contestant responding directly to questions in first person\n"
-                "   - No references suggesting this is a replay or example\n"
-                "   - Spontaneous emotional reactions from the current contestant\n\n"
-                
-                "3. Question announcement (needs processing):\n"
-                "   - Clear A/B question format presented to listeners\n"
-                "   - Instructions for entry (texting, calling, etc.)\n"
-                "   - Often follows examples of previous winners\n"
-                "   - May contain entry deadline information\n"
-                "   - Repeated for clarity\n\n"
-                
-                "FORMAT YOUR RESPONSE EXACTLY LIKE THIS:\n"
-                "1. Current winner conversation: [YES/NO]\n"
-                "2. Evidence for current/replay:\n"
-                "   - Time references: [past/present tense markers]\n"
-                "   - Interaction type: [direct/reported/invitation]\n"
-                "   - Named individuals: [mentioned as current contestants or examples]\n"
-                "3. Question announcement present: [YES/NO]\n"
-                "4. Question details: [the actual question if present]\n"
-                "5. FINAL DECISION: [WINNER/REPLAY_WITH_QUESTION/QUESTION_ONLY/NEITHER]\n\n"
-                
-                "IMPORTANT NOTES:\n"
-                "- A transcript can contain BOTH a replay AND a new question\n"
-                "- Prioritize identifying new questions even if replays are present\n"
-                "- Look for clear transitions between replay examples and new questions\n"
-                "- Do NOT classify replays of previous winners as current winners"
+            analysis = get_llm_client().complete_json(
+                "millionaire_conversation",
+                CONVERSATION_PROMPT.messages(text),
+                CONVERSATION_ANALYSIS_SCHEMA,
+                model="gpt-4",
+                budget_seconds=30,
+                max_tokens=400,
+                temperature=0,
+                top_p=0.1
             )
 
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={"Authorization": f"Bearer {OPENAI_API_KEY.strip()}"},
-                json={
-                    "model": "gpt-4",
-                    "messages": [
-                        {"role": "system", "content": system_message},
-                        {"role": "user", "content": text}
-                    ],
-                    "max_tokens": 400,
-                    "temperature": 0,
-                    "top_p": 0.1
-                },
-                timeout=30
-            )
-            response.raise_for_status()
-            analysis = response.json()["choices"][0]["message"]["content"].strip()
-
             logger.info(f"📝 Conversation Analysis Results:\n{analysis}")
             
-            # Parse the detailed analysis
-            is_current_winner = "Current winner conversation: YES" in analysis
-            is_replay_with_question = "FINAL DECISION: REPLAY_WITH_QUESTION" in analysis
-            is_question_only = "FINAL DECISION: QUESTION_ONLY" in analysis
+            is_current_winner = analysis["current_winner_conversation"]
+            is_replay_with_question = analysis["final_decision"] == "REPLAY_WITH_QUESTION"
+            is_question_only = analysis["final_decision"] == "QUESTION_ONLY"
             
             # Handle the case where there's a replay with a question announcement
             if is_replay_with_question:
@@ -425,41 +425,38 @@ class AudioProcessor:
 
     def process_trigger(self, alarm_id):
         """Processes an alarm trigger, recording, transcribing, and analyzing the audio."""
+        trigger_time = time.time()
         timestamp = datetime.now(TIME_ZONE).strftime("%Y%m%d_%H%M%S")
         logger.info(f"\n=== Processing trigger for {alarm_id} at {timestamp} ===\n")
 
+        profile = get_audio_profile()
         file_paths = {
             'wav': os.path.join(OUTPUT_DIR, f"{alarm_id}_{timestamp}.wav"),
-            'mp3': os.path.join(OUTPUT_DIR, f"{alarm_id}_{timestamp}.mp3")
+            'mp3': os.path.join(OUTPUT_DIR, f"{alarm_id}_{timestamp}.{profile.extension}")
         }
+        recording_duration = timing_profile("millionaire", {"RECORDING_DURATION": RECORDING_DURATION})["RECORDING_DURATION"]
+        speech_file = None
 
         try:
-            logger.info(f"Starting {RECORDING_DURATION} seconds recording...")
-            command = [
-                "/usr/bin/ffmpeg", "-y",
-                "-i", LIVE_STREAM_URL,
-                "-t", str(RECORDING_DURATION),
-                "-acodec", "pcm_s16le",
-                "-ar", "44100",
-                "-ac", "2",
-                file_paths['wav']
-            ]
-            subprocess.run(command, check=True, capture_output=True)
+            logger.info(f"Starting {recording_duration} seconds recording...")
+            from_archive = record_with_preroll(trigger_time, recording_duration, file_paths['wav'])
+            if not from_archive:
+                record_stream(LIVE_STREAM_URL, recording_duration, file_paths['wav'], profile=profile, raw=True).check_returncode()
             logger.info("Recording completed successfully")
 
-            logger.info("Converting WAV to MP3...")
-            command = [
-                "/usr/bin/ffmpeg", "-y",
-                "-i", file_paths['wav'],
-                "-codec:a", "libmp3lame",
-                "-qscale:a", "2",
-                file_paths['mp3']
-            ]
-            subprocess.run(command, check=True, capture_output=True)
-            logger.info(f"MP3 conversion completed: {file_paths['mp3']}")
+            logger.info(f"Converting WAV to {profile.name}...")
+            encode_file(file_paths['wav'], file_paths['mp3'], profile)
+            logger.info(f"Conversion completed: {file_paths['mp3']} ({os.path.getsize(file_paths['mp3'])} bytes)")
 
             logger.info("Starting Whisper transcription...")
-            transcription = self.transcribe_audio(file_paths['mp3'])
+            speech_file, regions = prepare_for_transcription(file_paths['mp3'])
+            if regions is not None:
+                preroll = AUDIO_ARCHIVE_PREROLL_SECONDS if from_archive else 0
+                record_timings("millionaire", f"{alarm_id}_{timestamp}", trigger_time, **recording_timings(regions, preroll))
+            if not speech_file:
+                logger.info("No speech found in the recording - skipping transcription")
+                return
+            transcription = self.transcribe_audio(speech_file)
             
             if transcription:
                 logger.info(f"Transcription completed: {transcription}")
@@ -488,25 +485,29 @@ class AudioProcessor:
                             return answer
                 else:
                     logger.info("No winner and no question detected - skipping processing")
-                
-                # Clean up after processing
-                try:
-                    if os.path.exists(file_paths['wav']):
-                        os.remove(file_paths['wav'])
-                        logger.info(f"Cleaned up WAV file: {file_paths['wav']}")
-                    
-                    # Move processed MP3 to processed directory
-                    processed_mp3 = os.path.join(PROCESSED_DIR, os.path.basename(file_paths['mp3']))
-                    if os.path.exists(file_paths['mp3']):
-                        os.rename(file_paths['mp3'], processed_mp3)
-                        logger.info(f"Moved processed MP3 to: {processed_mp3}")
-                except Exception as cleanup_error:
-                    logger.warning(f"Cleanup error: {str(cleanup_error)}")
 
         except Exception as e:
             logger.error(f"Processing error: {str(e)}")
             logger.exception("Full error traceback:")
 
+        finally:
+            # Clean up on every path (early returns and errors included)
+            try:
+                if os.path.exists(file_paths['wav']):
+                    os.remove(file_paths['wav'])
+                    logger.info(f"Cleaned up WAV file: {file_paths['wav']}")
+
+                if speech_file and speech_file != file_paths['mp3'] and os.path.exists(speech_file):
+                    os.remove(speech_file)
+
+                # Move processed MP3 to processed directory
+                processed_mp3 = os.path.join(PROCESSED_DIR, os.path.basename(file_paths['mp3']))
+                if os.path.exists(file_paths['mp3']):
+                    os.rename(file_paths['mp3'], processed_mp3)
+                    logger.info(f"Moved processed MP3 to: {processed_mp3}")
+            except Exception as cleanup_error:
+                logger.warning(f"Cleanup error: {str(cleanup_error)}")
+
         
 def handle_comp(alarm_id):
     try:
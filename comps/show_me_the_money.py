@@ -1,14 +1,17 @@
 # This is a temp initilization for comps later will be updated
 from logger import logger 
-from typing import Optional, Dict, Any
 from datetime import datetime
+import json
 import time
-import requests
 from constants import *
 from redis_cache import RedisContactManager
+from client_cache import get_client_cache
+from acr_poller import wait_for_track
 
 
 COMP_NAME = "Show Me The Money"
+ARTIST_WAIT_SECONDS = 120
+TRACK_START_TOLERANCE_SECONDS = 5       # ACR offsets and the alarm time are only roughly aligned
 
 # Initialize the contact manager (you can move this to a global scope if needed)
 contact_manager = RedisContactManager()
@@ -19,61 +22,6 @@ last_artist = None
 processing_alarm = False
 waiting_for_api_check = False
 
-def fetch_live_data(bearer_token: str, live_data_api_url: str) -> Optional[Dict[str, Any]]:
-    """
-    Fetches live data from an API endpoint using a bearer token for authorization.
-
-    Args:
-        bearer_token (str): The bearer token for authorization to access the API.
-        live_data_api_url (str): The URL of the API endpoint to fetch live data from.
-
-    Returns:
-        Optional[Dict[str, Any]]: Returns a dictionary containing the live data if the request is successful;
-                                  otherwise, returns None.
-    """
-    headers = {
-        "Authorization": f"Bearer {bearer_token}",
-        "Content-Type": "application/json"
-    }
-
-    try:
-        print("Fetching live artist data...")
-        response = requests.get(live_data_api_url, headers=headers)
-        if response.status_code == 200:
-            live_data = response.json()
-            print(f"Live data received: {live_data}")
-            logger.info(f"Live data received: {live_data}")
-            return live_data
-        else:
-            print(f"Failed to fetch live data. Status code: {response.status_code}")
-            logger.error(f"Failed to fetch live data. Status code: {response.status_code}")
-            return None
-    except Exception as e:
-        print(f"Error fetching live data: {str(e)}")
-        logger.error(f"Error fetching live data: {str(e)}")
-        return None
-    
-
-def extract_artist_name(live_data: Dict[str, Any]) -> Optional[str]:
-    """
-    Extracts the artist name from the live data dictionary.
-
-    Args:
-        live_data (Dict[str, Any]): The live data dictionary from which to extract the artist name.
-
-    Returns:
-        Optional[str]: The artist name if it exists; otherwise, returns None.
-    """
-    try:
-        # Navigate to the most reliable path for the artist name
-        artist_name = live_data['data']['metadata']['music'][0]['artists'][0]['name']
-        print(artist_name)
-        return artist_name
-    except (KeyError, IndexError, TypeError):
-        # If any error occurs while trying to access the artist name, return None
-        return None
-
-
 def process_callback(data):
     print("Processing callback...")
     global processing_alarm, waiting_for_api_check
@@ -102,68 +50,56 @@ def process_callback(data):
 
         return False
 
-def get_current_artist_name():
-    # Check if artist name is already in Redis
-    artist_name = contact_manager.redis_client.get('current_artist_name')
-    if artist_name:
-        artist_name = artist_name.decode('utf-8')
+def get_current_artist_name(alarm_at):
+    # Check if another worker already stored the artist of a track that started after this alarm
+    cached = get_client_cache().get('current_artist_name')
+    try:
+        cached = json.loads(cached) if cached else None
+    except ValueError:
+        cached = None               # plain name from an older version: its track time is unknown
+    if cached and cached["started_at"] >= alarm_at - TRACK_START_TOLERANCE_SECONDS:
+        artist_name = cached["artist"]
         logger.info(f"Using artist name from Redis: {artist_name}")
         return artist_name
     else:
         # Fetch and store artist name
-        artist_name = fetch_and_store_artist_name()
+        artist_name = fetch_and_store_artist_name(alarm_at)
         return artist_name
 
-def fetch_and_store_artist_name():
+def fetch_and_store_artist_name(alarm_at):
     logger.info("Retrieving artist name...")
-    check_count = 0
-    max_checks = 6  # Will check for 2 minutes (6 * 20 seconds)
-
-    artist_name = None  # Initialize artist_name
-
-    while check_count < max_checks:
-        logger.info("Started processing")
-        # Simulate fetching live data
-        live_data = fetch_live_data(ACR_API_KEY, ACR_API_URL)
-        if live_data:
-        # if True:
-            artist_name = extract_artist_name(live_data)
-            # artist_name = semulate_artists()
-
-            logger.info(f"Artist name detected: {artist_name}")
-
-            if artist_name:
-                # Store the artist name in Redis for other workers
-                contact_manager.redis_client.set('current_artist_name', artist_name)
-                logger.info(f"Artist name '{artist_name}' stored in Redis.")
-
-                return artist_name
-            else:
-                logger.info("No artist name detected. Will retry.")
-        else:
-            logger.info("No live data available. Will retry.")
-
-        # Wait before checking again
-        time.sleep(20)
-        check_count += 1
+    # Wait up to 2 minutes for the shared ACR poller to report the artist of a track that
+    # started after the alarm; the track playing before it is not the one to report.
+    track = wait_for_track(lambda t: bool(t["artist"]), timeout=ARTIST_WAIT_SECONDS,
+                           started_since=alarm_at - TRACK_START_TOLERANCE_SECONDS)
+
+    if track:
+        artist_name = track["artist"]
+        logger.info(f"Artist name detected: {artist_name}")
+        # Store the artist name in Redis for other workers
+        get_client_cache().set('current_artist_name', json.dumps({"artist": artist_name, "started_at": track["started_at"]}))
+        logger.info(f"Artist name '{artist_name}' stored in Redis.")
+        return artist_name
 
-    logger.info("Artist name could not be retrieved after maximum retries.")
+    logger.info("Artist name could not be retrieved within the wait period.")
     return None
 
 
 def process_alarm():
     global last_artist    
+    alarm_at = time.time()
     try:
         logger.info("Processing alarm.")
         # Retrieve current artist name
-        artist_name = get_current_artist_name()
+        artist_name = get_current_artist_name(alarm_at)
         if not artist_name:
             logger.info("Artist name could not be retrieved. Exiting process_alarm.")
             return
         # Check for duplicate processing
          # Cooldown logic applies only for different request IDs
-        last_processed_artist = contact_manager.redis_client.get('last_processed_artist')
-        last_processed_time = contact_manager.redis_client.get('last_processed_time')
+        cache = get_client_cache()
+        last_processed_artist = cache.get('last_processed_artist')
+        last_processed_time = cache.get('last_processed_time')
         cooldown_period = 300  # Cooldown period in seconds (e.g., 5 minutes)
         current_time = int(time.time())
 
@@ -185,8 +121,8 @@ def process_alarm():
         logger.info(f"DATA TO SEND,artist: {artist_name}")
 
         # Update last_processed_artist and last_processed_time in Redis
-        contact_manager.redis_client.set('last_processed_artist', artist_name)
-        contact_manager.redis_client.set('last_processed_time', current_time)
+        cache.set('last_processed_artist', artist_name)
+        cache.set('last_processed_time', current_time)
 
         return [COMP_NAME, artist_name]
         
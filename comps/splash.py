@@ -1,53 +1,36 @@
 from logger import logger
-import threading
 from comps.splash_cash_detector import detect_splash_cash_outcome_async
-from redis_cache import RedisContactManager
 
-def execute_comp(alert_type: str):
+COMP_NAME = "Splash The Cash"
+
+
+def execute_comp(alert_type: str, trigger_id: str = None):
     """
     Execute Splash The Cash IMMEDIATE alarm message.
     This sends the "GO time! The alarm has sounded" message within 3 seconds.
-    The outcome detection runs separately in background.
-    
+    Outcome detection runs as a background session (comps/splash_sessions.py), which
+    sends the outcome message to the messaging server as a second event when it finishes.
+
     Args:
         alert_type (str): The type of alert that triggered this competition
-        
+        trigger_id (str): Id of this trigger (one per alarm callback); a trigger starts at most one session
+
     Returns:
         tuple: (comp_name, alarm_message) - immediate alarm message for users
     """
     logger.info(f"Executing Splash The Cash ALARM with alert_type: {alert_type}")
-    
+
     try:
         # Start background outcome detection (non-blocking)
-        # logger.info("Starting background outcome detection thread")
-        # detection_thread = threading.Thread(
-        #     target=detect_splash_cash_outcome_async,
-        #     daemon=True
-        # )
-        # detection_thread.start()
-        detect_splash_cash_outcome_async()
-        
-        # Return immediate alarm message (this will be sent within 3 seconds)
-        comp_name = "Splash The Cash"
-        # This message is handled by the existing template in constants.py: MESSAGES_TEMPLATES["Splash The Cash"]
-        # It will be formatted as: "Hi {name}, it's GO time! The alarm has sounded..."
-        alarm_message = None  # Placeholder - the messaging server will use the template
-        manager = RedisContactManager()
-
-        if manager.redis_client.exists("SPLASH_MESSAGE"):
-            alarm_message = manager.redis_client.get("SPLASH_MESSAGE")
-            # alarm_message = alarm_message.decode()
-        else:
-            return None
-    
-
-            
-        
-        logger.info(f"Returning immediate alarm message for: {comp_name}")
-        return comp_name, alarm_message
-        
+        session_id = detect_splash_cash_outcome_async(alarm_id=alert_type, trigger_id=trigger_id)
+        logger.info(f"Splash outcome detection session: {session_id}")
     except Exception as e:
-        logger.error(f"Error in Splash The Cash alarm execution: {str(e)}")
+        logger.error(f"Error starting Splash The Cash outcome detection: {str(e)}")
         logger.exception("Full alarm execution error traceback:")
-        # Still return alarm message even if background detection fails
-        return None
\ No newline at end of file
+        # Still return the alarm message even if background detection fails
+
+    # This message is handled by the existing template in constants.py: MESSAGES_TEMPLATES["Splash The Cash"]
+    # It will be formatted as: "Hi {name}, it's GO time! The alarm has sounded..."
+    alarm_message = None  # Placeholder - the messaging server will use the template
+    logger.info(f"Returning immediate alarm message for: {COMP_NAME}")
+    return COMP_NAME, alarm_message
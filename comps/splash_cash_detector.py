@@ -5,16 +5,32 @@ Detects win/lose outcomes from live radio stream after alarm trigger
 """
 
 
-import time
+import asyncio
+import json
+import os
+
+import numpy as np
 
-import requests
 from datetime import datetime
-from constants import LIVE_STREAM_URL, OPENAI_API_KEY, WHISPER_API_URL, GPT_API_URL
+import metrics
+from constants import LIVE_STREAM_URL, SPLASH_SEGMENT_INDEX, CHUNK_DIR
+from audio_fingerprint import FingerprintIndex, SegmentStartDetector
+from llm_client import LLMError, Schema, get_llm_client
+from prompts import Prompt
 from logger import logger
-from redis_cache import RedisContactManager
+from comp_runtime import get_runtime
+from transcription import get_transcription_backend
+from audio_segmentation import prepare_for_transcription, encode_pcm_async
+from audio_profile import get_audio_profile
+from transcript_store import TranscriptStore
+from transcript_stitcher import TranscriptStitcher
+from timing_history import timing_profile, record_timings, first_phrase_seconds, STAGE1_CENSOR_SECONDS
+from capture_hub import get_capture_hub, SAMPLE_RATE as CAPTURE_SAMPLE_RATE, BYTES_PER_SECOND as CAPTURE_BYTES_PER_SECOND
 
 # ============= TIMING CONTROLS =============
-INITIAL_DELAY_MINUTES = 2         # Wait time after alarm before recording starts
+INITIAL_DELAY_MINUTES = 2         # Wait time after alarm before recording starts (fallback when the segment start is not heard)
+SEGMENT_PREROLL_SECONDS = 10       # Audio kept from before a detected segment start
+SEGMENT_WATCH_STEP_SECONDS = 1     # How often the stream is checked for the segment start
 CHUNK_DURATION_MINUTES = 2         # Length of each recording chunk
 CHUNK_OVERLAP_SECONDS = 30         # Overlap between chunks to avoid lost conversation
 MAX_RECORDING_MINUTES = 46         # Maximum total recording time
@@ -22,6 +38,14 @@ OUTCOME_CHECK_MINUTES = 4          # Start checking for outcomes after this time
 NEXT_ROUND_WAIT_MINUTES = 3        # Additional recording time after outcome to get next round timing
 TARGET_NOTIFICATION_MINUTES = 2    # Goal: notify within this time of outcome
 MAX_SMS_LENGTH = 160
+GPT_BUDGET_SECONDS = 45            # total time for one analysis, including immediate retries
+# Defaults of the timings the tuner may override per session (see timing_history.py)
+TIMING_DEFAULTS = {
+    "INITIAL_DELAY_MINUTES": INITIAL_DELAY_MINUTES,
+    "CHUNK_DURATION_MINUTES": CHUNK_DURATION_MINUTES,
+    "OUTCOME_CHECK_MINUTES": OUTCOME_CHECK_MINUTES,
+    "NEXT_ROUND_WAIT_MINUTES": NEXT_ROUND_WAIT_MINUTES,
+}
 
 # ============= SMS TEMPLATES =============
 WIN_SMS_TEMPLATE = "Winner - prize has been won! Enter next round in 40mins - Text **CASH** to **82122** or call 03308809118"
@@ -29,10 +53,13 @@ LOSE_SMS_TEMPLATE = "No winner. Jackpot rollover! You can now enter next round -
 FALLBACK_MESSAGE = "The call has been made. Are you the lucky winner? If not, next round starts again soon. Get ready, another chance to win is just around the corner!"
 
 # ============= FILE PATHS =============
-CHUNK_DIR = "./audio_chunks/"
-TRANSCRIPT_FILE = "session_transcript.txt"
+# Every session gets its own directory under CHUNK_DIR holding its chunks and GPT response.
+# The transcript is kept in a TranscriptStore (Redis stream per session); the audio the
+# chunks share is transcribed twice, so only what TranscriptStitcher finds new is stored.
 GPT_RESPONSE_FILE = "splash_gptmessage.txt"
 LOG_FILE = "splash_processing.log"
+SESSION_MESSAGE_KEY = "splash:session:{session_id}:message"
+SESSION_MESSAGE_TTL_SECONDS = 24 * 60 * 60
 
 
 
@@ -92,15 +119,12 @@ YOUR TASKS:
 2. Identify the outcome: WIN, LOSE, or UNKNOWN
 3. Generate SMS using the exact templates provided
 
-TRANSCRIPT TO ANALYZE:
-{transcript_text}
-
 SMS TEMPLATES TO USE:
 - WIN: "Winner - prize has been won! Enter next round in 40mins - Text **CASH** to **82122** or call 03308809118"
 - LOSE: "No winner. Jackpot rollover! You can now enter next round - Text **CASH** to **82122** or call 03308809118"
 
 RESPOND ONLY IN THIS EXACT JSON FORMAT - NO OTHER TEXT:
-{{
+{
 "call_made": true/false,
 "outcome": "WIN"/"LOSE"/"UNKNOWN",
 "sms_message": "exact SMS using templates above",
@@ -108,7 +132,7 @@ RESPOND ONLY IN THIS EXACT JSON FORMAT - NO OTHER TEXT:
 "stage_1_call_initiated": true/false,
 "stage_2_call_completed": true/false,
 "stage_3_clear_outcome": true/false
-}}
+}
 
 CONSTRAINTS:
 - DO NOT include any text outside the JSON
@@ -119,18 +143,59 @@ CONSTRAINTS:
 - Be extremely conservative - prefer UNKNOWN over wrong decisions
 - DO NOT extract or mention any timing information"""
 
+# Static prefix (system + instructions) first, transcript last; see prompts.py.
+ANALYSIS_PROMPT = Prompt(
+    "splash_analysis",
+    SYSTEM_CONSTRAINTS,
+    BULLETPROOF_ANALYSIS_PROMPT,
+    transcript_header="TRANSCRIPT TO ANALYZE:",
+    max_prompt_tokens=12000,   # gpt-3.5-turbo-16k, leaving room for the answer
+)
+
+
+# Expected GPT answer; checked by llm_client before the stage rules are applied. The SMS
+# sent is built from the templates, so the model's sms_message is optional and unchecked.
+ANALYSIS_SCHEMA = Schema({
+    "type": "object",
+    "properties": {
+        "call_made": {"type": "boolean"},
+        "outcome": {"type": "string", "enum": ["WIN", "LOSE", "UNKNOWN"]},
+        "sms_message": {"type": "string"},
+        "confidence": {"type": "string", "enum": ["high", "medium", "low"]},
+        "stage_1_call_initiated": {"type": "boolean"},
+        "stage_2_call_completed": {"type": "boolean"},
+        "stage_3_clear_outcome": {"type": "boolean"},
+    },
+    "required": ["call_made", "outcome", "confidence",
+                 "stage_1_call_initiated", "stage_2_call_completed", "stage_3_clear_outcome"],
+})
+
 
 # ============= GLOBAL STATE =============
 class SplashCashDetector:
-    def __init__(self):
+    def __init__(self, on_status=None, stream_url=None):
         self.logger = logger
+        self.on_status = on_status
+        self.stream_url = stream_url or LIVE_STREAM_URL
+        self.result = None
         self.session_id = None
+        self.session_dir = None
+        self.subscription = None
+        self.previous_tail = b""
         self.is_recording = False
         self.chunks_recorded = 0
         self.outcome_detected = False
         self.call_detected = False
         self.session_start_time = None
-        self.transcript_content = ""
+        self.transcripts = None
+        self.stitcher = None
+        self.audio_seconds = 0.0
+        self.chunk_spans = {}
+        self.timing = dict(TIMING_DEFAULTS)
+        self.timings = {}
+        self.recording_offset = None
+        self.last_chunk = None
+        self.chunk_captured_at = None
         
         # Create directories
         from pathlib import Path
@@ -139,42 +204,76 @@ class SplashCashDetector:
         self.logger.info("=== Splash Cash Detector Initialized ===")
 
     
-    def start_detection_session(self):
-        """Start a new detection session after alarm trigger"""
+    async def start_detection_session(self, session_id=None):
+        """
+        Run a detection session after alarm trigger. A coroutine: sessions run on the
+        comp runtime (see comps/splash_sessions.py and comp_runtime.py).
+
+        Returns:
+            dict: {"outcome": ..., "message": ...}; message is None when nothing should be sent.
+        """
         # Prevent multiple sessions
         if self.is_recording:
             self.logger.warning("Session already in progress. Ignoring new trigger.")
-            return
+            return None
             
         from datetime import datetime
-        self.session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.session_id = session_id or datetime.now().strftime("%Y%m%d_%H%M%S")
         self.session_start_time = datetime.now()
         self.is_recording = False
         self.chunks_recorded = 0
         self.outcome_detected = False
         self.call_detected = False
-        self.transcript_content = ""
+        self.transcripts = TranscriptStore(self.session_id)
+        self.stitcher = TranscriptStitcher()
+        self.audio_seconds = 0.0
+        self.chunk_spans = {}
+        # Timing constants for this session, and when its events happened (seconds after the alarm)
+        self.timing = await asyncio.to_thread(timing_profile, "splash", TIMING_DEFAULTS)
+        self.timings = {}
+        self.recording_offset = None
+        self.last_chunk = None
+        self.chunk_captured_at = None
+        self.result = None
+        self.previous_tail = b""
+        
+        # Per-session files, so overlapping sessions never share output
+        import os
+        self.session_dir = os.path.join(CHUNK_DIR, self.session_id)
+        os.makedirs(self.session_dir, exist_ok=True)
         
         self.logger.info(f"=== NEW SESSION STARTED: {self.session_id} ===")
         self.logger.info(f"Alarm triggered at: {self.session_start_time}")
         
-        # Start the detection process
-        # import threading
-        # threading.Thread(target=self._detection_workflow, daemon=True).start()
-        self._detection_workflow()
-
-    def _detection_workflow(self):
+        await self._detection_workflow()
+        return self.result
+
+    def _session_file(self, filename):
+        """Path of one of this session's files"""
+        import os
+        return os.path.join(self.session_dir, filename)
+
+    async def _set_status(self, state, **fields):
+        """Report progress to whoever started the session."""
+        if self.on_status:
+            try:
+                await self.on_status(state, **fields)
+            except Exception as e:
+                self.logger.error(f"Error reporting session status: {e}")
+
+    async def _detection_workflow(self):
         """Main detection workflow"""
         try:
-            # Phase 1: Initial delay
-            self.logger.info(f"Waiting {INITIAL_DELAY_MINUTES} minutes before starting recording...")
-            time.sleep(INITIAL_DELAY_MINUTES * 60)
-            
-            self.logger.info("Initial delay complete. Starting recording workflow.")
+            # Phase 1: Wait for the segment to start (or the fixed initial delay)
+            await self._set_status("waiting")
+            await self._wait_for_segment_start()
             
             # Phase 2: Recording and processing
             self.is_recording = True
-            max_chunks = (MAX_RECORDING_MINUTES // CHUNK_DURATION_MINUTES) + 1
+            # Alarm -> first recorded sample (the pre-roll reaches back before now)
+            self.recording_offset = (datetime.now() - self.session_start_time).total_seconds() - self.audio_seconds
+            self.timings["recording_start_seconds"] = round(self.recording_offset, 2)
+            max_chunks = int(MAX_RECORDING_MINUTES // self.timing["CHUNK_DURATION_MINUTES"]) + 1
             
             for chunk_num in range(1, max_chunks + 1):
                 if self.outcome_detected:
@@ -182,27 +281,27 @@ class SplashCashDetector:
                     break
                 
                 # Record chunk
-                chunk_file = self._record_chunk(chunk_num)
+                await self._set_status("recording", chunks_recorded=self.chunks_recorded)
+                chunk_file = await self._record_chunk(chunk_num)
                 if not chunk_file:
                     continue
                 
                 # Transcribe chunk
-                transcript = self._transcribe_chunk(chunk_file)
+                transcript = await self._transcribe_chunk(chunk_file)
                 if transcript:
-                    self.transcript_content += f"\n--- Chunk {chunk_num} ---\n{transcript}"
-                    self._save_transcript()
+                    await self._save_transcript(chunk_num, transcript)
                 
                 # Check for outcome after every chunk (if we have enough content)
-                total_minutes = chunk_num * CHUNK_DURATION_MINUTES
-                if total_minutes >= OUTCOME_CHECK_MINUTES and not self.outcome_detected:
+                total_minutes = chunk_num * self.timing["CHUNK_DURATION_MINUTES"]
+                if total_minutes >= self.timing["OUTCOME_CHECK_MINUTES"] and not self.outcome_detected:
                     self.logger.info(f"Sufficient content recorded ({total_minutes} mins). Starting analysis...")
-                    self._analyze_transcript()
+                    await self._analyze_transcript()
             
             # Timeout fallback
             if not self.outcome_detected:
                 if self.call_detected:
                     self.logger.warning("Maximum recording time reached without outcome detection")
-                    self._send_fallback_message()
+                    await self._send_fallback_message()
                 else:
                     self.logger.info("No call detected during entire recording session. No SMS will be sent.")
                     # Save no-call response
@@ -211,117 +310,169 @@ class SplashCashDetector:
                         "message": "No competition call was detected in the audio stream",
                         "timestamp": datetime.now().isoformat()
                     }
-                    import json
-                    with open(GPT_RESPONSE_FILE, 'w', encoding='utf-8') as f:
+                    with open(self._session_file(GPT_RESPONSE_FILE), 'w', encoding='utf-8') as f:
                         json.dump(no_call_response, f, indent=2)
+                    self.result = {"outcome": "NO_CALL_DETECTED", "message": None}
             
         except Exception as e:
             self.logger.error(f"Error in detection workflow: {e}")
-            self._send_fallback_message()
+            await self._send_fallback_message()
         finally:
+            self._record_timings()
             self._cleanup_session()
 
-    def _record_chunk(self, chunk_num):
-        """Record a single audio chunk using ffmpeg"""
+    def _record_timings(self):
+        """Add this session's event timings to the timing history"""
+        stage1 = first_phrase_seconds(self.stitcher.emitted) if self.stitcher else None
+        if self.recording_offset is not None:
+            if stage1 is not None:
+                self.timings["stage1_recording_seconds"] = round(stage1, 2)
+                self.timings["stage1_seconds"] = round(self.recording_offset + stage1, 2)
+            # The call may have begun before the recording did: its true start is unknown.
+            self.timings["stage1_censored"] = (stage1 < STAGE1_CENSOR_SECONDS if stage1 is not None
+                                               else self.call_detected)
+        record_timings("splash", self.session_id, self.session_start_time.timestamp(),
+                       outcome=(self.result or {}).get("outcome"), **self.timings)
+
+    def _subscribe(self):
+        """Listen to the shared capture of the stream from now on"""
+        self.subscription = get_capture_hub(self.stream_url).subscribe(f"splash-{self.session_id}",
+                                                                       loop=asyncio.get_running_loop())
+
+    async def _wait_for_segment_start(self):
+        """
+        Start recording when the segment's bed music or sting is heard, with up to
+        SEGMENT_PREROLL_SECONDS of audio from before it; after INITIAL_DELAY_MINUTES
+        without a match, start anyway (the old fixed delay).
+        """
+        index = _get_segment_index()
+        initial_delay = self.timing["INITIAL_DELAY_MINUTES"]
+        if index is None:
+            self.logger.info(f"Waiting {initial_delay} minutes before starting recording...")
+            await asyncio.sleep(initial_delay * 60)
+            self.logger.info("Initial delay complete. Starting recording workflow.")
+            self._subscribe()
+            return
+
+        self.logger.info(f"Watching for the segment start (up to {initial_delay} minutes)...")
+        self._subscribe()
+        detector = SegmentStartDetector(index, step_seconds=SEGMENT_WATCH_STEP_SECONDS)
+        preroll_bytes = SEGMENT_PREROLL_SECONDS * CAPTURE_BYTES_PER_SECOND
+        recent = b""
+        deadline = asyncio.get_running_loop().time() + initial_delay * 60
+        while asyncio.get_running_loop().time() < deadline:
+            pcm = await self.subscription.read_seconds(SEGMENT_WATCH_STEP_SECONDS)
+            if not pcm:
+                break
+            recent = (recent + pcm)[-(preroll_bytes + len(pcm)):]
+            found = detector.feed(np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0)
+            if not found:
+                continue
+            marker, score, start = found
+            heard = detector.samples_seen / CAPTURE_SAMPLE_RATE
+            keep = int(min(heard - start + SEGMENT_PREROLL_SECONDS, len(recent) / CAPTURE_BYTES_PER_SECOND)
+                       * CAPTURE_BYTES_PER_SECOND) & ~1
+            self.previous_tail = recent[len(recent) - keep:] if keep > 0 else b""
+            self.audio_seconds = len(self.previous_tail) / CAPTURE_BYTES_PER_SECOND
+            elapsed = (datetime.now() - self.session_start_time).total_seconds()
+            offset = round(elapsed - (heard - start), 2)
+            self.logger.info(f"Segment start detected: '{marker}' (score {score}) {offset}s after the alarm; "
+                             f"recording with {self.audio_seconds:.1f}s of pre-roll")
+            metrics.observe("splash.segment_start_seconds", offset)
+            self.timings["segment_start_seconds"] = offset
+            await self._set_status("waiting", segment_marker=marker, segment_start_seconds=offset)
+            return
+        self.logger.info(f"Segment start not detected within {initial_delay} minutes. Starting recording workflow.")
+        metrics.incr("splash.segment_start_fallback")
+
+    async def _record_chunk(self, chunk_num):
+        """Take the next chunk from the shared capture and encode it for upload"""
         try:
-            import subprocess, os
-            # For live streams, we record in real-time chunks (no seeking)
-            duration = CHUNK_DURATION_MINUTES * 60 + CHUNK_OVERLAP_SECONDS
-            
-            chunk_filename = f"session_{self.session_id}_chunk_{chunk_num:02d}.mp3"
-            chunk_path = os.path.join(CHUNK_DIR, chunk_filename)
-            
-            self.logger.info(f"Recording chunk {chunk_num}: {chunk_filename} (duration: {duration}s)")
-            
-            # ffmpeg command for live stream recording
-            cmd = [
-                '/usr/bin/ffmpeg',
-                '-i', LIVE_STREAM_URL,
-                '-t', str(duration),  # Record for this duration
-                '-acodec', 'libmp3lame',  # Use libmp3lame for better compatibility
-                '-ab', '128k',
-                '-ar', '44100',  # Sample rate
-                '-ac', '2',      # Stereo
-                '-y',            # Overwrite output file
-                '-loglevel', 'error',  # Reduce ffmpeg output
-                chunk_path
-            ]
-            
-            self.logger.info(f"Running ffmpeg command: {' '.join(cmd)}")
-            
-            # Record chunk with timeout
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=duration + 60)
-            
-            if result.returncode == 0:
-                if os.path.exists(chunk_path):
-                    file_size = os.path.getsize(chunk_path)
-                    self.logger.info(f"Chunk {chunk_num} recorded successfully. Size: {file_size} bytes")
-                    self.chunks_recorded += 1
-                    return chunk_path
-                else:
-                    self.logger.error(f"Chunk file was not created: {chunk_path}")
-                    return None
-            else:
-                self.logger.error(f"ffmpeg error for chunk {chunk_num}:")
-                self.logger.error(f"Return code: {result.returncode}")
-                self.logger.error(f"stderr: {result.stderr}")
-                self.logger.error(f"stdout: {result.stdout}")
+            import os
+            import numpy as np
+            duration = self.timing["CHUNK_DURATION_MINUTES"] * 60
+            
+            profile = get_audio_profile()
+            chunk_filename = f"chunk_{chunk_num:02d}.{profile.extension}"
+            chunk_path = os.path.join(self.session_dir, chunk_filename)
+            
+            self.logger.info(f"Recording chunk {chunk_num}: {chunk_filename} (duration: {duration}s + {CHUNK_OVERLAP_SECONDS}s overlap, profile: {profile.name})")
+            
+            # Audio keeps queueing in the subscription while we transcribe, so chunks are
+            # contiguous; the tail of the previous chunk is repeated as the overlap.
+            audio = await self.subscription.read_seconds(duration)
+            if not audio:
+                self.logger.error(f"No audio captured for chunk {chunk_num}")
                 return None
+            self.last_chunk = chunk_num
+            self.chunk_captured_at = asyncio.get_running_loop().time()
+            pcm = self.previous_tail + audio
+            start = self.audio_seconds - len(self.previous_tail) / CAPTURE_BYTES_PER_SECOND
+            self.audio_seconds += len(audio) / CAPTURE_BYTES_PER_SECOND
+            self.chunk_spans[chunk_num] = (start, self.audio_seconds)
+            self.previous_tail = audio[-CHUNK_OVERLAP_SECONDS * CAPTURE_BYTES_PER_SECOND:]
+            
+            await encode_pcm_async(np.frombuffer(pcm, dtype=np.int16), chunk_path, sample_rate=CAPTURE_SAMPLE_RATE, profile=profile)
+            file_size = os.path.getsize(chunk_path)
+            self.logger.info(f"Chunk {chunk_num} recorded successfully. Size: {file_size} bytes")
+            self.chunks_recorded += 1
+            return chunk_path
                 
-        except subprocess.TimeoutExpired:
-            self.logger.error(f"Timeout recording chunk {chunk_num} after {duration + 60} seconds")
-            return None
         except Exception as e:
             self.logger.error(f"Error recording chunk {chunk_num}: {e}")
             return None
 
-    def _transcribe_chunk(self, chunk_file):
-        """Transcribe audio chunk using Whisper API"""
+    async def _transcribe_chunk(self, chunk_file):
+        """Transcribe audio chunk into timed segments (seconds into the chunk) using the configured backend"""
         try:
             import os
             self.logger.info(f"Transcribing: {os.path.basename(chunk_file)}")
             
-            headers = {
-                'Authorization': f'Bearer {OPENAI_API_KEY}'
-            }
-            
-            with open(chunk_file, 'rb') as audio_file:
-                files = {
-                    'file': audio_file,
-                    'model': (None, 'whisper-1'),
-                    'language': (None, 'en')
-                }
-                
-                response = requests.post(WHISPER_API_URL, headers=headers, files=files, timeout=120)
-            
-            if response.status_code == 200:
-                transcript = response.json().get('text', '')
-                self.logger.info(f"Transcription completed. Length: {len(transcript)} characters")
-                return transcript
-            else:
-                self.logger.error(f"Whisper API error: {response.status_code} - {response.text}")
+            # Only the presenter's speech matters - skip music and adverts entirely.
+            # Segmentation is CPU work, so it runs off the event loop.
+            speech_file, regions = await asyncio.to_thread(prepare_for_transcription, chunk_file)
+            if not speech_file:
+                self.logger.info(f"No speech found in {os.path.basename(chunk_file)}. Skipping transcription.")
                 return None
+            
+            segments = await get_transcription_backend().transcribe_segments_async(speech_file, language='en', timeout=120)
+            if regions is not None:
+                # Times in the speech-only file -> times in the chunk
+                for segment in segments:
+                    segment["start"] = regions.to_source_time(segment["start"])
+                    if segment["end"] is not None:
+                        segment["end"] = regions.to_source_time(segment["end"])
+            self.logger.info(f"Transcription completed. {len(segments)} segments, "
+                             f"{sum(len(segment['text']) for segment in segments)} characters")
+            return segments
                 
         except Exception as e:
             self.logger.error(f"Error transcribing chunk: {e}")
             return None
     
-    def _save_transcript(self):
-        """Save current transcript to file"""
+    async def _save_transcript(self, chunk_num, segments):
+        """Append the part of a chunk's transcript not heard in the previous chunk to the transcript store"""
         try:
-            with open(TRANSCRIPT_FILE, 'w', encoding='utf-8') as f:
-                f.write(self.transcript_content)
-            self.logger.info("Transcript saved to file")
+            start, end = self.chunk_spans.get(chunk_num, (0.0, None))
+            new = self.stitcher.add(segments, offset=start, end=end)
+            if not new:
+                self.logger.info(f"Chunk {chunk_num} only repeated the overlap; nothing new to store")
+                return
+            transcript = " ".join(segment["text"].strip() for segment in new)
+            await asyncio.to_thread(self.transcripts.append, chunk_num, transcript, start=new[0]["start"], end=end)
+            self.logger.info(f"Transcript of chunk {chunk_num} stored ({len(self.transcripts)} chunks so far, "
+                             f"{self.stitcher.duplicate_words} repeated words dropped)")
         except Exception as e:
             self.logger.error(f"Error saving transcript: {e}")
 
-    def _analyze_transcript(self):
+    async def _analyze_transcript(self):
         """Analyze transcript with GPT-3.5 for outcome detection"""
         try:
             self.logger.info("Analyzing transcript with GPT-3.5 Turbo...")
+            await self._set_status("analyzing", chunks_recorded=self.chunks_recorded)
             
             # Bulletproof analysis (no timing extraction)
-            analysis = self._call_gpt_analysis(self.transcript_content)
+            analysis = await self._call_gpt_analysis(self.transcripts.parts())
             if not analysis:
                 return
             
@@ -335,48 +486,52 @@ class SplashCashDetector:
             
             if outcome in ['WIN', 'LOSE']:
                 self.logger.info(f"{outcome} detected! Recording additional time for complete context...")
+                self.timings.update(
+                    outcome_chunk=self.last_chunk,
+                    outcome_seconds=round(self.recording_offset + self.audio_seconds, 2),
+                    analysis_seconds=round(asyncio.get_running_loop().time() - self.chunk_captured_at, 2))
                 # Record additional time to ensure we have complete context
-                self._record_additional_context(analysis)
+                await self._record_additional_context(analysis)
             elif outcome == 'UNKNOWN':
                 self.logger.info("Outcome still unknown. Continuing recording...")
                 
         except Exception as e:
             self.logger.error(f"Error analyzing transcript: {e}")
 
-    def _record_additional_context(self, initial_analysis):
+    async def _record_additional_context(self, initial_analysis):
         """Record additional chunks to ensure complete context"""
         try:
             outcome = initial_analysis.get('outcome')
             
             # Record additional chunks for complete context
-            additional_chunks = NEXT_ROUND_WAIT_MINUTES // CHUNK_DURATION_MINUTES + 1
+            additional_chunks = int(self.timing["NEXT_ROUND_WAIT_MINUTES"] // self.timing["CHUNK_DURATION_MINUTES"]) + 1
             start_chunk = self.chunks_recorded + 1
             end_chunk = start_chunk + additional_chunks
             
             self.logger.info(f"Recording {additional_chunks} additional chunks for complete context")
             
             for chunk_num in range(start_chunk, end_chunk + 1):
-                chunk_file = self._record_chunk(chunk_num)
+                chunk_file = await self._record_chunk(chunk_num)
                 if chunk_file:
-                    transcript = self._transcribe_chunk(chunk_file)
+                    transcript = await self._transcribe_chunk(chunk_file)
                     if transcript:
-                        self.transcript_content += f"\n--- Chunk {chunk_num} ---\n{transcript}"
-                        self._save_transcript()
+                        await self._save_transcript(chunk_num, transcript)
             
             # Re-analyze with complete transcript
-            final_analysis = self._call_gpt_analysis(self.transcript_content)
+            final_analysis = await self._call_gpt_analysis(self.transcripts.parts())
             if final_analysis:
                 self.logger.info(f"Final Analysis Result: {final_analysis}")
-                self._finalize_and_send_sms(final_analysis)
+                self.timings["confirmation_changed"] = final_analysis.get('outcome') != outcome
+                await self._finalize_and_send_sms(final_analysis)
             else:
                 # Use initial analysis if final analysis fails
-                self._finalize_and_send_sms(initial_analysis)
+                await self._finalize_and_send_sms(initial_analysis)
             
         except Exception as e:
             self.logger.error(f"Error recording additional context: {e}")
-            self._finalize_and_send_sms(initial_analysis)
+            await self._finalize_and_send_sms(initial_analysis)
 
-    def _finalize_and_send_sms(self, analysis):
+    async def _finalize_and_send_sms(self, analysis):
         """Generate final SMS and send notification"""
         try:
             outcome = analysis.get('outcome', 'UNKNOWN')
@@ -391,7 +546,6 @@ class SplashCashDetector:
             
             # Create final result
             from datetime import datetime
-            import json
             final_result = {
                 "call_made": analysis.get('call_made', False),
                 "outcome": outcome,
@@ -404,121 +558,79 @@ class SplashCashDetector:
             }
             
             # Save final response
-            with open(GPT_RESPONSE_FILE, 'w', encoding='utf-8') as f:
+            with open(self._session_file(GPT_RESPONSE_FILE), 'w', encoding='utf-8') as f:
                 json.dump(final_result, f, indent=2)
             
             # Send SMS
-            self._send_sms(sms_message)
+            await self._send_sms(sms_message)
+            self.result = {"outcome": outcome, "message": sms_message}
             self.outcome_detected = True
             
         except Exception as e:
             self.logger.error(f"Error finalizing SMS: {e}")
-            self._send_fallback_message()
+            await self._send_fallback_message()
             self.outcome_detected = True
     
-    def _call_gpt_analysis(self, transcript):
-        """Call GPT-3.5 Turbo for transcript analysis"""
+    async def _call_gpt_analysis(self, transcript_parts):
+        """Call GPT-3.5 Turbo for transcript analysis (structured output, see llm_client.py)"""
         try:
-            prompt = BULLETPROOF_ANALYSIS_PROMPT.format(transcript_text=transcript)
-            
-            headers = {
-                'Authorization': f'Bearer {OPENAI_API_KEY}',
-                'Content-Type': 'application/json'
-            }
-            
-            data = {
-                "model": "gpt-3.5-turbo-16k",
-                "messages": [
-                    {"role": "system", "content": SYSTEM_CONSTRAINTS},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.1,
-                "max_tokens": 400,
-                "top_p": 0.9,
-                "frequency_penalty": 0.3,
-                "presence_penalty": 0.2
-            }
-            
-            response = requests.post(GPT_API_URL, headers=headers, json=data, timeout=60)
-            
-            if response.status_code == 200:
-                gpt_response = response.json()
-                content = gpt_response['choices'][0]['message']['content']
-                
-                # Validate and parse JSON response
-                is_valid, result = self._validate_gpt_response(content)
-                if is_valid:
-                    return result
-                else:
-                    self.logger.error(f"Invalid GPT response: {result}")
-                    return None
-            else:
-                self.logger.error(f"GPT API error: {response.status_code} - {response.text}")
-                return None
+            # Oldest chunks are dropped first if the transcript outgrows the token budget
+            messages = ANALYSIS_PROMPT.messages(transcript_parts)
+            data = await get_llm_client().complete_json_async(
+                "splash_analysis", messages, ANALYSIS_SCHEMA, model="gpt-3.5-turbo-16k",
+                budget_seconds=GPT_BUDGET_SECONDS,
+                temperature=0.1,
+                max_tokens=400,
+                top_p=0.9,
+            )
+            return self._apply_stage_rules(data)
                 
+        except LLMError as e:
+            self.logger.error(f"Invalid GPT response: {e}")
+            return None
         except Exception as e:
             self.logger.error(f"Error calling GPT: {e}")
             return None
     
-    def _validate_gpt_response(self, response_text):
-        """Validate GPT response format"""
-        try:
-            import json
-            data = json.loads(response_text.strip())
-            
-            required_keys = ["call_made", "outcome", "sms_message", "confidence", 
-                           "stage_1_call_initiated", "stage_2_call_completed", "stage_3_clear_outcome"]
-            valid_outcomes = ["WIN", "LOSE", "UNKNOWN"]
-            
-            if not all(key in data for key in required_keys):
-                return False, "Missing required keys"
-            if data["outcome"] not in valid_outcomes:
-                return False, "Invalid outcome value"
-            if len(data["sms_message"]) > MAX_SMS_LENGTH:
-                return False, "SMS message too long"
-            
-            # Additional validation: Only allow WIN/LOSE if all stages detected
-            if data["outcome"] in ["WIN", "LOSE"]:
-                if not (data["stage_1_call_initiated"] and 
-                       data["stage_2_call_completed"] and 
-                       data["stage_3_clear_outcome"]):
-                    self.logger.warning("WIN/LOSE declared without all stages detected. Forcing UNKNOWN.")
-                    data["outcome"] = "UNKNOWN"
-                
-            return True, data
-            
-        except json.JSONDecodeError as e:
-            return False, f"Invalid JSON response: {e}"
+    def _apply_stage_rules(self, data):
+        """Only allow WIN/LOSE if all stages were detected"""
+        if data["outcome"] in ["WIN", "LOSE"]:
+            if not (data["stage_1_call_initiated"] and 
+                   data["stage_2_call_completed"] and 
+                   data["stage_3_clear_outcome"]):
+                self.logger.warning("WIN/LOSE declared without all stages detected. Forcing UNKNOWN.")
+                data["outcome"] = "UNKNOWN"
+        return data
     
-    def _send_sms(self, message):
+    async def _send_sms(self, message):
         """Send SMS notification (placeholder - implement your SMS service)"""
         try:
             self.logger.info(f"SMS NOTIFICATION: {message}")
             
             # TODO: Implement actual SMS sending logic here
             # This could be Twilio, AWS SNS, or your existing SMS service
-            manager = RedisContactManager()
-            manager.redis_client.set("SPLASH_MESSAGE",message)
+            await get_runtime().redis().set(SESSION_MESSAGE_KEY.format(session_id=self.session_id), message,
+                                            ex=SESSION_MESSAGE_TTL_SECONDS)
             # For now, just log the message
             print(f"\n🔔 SMS ALERT: {message}\n")
             
         except Exception as e:
             self.logger.error(f"Error sending SMS: {e}")
     
-    def _send_fallback_message(self):
+    async def _send_fallback_message(self):
         """Send fallback message when outcome cannot be determined"""
         self.logger.info("Sending fallback message")
-        self._send_sms(FALLBACK_MESSAGE)
+        await self._send_sms(FALLBACK_MESSAGE)
+        self.result = {"outcome": "TIMEOUT", "message": FALLBACK_MESSAGE}
         
         # Save fallback response
         from datetime import datetime
-        import json
         fallback_response = {
             "outcome": "TIMEOUT",
             "message": FALLBACK_MESSAGE,
             "timestamp": datetime.now().isoformat()
         }
-        with open(GPT_RESPONSE_FILE, 'w', encoding='utf-8') as f:
+        with open(self._session_file(GPT_RESPONSE_FILE), 'w', encoding='utf-8') as f:
             json.dump(fallback_response, f, indent=2)
     
     def _cleanup_session(self):
@@ -527,10 +639,16 @@ class SplashCashDetector:
             import os
             self.logger.info("Cleaning up session...")
             
-            # Clean up transcript file for next session
-            if os.path.exists(TRANSCRIPT_FILE):
-                os.remove(TRANSCRIPT_FILE)
-                self.logger.info("Transcript file cleaned up")
+            # Stop listening to the shared capture
+            if self.subscription:
+                self.subscription.close()
+                self.subscription = None
+            
+            # Clean up this session's audio; the GPT response is kept and the transcript stays in its store
+            for filename in os.listdir(self.session_dir):
+                if filename != GPT_RESPONSE_FILE:
+                    os.remove(os.path.join(self.session_dir, filename))
+            self.logger.info("Session audio cleaned up")
             
             self.is_recording = False
             self.logger.info(f"=== SESSION {self.session_id} COMPLETED ===")
@@ -539,10 +657,24 @@ class SplashCashDetector:
             self.logger.error(f"Error during cleanup: {e}")
 
 # ============= ASYNC FUNCTION FOR SERVER INTEGRATION =============
-def detect_splash_cash_outcome_async():
-    """Function called by splash.py - creates detector and starts session"""
-    detector = SplashCashDetector()
-    detector.start_detection_session()
+_segment_index = None
+
+
+def _get_segment_index():
+    """The segment-start fingerprint index, loaded once; None when it has not been built."""
+    global _segment_index
+    if _segment_index is None and os.path.exists(SPLASH_SEGMENT_INDEX):
+        try:
+            _segment_index = FingerprintIndex.load(SPLASH_SEGMENT_INDEX)
+        except Exception as e:
+            logger.error(f"Could not load segment index {SPLASH_SEGMENT_INDEX}: {e}")
+    return _segment_index
+
+
+def detect_splash_cash_outcome_async(alarm_id="manual", stream_url=None, trigger_id=None):
+    """Start a background detection session for an alarm and return its session id"""
+    from comps.splash_sessions import get_session_manager
+    return get_session_manager().start_session(alarm_id, stream_url=stream_url, trigger_id=trigger_id)
 
 # # ============= MAIN EXECUTION =============
 # def main():
@@ -0,0 +1,167 @@
+# SPLASH THE CASH DETECTION SESSIONS.
+# Each alarm starts one detection session as a tracked task on the comp runtime's event
+# loop (comp_runtime.py), so the alarm message can go out immediately and a worker can
+# keep many sessions waiting at once. When the session finishes, its outcome message is
+# queued in the outbox for the messaging server as a second event. Session status is kept in Redis so
+# any worker can report it (see /splash/sessions in app.py).
+
+import asyncio
+import json
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from comp_runtime import get_runtime
+from logger import logger
+from outbox import enqueue
+from redis_cache import RedisContactManager
+from transcript_store import TranscriptStore
+
+COMP_NAME = "Splash The Cash"
+
+SESSION_KEY_PREFIX = "splash:session:"        # hash per session
+SESSIONS_INDEX_KEY = "splash:sessions"        # sorted set of session ids by start time
+SESSION_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Session states, in the order a session normally goes through them.
+PENDING = "pending"
+WAITING = "waiting"            # initial delay after the alarm
+RECORDING = "recording"
+ANALYZING = "analyzing"
+SENDING = "sending"            # outcome being queued in the outbox
+COMPLETED = "completed"
+FAILED = "failed"
+ACTIVE_STATES = (PENDING, WAITING, RECORDING, ANALYZING, SENDING)
+
+
+class SplashSessionManager:
+    """Starts, tracks and reports Splash The Cash detection sessions."""
+
+    def __init__(self, redis_client=None):
+        self.redis_client = redis_client or RedisContactManager().redis_client
+        self.runtime = get_runtime()
+        self.tasks = {}                # session id -> (future, alarm id, trigger id)
+        self._lock = threading.Lock()
+
+    def start_session(self, alarm_id, stream_url=None, trigger_id=None):
+        """
+        Start outcome detection for an alarm in the background. Sessions run side by side,
+        also for the same alarm (a new round while the last one is still recording), and
+        share one capture of each stream.
+
+        Args:
+            alarm_id (str): Alert type that fired.
+            trigger_id (str): Id of the trigger (e.g. the callback); a trigger delivered
+                twice starts only one session. Without it every call starts a session.
+
+        Returns:
+            str: The session id, or None if a session for this trigger is already running.
+        """
+        with self._lock:
+            if trigger_id is not None:
+                for session_id, (future, _, running_trigger) in self.tasks.items():
+                    if not future.done() and running_trigger == trigger_id:
+                        logger.warning(f"Splash session {session_id} is already running for trigger {trigger_id}")
+                        return None
+            session_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{alarm_id}"
+            if session_id in self.tasks:
+                # A second round of the same alarm in the same second still gets its own session.
+                session_id = f"{session_id}_{(trigger_id or uuid.uuid4().hex)[:8]}"
+            self.update_status(session_id, state=PENDING, alarm_id=alarm_id, trigger_id=trigger_id, started_at=time.time())
+            self.redis_client.zadd(SESSIONS_INDEX_KEY, {session_id: time.time()})
+            future = self.runtime.submit(self._run_session(session_id, stream_url))
+            self.tasks[session_id] = (future, alarm_id, trigger_id)
+            future.add_done_callback(lambda _: self._forget(session_id))
+        logger.info(f"Splash session {session_id} started in the background for alarm {alarm_id}")
+        return session_id
+
+    def _forget(self, session_id):
+        with self._lock:
+            self.tasks.pop(session_id, None)
+
+    async def _run_session(self, session_id, stream_url=None):
+        from comps.splash_cash_detector import SplashCashDetector
+
+        async def on_status(state, **fields):
+            await self.update_status_async(session_id, state=state, **fields)
+
+        try:
+            detector = SplashCashDetector(on_status=on_status, stream_url=stream_url)
+            result = await detector.start_detection_session(session_id=session_id)
+            message = result.get("message") if result else None
+            if not message:
+                await on_status(COMPLETED, outcome=(result or {}).get("outcome"), finished_at=time.time())
+                logger.info(f"Splash session {session_id} finished without an outcome message to send")
+                return
+
+            await on_status(SENDING, outcome=result["outcome"], message=message)
+            # One outcome per session: the session id is the idempotency key.
+            message_id = await asyncio.to_thread(enqueue, COMP_NAME, message, f"splash:{session_id}", immediate=True)
+            await on_status(COMPLETED, outbox_message_id=message_id, finished_at=time.time())
+        except Exception as e:
+            logger.exception(f"Splash session {session_id} failed")
+            await on_status(FAILED, error=str(e), finished_at=time.time())
+
+    @staticmethod
+    def _status_mapping(fields):
+        mapping = {name: value if isinstance(value, (str, int, float)) else json.dumps(value)
+                   for name, value in fields.items() if value is not None}
+        mapping["updated_at"] = time.time()
+        return mapping
+
+    def update_status(self, session_id, **fields):
+        key = SESSION_KEY_PREFIX + session_id
+        try:
+            pipeline = self.redis_client.pipeline()
+            pipeline.hset(key, mapping=self._status_mapping(fields))
+            pipeline.expire(key, SESSION_TTL_SECONDS)
+            pipeline.execute()
+        except Exception as e:
+            logger.error(f"Could not update splash session {session_id} status: {e}")
+
+    async def update_status_async(self, session_id, **fields):
+        """update_status() for coroutines running on the comp runtime."""
+        key = SESSION_KEY_PREFIX + session_id
+        try:
+            async with self.runtime.redis().pipeline() as pipeline:
+                pipeline.hset(key, mapping=self._status_mapping(fields))
+                pipeline.expire(key, SESSION_TTL_SECONDS)
+                await pipeline.execute()
+        except Exception as e:
+            logger.error(f"Could not update splash session {session_id} status: {e}")
+
+    def get_status(self, session_id):
+        """Return the stored status of one session as a dict (empty if unknown)."""
+        data = self.redis_client.hgetall(SESSION_KEY_PREFIX + session_id)
+        status = {key.decode("utf-8"): value.decode("utf-8") for key, value in data.items()}
+        if status:
+            status["session_id"] = session_id
+        return status
+
+    def list_sessions(self, limit=20):
+        """Return the most recent sessions, newest first."""
+        session_ids = self.redis_client.zrevrange(SESSIONS_INDEX_KEY, 0, limit - 1)
+        sessions = [self.get_status(session_id.decode("utf-8")) for session_id in session_ids]
+        return [session for session in sessions if session]
+
+    def get_transcript(self, session_id):
+        """Return a session's transcript segments, also after the session has ended."""
+        return TranscriptStore(session_id, redis_client=self.redis_client).segments()
+
+    def active_sessions(self):
+        """Ids of the sessions running in this worker."""
+        with self._lock:
+            return [session_id for session_id, task in self.tasks.items() if not task[0].done()]
+
+
+_session_manager = None
+_session_manager_lock = threading.Lock()
+
+
+def get_session_manager():
+    global _session_manager
+    with _session_manager_lock:
+        if _session_manager is None:
+            _session_manager = SplashSessionManager()
+    return _session_manager
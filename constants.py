@@ -11,6 +11,8 @@ load_dotenv(".env-info")
 # MESSAGEING SERVER
 AUTH = os.getenv("AUTH")
 URL = os.getenv("URL")
+# optional endpoint accepting {"messages": [...]}; without it the outbox posts messages one by one
+MESSAGE_BATCH_URL = os.getenv("MESSAGE_BATCH_URL")
 
 
 # ACR API
@@ -57,4 +59,53 @@ LIVE_STREAM_URL = os.getenv('LIVE_STREAM_URL')
 
 # splash the cash
 WHISPER_API_URL = os.getenv("WHISPER_API_URL")
-GPT_API_URL = os.getenv("GPT_API_URL")
\ No newline at end of file
+GPT_API_URL = os.getenv("GPT_API_URL")
+
+# transcription backend: "http" (Whisper API) or "local" (faster-whisper on CPU)
+TRANSCRIPTION_BACKEND = os.getenv("TRANSCRIPTION_BACKEND", "http")
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "small.en")
+LOCAL_WHISPER_COMPUTE_TYPE = os.getenv("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+LOCAL_WHISPER_WORKERS = int(os.getenv("LOCAL_WHISPER_WORKERS", "2"))
+
+# speech/music segmentation before transcription
+SPEECH_FILTER_ENABLED = os.getenv("SPEECH_FILTER_ENABLED", "true").lower() == "true"
+
+# recording/upload audio profile: speech_mp3 (default), speech_opus or broadcast
+AUDIO_PROFILE = os.getenv("AUDIO_PROFILE", "speech_mp3")
+
+# contact storage in Redis: "hash" (one hash per contact) or "compact" (packed blobs in bucket hashes)
+CONTACT_STORAGE = os.getenv("CONTACT_STORAGE", "hash")
+# compact mode only: number of bucket hashes (~100 contacts each keeps them listpack encoded); fixed once contacts are stored
+CONTACT_BUCKETS = int(os.getenv("CONTACT_BUCKETS", "10000"))
+
+# local alarm-jingle detection on the live stream (alarm_detector.py); needs templates + manifest.json
+ALARM_DETECTOR_ENABLED = os.getenv("ALARM_DETECTOR_ENABLED", "false").lower() == "true"
+ALARM_TEMPLATE_DIR = os.getenv("ALARM_TEMPLATE_DIR", "alarm_templates")
+ALARM_MATCH_THRESHOLD = float(os.getenv("ALARM_MATCH_THRESHOLD", "0.5"))
+
+# Splash The Cash: fingerprint index of the segment's bed music/stings (audio_fingerprint.py build ...);
+# without it recording starts after the fixed initial delay
+SPLASH_SEGMENT_INDEX = os.getenv("SPLASH_SEGMENT_INDEX", "segment_markers/splash_index.npz")
+
+# rolling on-disk archive of the live stream (audio_archive.py); comps read their pre-roll from it
+AUDIO_ARCHIVE_ENABLED = os.getenv("AUDIO_ARCHIVE_ENABLED", "false").lower() == "true"
+AUDIO_ARCHIVE_DIR = os.getenv("AUDIO_ARCHIVE_DIR", "audio_archive")
+AUDIO_ARCHIVE_RETENTION_MINUTES = int(os.getenv("AUDIO_ARCHIVE_RETENTION_MINUTES", "60"))
+AUDIO_ARCHIVE_PREROLL_SECONDS = int(os.getenv("AUDIO_ARCHIVE_PREROLL_SECONDS", "10"))
+
+# recorded audio directories (comps) and their housekeeping (storage_manager.py)
+OUTPUT_DIR = "output_segments"
+PROCESSED_DIR = os.path.join(OUTPUT_DIR, "processed_segments")
+CHUNK_DIR = "./audio_chunks/"
+STORAGE_MANAGER_ENABLED = os.getenv("STORAGE_MANAGER_ENABLED", "true").lower() == "true"
+STORAGE_SWEEP_MINUTES = int(os.getenv("STORAGE_SWEEP_MINUTES", "10"))
+STORAGE_CHUNK_RETENTION_HOURS = int(os.getenv("STORAGE_CHUNK_RETENTION_HOURS", "24"))
+STORAGE_CHUNK_MAX_MB = int(os.getenv("STORAGE_CHUNK_MAX_MB", "2048"))
+STORAGE_PROCESSED_RETENTION_DAYS = int(os.getenv("STORAGE_PROCESSED_RETENTION_DAYS", "30"))
+STORAGE_PROCESSED_MAX_MB = int(os.getenv("STORAGE_PROCESSED_MAX_MB", "5120"))
+# audio profile kept recordings are re-encoded with (audio_profile.PROFILES)
+STORAGE_ARCHIVE_PROFILE = os.getenv("STORAGE_ARCHIVE_PROFILE", "speech_opus")
+
+# per-session comp timings (timing_history.py); with TIMING_AUTOTUNE the comps use the tuned timings
+TIMING_HISTORY_DB = os.getenv("TIMING_HISTORY_DB", "timing_history.sqlite3")
+TIMING_AUTOTUNE = os.getenv("TIMING_AUTOTUNE", "false").lower() == "true"
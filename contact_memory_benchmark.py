@@ -0,0 +1,56 @@
+# MEMORY PER CONTACT: HASH VS COMPACT STORAGE.
+# Loads synthetic contacts into an empty Redis database in each storage mode and reports
+# used_memory per contact. Needs a running Redis; the database given with --db is FLUSHED.
+#
+#   python contact_memory_benchmark.py --contacts 1000000 --db 15
+#
+# Compact buckets only stay listpack encoded while every blob fits in
+# hash-max-listpack-value (64 bytes by default); --listpack-value raises it for the run.
+
+import argparse
+
+from redis_cache import RedisContactManager
+
+
+def synthetic_contacts(count):
+    for i in range(count):
+        yield {
+            "id": str(1000000 + i),
+            "name": f"Contact {i}",
+            "phone": f"+4477{i:08d}",
+            "email": f"contact{i}@example.com",
+        }
+
+
+def measure(storage, count, db, batch_size):
+    manager = RedisContactManager(db=db, storage=storage)
+    client = manager.redis_client
+    client.flushdb()
+    before = client.info("memory")["used_memory"]
+    manager.bulk_load_contacts(synthetic_contacts(count), batch_size=batch_size)
+    after = client.info("memory")["used_memory"]
+    sample = "contacts:b:0" if storage == "compact" else "contact:1000000"
+    encoding = client.object("encoding", sample)
+    client.flushdb()
+    return (after - before) / count, encoding
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redis memory per contact in each storage mode")
+    parser.add_argument("--contacts", type=int, default=1000000)
+    parser.add_argument("--db", type=int, default=15)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--listpack-value", type=int, default=None,
+                        help="set hash-max-listpack-value for the run (e.g. 128)")
+    args = parser.parse_args()
+
+    if args.listpack_value:
+        RedisContactManager(db=args.db).redis_client.config_set("hash-max-listpack-value", args.listpack_value)
+
+    for storage in ("hash", "compact"):
+        per_contact, encoding = measure(storage, args.contacts, args.db, args.batch_size)
+        print(f"{storage:8s} {args.contacts} contacts: {per_contact:.1f} bytes/contact (sample key encoding: {encoding})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# PER-CAMPAIGN DELIVERY STATE ("has this contact been messaged this round?").
+# Every stored contact gets a permanent bit offset (contacts:index) when it is loaded.
+# A campaign has a generation counter and one bitmap per generation; "sent?" is a GETBIT
+# on the current generation's bitmap and starting a new round is a single INCR: the new
+# generation's bitmap is simply empty. Bitmaps of old generations are removed with
+# UNLINK by a background sweep, so a reset never walks the contacts.
+# The sent flag is no longer stored as a message_sent field in the contact hashes (reset
+# would have to rewrite every hash): RedisContactManager adds message_sent to the contacts
+# it returns, and anything reading contact:* hashes directly must ask sent_many() instead.
+
+import threading
+
+from logger import logger
+
+INDEX_KEY = "contacts:index"              # hash: contact id -> bit offset
+INDEX_SEQ_KEY = "contacts:index_seq"
+ALL_CONTACTS_KEY = "contacts_all"         # set of every stored contact id (source for re-queueing)
+INDEX_COMPLETE_KEY = "contacts:index_complete"   # set once every stored contact is in contacts_all
+GENERATION_KEY = "campaign:{campaign}:generation"
+SENT_KEY_PREFIX = "campaign:{campaign}:sent:"    # + generation -> bitmap
+DEFAULT_CAMPAIGN = "default"
+KEEP_GENERATIONS = 2                      # current + previous round stay readable
+GC_SCAN_COUNT = 100
+
+# Give ids without one a bit offset and record them in contacts_all.
+# KEYS: index hash, index sequence, contacts_all. ARGV: ids.
+ASSIGN_SCRIPT = """
+for _, id in ipairs(ARGV) do
+    if redis.call('HEXISTS', KEYS[1], id) == 0 then
+        redis.call('HSET', KEYS[1], id, redis.call('INCR', KEYS[2]) - 1)
+    end
+    redis.call('SADD', KEYS[3], id)
+end
+return #ARGV
+"""
+
+# Sent flags (0/1) of ARGV[2..] in the current generation. KEYS: generation, index hash.
+# ARGV[1]: sent key prefix.
+SENT_SCRIPT = """
+local key = ARGV[1] .. (redis.call('GET', KEYS[1]) or '0')
+local flags = {}
+for i = 2, #ARGV do
+    local offset = redis.call('HGET', KEYS[2], ARGV[i])
+    flags[#flags + 1] = offset and redis.call('GETBIT', key, offset) or 0
+end
+return flags
+"""
+
+# Set the sent bit of ARGV[2..] in the current generation. Same KEYS/ARGV as SENT_SCRIPT.
+MARK_SCRIPT = """
+local key = ARGV[1] .. (redis.call('GET', KEYS[1]) or '0')
+local marked = 0
+for i = 2, #ARGV do
+    local offset = redis.call('HGET', KEYS[2], ARGV[i])
+    if offset then
+        redis.call('SETBIT', key, offset, 1)
+        marked = marked + 1
+    end
+end
+return marked
+"""
+
+
+class DeliveryState:
+    """Sent flags of one campaign, stored as generation-stamped bitmaps."""
+
+    def __init__(self, redis_client, campaign=DEFAULT_CAMPAIGN):
+        self.redis_client = redis_client
+        self.campaign = campaign
+        self.generation_key = GENERATION_KEY.format(campaign=campaign)
+        self.sent_prefix = SENT_KEY_PREFIX.format(campaign=campaign)
+        self._assign = redis_client.register_script(ASSIGN_SCRIPT)
+        self._sent = redis_client.register_script(SENT_SCRIPT)
+        self._mark = redis_client.register_script(MARK_SCRIPT)
+
+    def generation(self):
+        return int(self.redis_client.get(self.generation_key) or 0)
+
+    def sent_key(self, generation=None):
+        return f"{self.sent_prefix}{self.generation() if generation is None else generation}"
+
+    def queue_assign(self, pipeline, contact_ids):
+        """Queue offset assignment for newly loaded contacts on a bulk-load pipeline."""
+        if contact_ids:
+            self._assign(keys=[INDEX_KEY, INDEX_SEQ_KEY, ALL_CONTACTS_KEY], args=contact_ids, client=pipeline)
+
+    def queue_forget(self, pipeline, contact_id):
+        """Queue removal of a deleted contact (its offset is not reused)."""
+        pipeline.hdel(INDEX_KEY, contact_id)
+        pipeline.srem(ALL_CONTACTS_KEY, contact_id)
+
+    def sent_many(self, contact_ids):
+        """Sent flags (bool) of contact_ids in the current generation, in one round trip."""
+        if not contact_ids:
+            return []
+        flags = self._sent(keys=[self.generation_key, INDEX_KEY], args=[self.sent_prefix, *contact_ids])
+        return [bool(flag) for flag in flags]
+
+    def is_sent(self, contact_id):
+        return self.sent_many([contact_id])[0]
+
+    def mark_sent(self, contact_ids):
+        if not contact_ids:
+            return 0
+        return self._mark(keys=[self.generation_key, INDEX_KEY], args=[self.sent_prefix, *contact_ids])
+
+    def sent_lookup(self):
+        """
+        A contact id -> sent flag function reading the whole bitmap once, for full listings.
+        """
+        bitmap = self.redis_client.get(self.sent_key()) or b""
+        offsets = self.redis_client.hgetall(INDEX_KEY)
+
+        def is_sent(contact_id):
+            offset = offsets.get(str(contact_id).encode("utf-8"))
+            if offset is None:
+                return False
+            offset = int(offset)
+            byte = offset // 8
+            return byte < len(bitmap) and bool(bitmap[byte] & (0x80 >> (offset % 8)))
+        return is_sent
+
+    def sent_count(self):
+        return self.redis_client.bitcount(self.sent_key())
+
+    def queue_reset(self, pipeline):
+        """Queue the generation INCR on a pipeline; call sweep_in_background() after executing it."""
+        pipeline.incr(self.generation_key)
+
+    def reset(self):
+        """Start a new round: every contact reads as unsent from now on."""
+        generation = self.redis_client.incr(self.generation_key)
+        self.sweep_in_background()
+        return generation
+
+    def sweep_in_background(self):
+        threading.Thread(target=self.collect_garbage, name=f"delivery-gc-{self.campaign}", daemon=True).start()
+
+    def collect_garbage(self):
+        """UNLINK the bitmaps of generations older than the last KEEP_GENERATIONS."""
+        try:
+            oldest_kept = self.generation() - KEEP_GENERATIONS + 1
+            stale = []
+            for key in self.redis_client.scan_iter(match=f"{self.sent_prefix}*", count=GC_SCAN_COUNT):
+                generation = key.decode("utf-8")[len(self.sent_prefix):]
+                if generation.isdigit() and int(generation) < oldest_kept:
+                    stale.append(key)
+            if stale:
+                self.redis_client.unlink(*stale)
+                logger.info(f"Removed {len(stale)} old delivery bitmaps of campaign {self.campaign}")
+        except Exception as e:
+            logger.error(f"Delivery state garbage collection failed for campaign {self.campaign}: {e}")
@@ -10,7 +10,7 @@ from redis_cache import RedisContactManager
 
 
 
-def run_comp(comp_name, alert_type):
+def run_comp(comp_name, alert_type, trigger_id=None):
     logger.info(f"Running comp: {comp_name, alert_type}")
     
     if not comp_name in COMPS:
@@ -24,7 +24,7 @@ def run_comp(comp_name, alert_type):
     #     else:
     #         return
     #     if result:
-    #         logger.info(f"Successfully sent data to message server for comp: {comp_name, alert_type}")
+    #         logger.info(f"Successfully queued data for message server for comp: {comp_name, alert_type}")
 
     # if comp_name == 'January Jackpot':
     #     logger.info(f"Running comp: {comp_name, alert_type}")
@@ -37,7 +37,7 @@ def run_comp(comp_name, alert_type):
     #     else:
     #         return
     #     if result:
-    #         logger.info(f"Successfully sent data to message server for comp: {comp_name, alert_type}")
+    #         logger.info(f"Successfully queued data for message server for comp: {comp_name, alert_type}")
 
     # if comp_name == 'Make me a millionaire':
     #     logger.info(f"Running comp: {comp_name, alert_type}")
@@ -52,35 +52,29 @@ def run_comp(comp_name, alert_type):
     #     else:
     #         return
     #     if result:
-    #         logger.info(f"Successfully sent data to message server for comp: {comp_name, alert_type}")
+    #         logger.info(f"Successfully queued data for message server for comp: {comp_name, alert_type}")
     # if comp_name == '35k Payday':
     #     logger.info(f"Running comp: {comp_name, alert_type}")
-    #     data = run_35k_payday(alert_type)
-    #     if data is None:
-    #         logger.info(f"No data received for comp: {comp_name}")
-    #         return
-    #     if data:
-    #         result = return_data_to_message_server(data)  
-    #     else:
-    #         return
-    #     if result:
-    #         logger.info(f"Successfully sent data to message server for comp: {comp_name, alert_type}")
+    #     # Runs in the background and queues the artist in the outbox itself.
+    #     run_35k_payday(alert_type)
 
     if comp_name == 'Splash The Cash':
         logger.info(f"Running comp: {comp_name, alert_type}")
         
-        data = execute_comp(alert_type)
+        data = execute_comp(alert_type, trigger_id=trigger_id)
         if data is None:
             logger.info(f"No data received for comp: {comp_name}")
             return
         if data:
             logger.info(f"Data to send: {data}")
             
-            result = return_data_to_message_server(data)  
+            # One alarm message per trigger, however often this runs for it.
+            key = f"{comp_name}:{alert_type}:{trigger_id}" if trigger_id else None
+            result = return_data_to_message_server(data, idempotency_key=key)
         else:
             return
         if result:
-            logger.info(f"Successfully sent data to message server for comp: {comp_name, alert_type}")
+            logger.info(f"Successfully queued data for message server for comp: {comp_name, alert_type}")
 
     
 
@@ -91,5 +85,5 @@ def run_comp(comp_name, alert_type):
     #     if data:
     #         result = return_data_to_message_server(data)
     #     if result:
-    #         logger.info(f"Successfully sent data to message server for comp: {comp_name, alert_type}")
+    #         logger.info(f"Successfully queued data for message server for comp: {comp_name, alert_type}")
     
\ No newline at end of file
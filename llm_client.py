@@ -0,0 +1,318 @@
+# STRUCTURED (JSON) GPT CALLS FOR THE COMPS.
+# Comps describe the answer they want with a small JSON schema. The model is asked for
+# a function call with exactly those arguments (or JSON mode), the reply is checked
+# against the compiled schema, near misses (code fences, trailing commas, "True",
+# "win" instead of "WIN", ...) are repaired locally, and anything still invalid is
+# retried immediately while the call's latency budget lasts. Per prompt counters go
+# to metrics so formatting problems show up on /metrics instead of as lost minutes.
+
+import asyncio
+import json
+import re
+import time
+
+import aiohttp
+import requests
+
+import metrics
+from comp_runtime import post_json
+from constants import GPT_API_URL, OPENAI_API_KEY
+from logger import logger
+
+DEFAULT_GPT_API_URL = "https://api.openai.com/v1/chat/completions"
+DEFAULT_BUDGET_SECONDS = 45
+DEFAULT_MAX_ATTEMPTS = 3
+MIN_ATTEMPT_SECONDS = 3          # don't start an attempt with less time than this left
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "integer": int,
+    "number": (int, float),
+    "null": type(None),
+}
+_TRUE_STRINGS = frozenset({"true", "yes", "y", "1"})
+_FALSE_STRINGS = frozenset({"false", "no", "n", "0"})
+
+
+class LLMError(Exception):
+    """Raised when no valid structured answer could be obtained within the budget."""
+
+
+class SchemaError(ValueError):
+    """A value does not match its schema."""
+
+
+class Schema:
+    """
+    A JSON schema subset compiled once into a validator.
+
+    Supported keywords: type (a name or list of names), properties, required, enum,
+    maxLength and items. Validation coerces near misses in place of failing (wrong
+    case enum values, "true"/"yes" for booleans, numeric strings) and counts them as
+    repairs.
+    """
+
+    def __init__(self, definition):
+        self.definition = definition
+        self._check = _compile(definition, "$")
+
+    def validate(self, value):
+        """
+        Returns:
+            tuple: (validated value, number of local repairs).
+
+        Raises:
+            SchemaError: if the value cannot be made to match.
+        """
+        repairs = []
+        return self._check(value, repairs), len(repairs)
+
+
+def _compile(definition, path):
+    types = definition.get("type")
+    types = tuple(types) if isinstance(types, list) else ((types,) if types else ())
+    python_types = tuple(_TYPES[name] for name in types)
+    enum = definition.get("enum")
+    enum_lookup = {str(option).lower(): option for option in enum} if enum else None
+    max_length = definition.get("maxLength")
+    properties = {name: _compile(sub, f"{path}.{name}") for name, sub in definition.get("properties", {}).items()}
+    required = tuple(definition.get("required", ()))
+    items = _compile(definition["items"], f"{path}[]") if "items" in definition else None
+
+    def coerce(value, repairs):
+        if "boolean" in types and isinstance(value, str):
+            lowered = value.strip().lower()
+            if lowered in _TRUE_STRINGS or lowered in _FALSE_STRINGS:
+                repairs.append(path)
+                return lowered in _TRUE_STRINGS
+        if ("integer" in types or "number" in types) and isinstance(value, str):
+            try:
+                number = float(value)
+            except ValueError:
+                return value
+            repairs.append(path)
+            return int(number) if "integer" in types and number.is_integer() else number
+        if "null" in types and isinstance(value, str) and value.strip().lower() in ("null", "none", ""):
+            repairs.append(path)
+            return None
+        return value
+
+    def check(value, repairs):
+        # bool is an int subclass; never let True pass as a number.
+        if python_types and (not isinstance(value, python_types) or
+                             (isinstance(value, bool) and "boolean" not in types)):
+            value = coerce(value, repairs)
+            if not isinstance(value, python_types) or (isinstance(value, bool) and "boolean" not in types):
+                raise SchemaError(f"{path}: expected {'/'.join(types)}, got {type(value).__name__}")
+        if enum_lookup is not None and value not in enum:
+            option = enum_lookup.get(str(value).strip().lower())
+            if option is None:
+                raise SchemaError(f"{path}: {value!r} is not one of {enum}")
+            repairs.append(path)
+            value = option
+        if max_length is not None and isinstance(value, str) and len(value) > max_length:
+            raise SchemaError(f"{path}: longer than {max_length} characters")
+        if isinstance(value, dict):
+            missing = [name for name in required if name not in value]
+            if missing:
+                raise SchemaError(f"{path}: missing {', '.join(missing)}")
+            for name, check_property in properties.items():
+                if name in value:
+                    value[name] = check_property(value[name], repairs)
+        if items is not None and isinstance(value, list):
+            value = [items(item, repairs) for item in value]
+        return value
+
+    return check
+
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_PYTHON_LITERALS = re.compile(r"\b(True|False|None)\b")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+
+def parse_json(text):
+    """
+    Parse a model reply as JSON, repairing common near misses.
+
+    Returns:
+        tuple: (parsed value, True if the text needed repairing)
+
+    Raises:
+        ValueError: if the text is not JSON even after repair.
+    """
+    try:
+        return json.loads(text), False
+    except (TypeError, ValueError):
+        pass
+    repaired = _FENCE.sub("", (text or "").strip()).translate(_SMART_QUOTES)
+    start, end = repaired.find("{"), repaired.rfind("}")
+    if start != -1 and end > start:
+        repaired = repaired[start:end + 1]
+    repaired = _TRAILING_COMMA.sub(r"\1", repaired)
+    repaired = _PYTHON_LITERALS.sub(lambda m: {"True": "true", "False": "false", "None": "null"}[m.group(1)], repaired)
+    return json.loads(repaired), True
+
+
+class LLMClient:
+    """
+    Chat completions client returning validated structured answers.
+
+    mode "function" asks for a forced function call whose parameters are the schema
+    (works with every function-calling model); mode "json" uses response_format
+    json_object (newer models only).
+    """
+
+    def __init__(self, api_url=None, api_key=None, mode="function"):
+        self.api_url = api_url or GPT_API_URL or DEFAULT_GPT_API_URL
+        self.api_key = (api_key or OPENAI_API_KEY or "").strip()
+        self.mode = mode
+        self.session = requests.Session()
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    def _body(self, prompt, messages, schema, model, options):
+        body = {"model": model, "messages": messages, **options}
+        if self.mode == "function":
+            body["tools"] = [{"type": "function", "function": {"name": prompt, "parameters": schema.definition}}]
+            body["tool_choice"] = {"type": "function", "function": {"name": prompt}}
+        else:
+            body["response_format"] = {"type": "json_object"}
+        return body
+
+    @staticmethod
+    def _reply_text(response_json):
+        message = response_json["choices"][0]["message"]
+        tool_calls = message.get("tool_calls")
+        if tool_calls:
+            return tool_calls[0]["function"]["arguments"]
+        return message.get("content") or ""
+
+    def _check(self, prompt, text, schema):
+        """Parse and validate one reply. Raises ValueError (incl. SchemaError) when unusable."""
+        value, repaired = parse_json(text)
+        value, repairs = schema.validate(value)
+        if repaired or repairs:
+            metrics.incr(f"llm.{prompt}.repaired")
+        return value
+
+    def _retry_messages(self, messages, text, error):
+        return messages + [
+            {"role": "assistant", "content": text},
+            {"role": "user", "content": f"That reply was invalid ({error}). Reply again with only the corrected JSON."},
+        ]
+
+    def _finish(self, prompt, started, attempts):
+        metrics.incr(f"llm.{prompt}.calls")
+        metrics.observe(f"llm.{prompt}.latency_seconds", round(time.monotonic() - started, 3))
+        if attempts > 1:
+            metrics.incr(f"llm.{prompt}.retries", attempts - 1)
+
+    def complete_json(self, prompt, messages, schema, model, budget_seconds=DEFAULT_BUDGET_SECONDS,
+                      max_attempts=DEFAULT_MAX_ATTEMPTS, **options):
+        """
+        Ask for a structured answer and return it validated against schema.
+
+        Args:
+            prompt (str): Prompt name, used as the function name and in metrics.
+            messages (list): Chat messages.
+            schema (Schema): Expected answer.
+            model (str): Model name.
+            budget_seconds (float): Total time allowed across attempts.
+            **options: Extra request fields (max_tokens, temperature, ...).
+
+        Raises:
+            LLMError: if no valid answer arrived within the budget.
+        """
+        started = time.monotonic()
+        last_error = None
+        attempt = 0
+        for attempt in range(1, max_attempts + 1):
+            remaining = budget_seconds - (time.monotonic() - started)
+            if attempt > 1 and remaining < MIN_ATTEMPT_SECONDS:
+                attempt -= 1            # not made: keep the retry count to attempts actually sent
+                break
+            text = None
+            try:
+                response = self.session.post(self.api_url, headers=self._headers(), timeout=remaining,
+                                             json=self._body(prompt, messages, schema, model, options))
+                if response.status_code != 200:
+                    raise LLMError(f"GPT API error: {response.status_code} - {response.text}")
+                text = self._reply_text(response.json())
+                value = self._check(prompt, text, schema)
+                self._finish(prompt, started, attempt)
+                return value
+            except (ValueError, KeyError, IndexError) as e:
+                last_error = e
+                metrics.incr(f"llm.{prompt}.parse_failures")
+                logger.warning(f"LLM '{prompt}' attempt {attempt} returned unusable output: {e}")
+                messages = self._retry_messages(messages, text, e) if text is not None else messages
+            except (LLMError, requests.exceptions.RequestException) as e:
+                last_error = e
+                logger.warning(f"LLM '{prompt}' attempt {attempt} failed: {e}")
+        self._finish(prompt, started, attempt)
+        metrics.incr(f"llm.{prompt}.failed")
+        raise LLMError(f"No valid '{prompt}' answer after {attempt} attempts: {last_error}")
+
+    async def complete_json_async(self, prompt, messages, schema, model, budget_seconds=DEFAULT_BUDGET_SECONDS,
+                                  max_attempts=DEFAULT_MAX_ATTEMPTS, **options):
+        """complete_json() for coroutines on the comp runtime."""
+        started = time.monotonic()
+        last_error = None
+        attempt = 0
+        for attempt in range(1, max_attempts + 1):
+            remaining = budget_seconds - (time.monotonic() - started)
+            if attempt > 1 and remaining < MIN_ATTEMPT_SECONDS:
+                attempt -= 1            # not made: keep the retry count to attempts actually sent
+                break
+            text = None
+            try:
+                status, body = await post_json(self.api_url, self._body(prompt, messages, schema, model, options),
+                                               headers=self._headers(), timeout=remaining)
+                if status != 200:
+                    raise LLMError(f"GPT API error: {status} - {body}")
+                text = self._reply_text(json.loads(body))
+                value = self._check(prompt, text, schema)
+                self._finish(prompt, started, attempt)
+                return value
+            except (ValueError, KeyError, IndexError) as e:
+                last_error = e
+                metrics.incr(f"llm.{prompt}.parse_failures")
+                logger.warning(f"LLM '{prompt}' attempt {attempt} returned unusable output: {e}")
+                messages = self._retry_messages(messages, text, e) if text is not None else messages
+            except (LLMError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+                logger.warning(f"LLM '{prompt}' attempt {attempt} failed: {e}")
+        self._finish(prompt, started, attempt)
+        metrics.incr(f"llm.{prompt}.failed")
+        raise LLMError(f"No valid '{prompt}' answer after {attempt} attempts: {last_error}")
+
+
+def parse_failure_rates():
+    """
+    Parse failures per attempt (first tries plus retries) for every prompt seen so far,
+    from the shared metrics; parse failures are counted per attempt, so this stays <= 1.
+    """
+    counters = metrics.snapshot()["counters"]
+    rates = {}
+    for name, calls in counters.items():
+        if name.startswith("llm.") and name.endswith(".calls") and calls:
+            prompt = name[len("llm."):-len(".calls")]
+            attempts = calls + counters.get(f"llm.{prompt}.retries", 0.0)
+            rates[prompt] = counters.get(f"llm.{prompt}.parse_failures", 0.0) / attempts
+    return rates
+
+
+_client = None
+
+
+def get_llm_client():
+    global _client
+    if _client is None:
+        _client = LLMClient()
+    return _client
@@ -0,0 +1,155 @@
+# LIGHTWEIGHT METRICS SHARED BY ALL WORKERS.
+# Counters, gauges and recent samples are kept in Redis so every gunicorn worker
+# reports into the same place; /metrics on the info server returns a snapshot.
+# Recording a metric must never break the code path being measured, so every
+# call swallows Redis errors. Calls made from a coroutine (comp runtime) must not block
+# the event loop on Redis either: they are buffered and a background thread writes them
+# in one pipeline per batch.
+
+import asyncio
+import queue
+import threading
+import time
+
+from logger import logger
+from redis_cache import RedisContactManager
+
+COUNTERS_KEY = "metrics:counters"
+GAUGES_KEY = "metrics:gauges"
+SAMPLES_KEY_PREFIX = "metrics:samples:"
+SAMPLE_NAMES_KEY = "metrics:sample_names"
+MAX_SAMPLES = 1000
+FLUSH_BATCH_SIZE = 500
+
+_redis_client = None
+_buffer = queue.SimpleQueue()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _client():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = RedisContactManager().redis_client
+    return _redis_client
+
+
+def _on_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _write(operation, *args):
+    """Apply operation(pipeline, *args) now, or buffer it when called from a coroutine."""
+    if _on_event_loop():
+        _start_flusher()
+        _buffer.put((operation, args))
+        return
+    try:
+        pipeline = _client().pipeline(transaction=False)
+        operation(pipeline, *args)
+        pipeline.execute()
+    except Exception as e:
+        logger.debug(f"metrics.{operation.__name__.lstrip('_')}({args[0]}) failed: {e}")
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_forever, name="metrics-flusher", daemon=True)
+            _flusher.start()
+
+
+def _flush_forever():
+    """Write buffered metrics; whatever piles up during one write goes out in the next pipeline."""
+    while True:
+        batch = [_buffer.get()]
+        while len(batch) < FLUSH_BATCH_SIZE:
+            try:
+                batch.append(_buffer.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            pipeline = _client().pipeline(transaction=False)
+            for operation, args in batch:
+                operation(pipeline, *args)
+            pipeline.execute()
+        except Exception as e:
+            logger.debug(f"metrics flush of {len(batch)} updates failed: {e}")
+
+
+def _incr(pipeline, name, amount):
+    pipeline.hincrbyfloat(COUNTERS_KEY, name, amount)
+
+
+def _gauge(pipeline, name, value):
+    pipeline.hset(GAUGES_KEY, name, value)
+
+
+def _observe(pipeline, name, value, observed_at):
+    key = SAMPLES_KEY_PREFIX + name
+    pipeline.lpush(key, f"{observed_at:.3f}:{value}")
+    pipeline.ltrim(key, 0, MAX_SAMPLES - 1)
+    pipeline.sadd(SAMPLE_NAMES_KEY, name)
+
+
+def incr(name, amount=1):
+    """Increment a counter."""
+    _write(_incr, name, amount)
+
+
+def gauge(name, value):
+    """Set a gauge to its current value."""
+    _write(_gauge, name, value)
+
+
+def observe(name, value):
+    """Record one sample of a distribution (latency, size, ...). Keeps the last MAX_SAMPLES."""
+    _write(_observe, name, value, time.time())
+
+
+def get_samples(name, count=MAX_SAMPLES):
+    """Return the most recent samples of a distribution as (timestamp, value) tuples, newest first."""
+    raw = _client().lrange(SAMPLES_KEY_PREFIX + name, 0, count - 1)
+    samples = []
+    for item in raw:
+        timestamp, value = item.decode("utf-8").split(":", 1)
+        samples.append((float(timestamp), float(value)))
+    return samples
+
+
+def summary(name):
+    """Summarise the recent samples of a distribution."""
+    values = sorted(value for _, value in get_samples(name))
+    if not values:
+        return {"count": 0}
+
+    def percentile(p):
+        return values[min(int(round(p * (len(values) - 1))), len(values) - 1)]
+
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "max": values[-1],
+    }
+
+
+def snapshot():
+    """All counters, gauges and sample summaries as a JSON friendly dict."""
+    client = _client()
+    counters = {k.decode("utf-8"): float(v) for k, v in client.hgetall(COUNTERS_KEY).items()}
+    gauges = {k.decode("utf-8"): float(v) for k, v in client.hgetall(GAUGES_KEY).items()}
+    names = sorted(name.decode("utf-8") for name in client.smembers(SAMPLE_NAMES_KEY))
+    return {
+        "counters": counters,
+        "gauges": gauges,
+        "samples": {name: summary(name) for name in names},
+    }
@@ -0,0 +1,323 @@
+# OUTBOUND DELIVERY TO THE MESSAGING SERVER.
+# Comps no longer POST their results directly: a message is written to a Redis outbox
+# and a delivery thread sends it. Delivery survives restarts and messaging server
+# outages: failures are retried with exponential backoff and, after MAX_ATTEMPTS, moved
+# to a dead-letter list for inspection. Every message carries an idempotency key that
+# stays the same across retries, so the messaging server can drop duplicates. Only the
+# worker holding DELIVERY_LEADER_KEY delivers, like the ACR poller; the lock is renewed
+# before every request, so a slow batch cannot outlive it and let a second worker in.
+# Comp results are time-critical: enqueue(..., immediate=True) makes the first delivery
+# attempt right away from the calling thread, instead of queueing behind a batch, and
+# only falls back to the queue (with the usual backoff) if that attempt fails.
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import requests
+
+import metrics
+from constants import AUTH, URL, MESSAGE_BATCH_URL
+from logger import logger
+from redis_cache import RedisContactManager
+
+MESSAGES_KEY = "outbox:messages"          # hash: message id -> JSON envelope
+SCHEDULE_KEY = "outbox:schedule"          # sorted set: message id -> next attempt (epoch seconds)
+DEAD_LETTER_KEY = "outbox:dead"           # list of JSON envelopes that exhausted their retries
+WAKE_CHANNEL = "outbox:wake"              # published on enqueue so delivery starts at once
+DELIVERY_LEADER_KEY = "outbox:delivery_leader"
+
+BATCH_SIZE = 20
+IDLE_WAIT_SECONDS = 5
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 300
+MAX_ATTEMPTS = 10
+REQUEST_TIMEOUT_SECONDS = 15
+LEADER_TTL_SECONDS = 60             # > REQUEST_TIMEOUT_SECONDS: renewed before each request
+DEAD_LETTER_MAX = 1000
+IMMEDIATE_HOLD_SECONDS = REQUEST_TIMEOUT_SECONDS + 5   # deliverer leaves an immediate message alone this long
+
+
+def backoff_seconds(attempts):
+    """Delay before the next attempt after `attempts` failures."""
+    return min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+
+
+def enqueue(comp_name, message_data, idempotency_key=None, redis_client=None, immediate=False):
+    """
+    Queue a message for the messaging server.
+
+    Args:
+        comp_name (str): Comp the message belongs to.
+        message_data (str): Message text, or None for the comp's template.
+        idempotency_key (str): Stable key for this logical message; generated if omitted.
+        immediate (bool): Make the first delivery attempt now, in this thread.
+
+    Returns:
+        str: The message id (also its idempotency key).
+    """
+    if isinstance(message_data, bytes):
+        message_data = message_data.decode('utf-8')
+    key = idempotency_key or uuid.uuid4().hex
+    envelope = {
+        "id": key,
+        "comp_name": comp_name,
+        "message_data": message_data,
+        "enqueued_at": time.time(),
+        "attempts": 0,
+        "last_error": None,
+    }
+    immediate = immediate and bool(URL)
+    client = redis_client or _client()
+    pipeline = client.pipeline()
+    pipeline.hsetnx(MESSAGES_KEY, key, json.dumps(envelope))
+    # An immediate message is stored first (so it survives a crash) but scheduled after
+    # the attempt in flight, so the deliverer does not send it a second time meanwhile.
+    pipeline.zadd(SCHEDULE_KEY, {key: envelope["enqueued_at"] + (IMMEDIATE_HOLD_SECONDS if immediate else 0)}, nx=True)
+    if not immediate:
+        pipeline.publish(WAKE_CHANNEL, key)
+    created = pipeline.execute()[0]
+    metrics.incr("outbox.enqueued")
+    logger.info(f"Queued message {key} for comp {comp_name}")
+    if immediate and created:
+        try:
+            _immediate_sender(client).deliver_one(envelope)
+        except Exception as e:
+            logger.error(f"Immediate delivery of message {key} failed, left to the outbox: {e}")
+    return key
+
+
+class OutboxDeliverer(threading.Thread):
+    """Background thread sending due outbox messages in batches."""
+
+    def __init__(self, redis_client=None):
+        super().__init__(name="outbox-deliverer", daemon=True)
+        self.redis_client = redis_client or RedisContactManager().redis_client
+        self.session = requests.Session()
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.leader_lock = self.redis_client.lock(DELIVERY_LEADER_KEY, timeout=LEADER_TTL_SECONDS)
+        self.is_leader = False
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+        self.redis_client.publish(WAKE_CHANNEL, "stop")
+
+    def run(self):
+        if not URL:
+            logger.warning("CRITICAL: URL is not set. Outbox delivery is disabled.")
+            return
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(WAKE_CHANNEL)
+        logger.info(f"Outbox deliverer started in worker {self.worker_id}")
+        try:
+            while not self.stopped.is_set():
+                wait = IDLE_WAIT_SECONDS
+                try:
+                    if self._hold_leadership():
+                        wait = self.deliver_due()
+                except Exception as e:
+                    logger.error(f"Outbox delivery error: {e}")
+                if wait > 0:
+                    pubsub.get_message(timeout=wait)
+        finally:
+            pubsub.close()
+            if self.is_leader:
+                try:
+                    self.leader_lock.release()
+                except Exception:
+                    pass
+
+    def _hold_leadership(self):
+        if self.is_leader:
+            try:
+                self.leader_lock.reacquire()
+                return True
+            except Exception:
+                logger.warning("Outbox deliverer lost leadership")
+                self.is_leader = False
+        if self.leader_lock.acquire(blocking=False):
+            self.is_leader = True
+            logger.info(f"Worker {self.worker_id} is now the outbox deliverer")
+        return self.is_leader
+
+    def _still_leader(self):
+        """Renew the leader lock mid-batch; False (and leadership dropped) if it was lost."""
+        try:
+            self.leader_lock.reacquire()
+            return True
+        except Exception:
+            logger.warning("Outbox deliverer lost leadership during a batch; leaving the rest scheduled")
+            self.is_leader = False
+            return False
+
+    def deliver_due(self):
+        """
+        Send one batch of due messages.
+
+        Returns:
+            float: Seconds until the next message is due (0 if more are due now).
+        """
+        now = time.time()
+        ids = self.redis_client.zrangebyscore(SCHEDULE_KEY, "-inf", now, start=0, num=BATCH_SIZE)
+        if ids:
+            raw = self.redis_client.hmget(MESSAGES_KEY, ids)
+            envelopes = [json.loads(item) for item in raw if item]
+            for message_id, item in zip(ids, raw):
+                if not item:
+                    # Envelope gone (already delivered elsewhere); drop the schedule entry.
+                    self.redis_client.zrem(SCHEDULE_KEY, message_id)
+            if envelopes:
+                self._send(envelopes)
+            if len(ids) == BATCH_SIZE:
+                return 0
+        metrics.gauge("outbox.pending", self.redis_client.zcard(SCHEDULE_KEY))
+        upcoming = self.redis_client.zrange(SCHEDULE_KEY, 0, 0, withscores=True)
+        if upcoming:
+            return max(0.0, min(upcoming[0][1] - time.time(), IDLE_WAIT_SECONDS))
+        return IDLE_WAIT_SECONDS
+
+    def _headers(self, idempotency_key=None):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': AUTH
+        }
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        return headers
+
+    @staticmethod
+    def _payload(envelope):
+        return {
+            'comp_name': envelope["comp_name"],
+            'message_data': envelope["message_data"],
+            'idempotency_key': envelope["id"],
+        }
+
+    @staticmethod
+    def _batch_key(envelopes):
+        """Idempotency key of a batch request: the same messages give the same key."""
+        ids = ",".join(sorted(envelope["id"] for envelope in envelopes))
+        return "batch:" + hashlib.sha256(ids.encode("utf-8")).hexdigest()
+
+    def _send(self, envelopes):
+        if MESSAGE_BATCH_URL and len(envelopes) > 1:
+            if not self._still_leader():
+                return
+            try:
+                response = self.session.post(MESSAGE_BATCH_URL, headers=self._headers(self._batch_key(envelopes)),
+                                             json={"messages": [self._payload(e) for e in envelopes]},
+                                             timeout=REQUEST_TIMEOUT_SECONDS)
+                error = None if response.status_code == 200 else f"{response.status_code}: {response.text}"
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+            for envelope in envelopes:
+                self._record(envelope, error)
+            return
+        for envelope in envelopes:
+            if not self._still_leader():
+                return
+            self.deliver_one(envelope)
+
+    def deliver_one(self, envelope):
+        """POST one message and record the result; needs no leadership (see enqueue(immediate=True))."""
+        try:
+            response = self.session.post(URL, headers=self._headers(envelope["id"]), json=self._payload(envelope),
+                                         timeout=REQUEST_TIMEOUT_SECONDS)
+            error = None if response.status_code == 200 else f"{response.status_code}: {response.text}"
+        except requests.exceptions.RequestException as e:
+            error = str(e)
+        self._record(envelope, error)
+
+    def _record(self, envelope, error):
+        """Remove a delivered message, or reschedule / dead-letter a failed one."""
+        message_id = envelope["id"]
+        if error is None:
+            pipeline = self.redis_client.pipeline()
+            pipeline.hdel(MESSAGES_KEY, message_id)
+            pipeline.zrem(SCHEDULE_KEY, message_id)
+            pipeline.execute()
+            lag = time.time() - envelope["enqueued_at"]
+            metrics.incr("outbox.delivered")
+            metrics.observe("outbox.delivery_lag_seconds", round(lag, 3))
+            logger.info(f"Successfully sent data to message server for comp {envelope['comp_name']} "
+                        f"(message {message_id}, lag {lag:.2f}s, attempts {envelope['attempts'] + 1})")
+            return
+
+        envelope["attempts"] += 1
+        envelope["last_error"] = error
+        metrics.incr("outbox.failed_attempts")
+        pipeline = self.redis_client.pipeline()
+        if envelope["attempts"] >= MAX_ATTEMPTS:
+            logger.error(f"Message {message_id} for comp {envelope['comp_name']} dead-lettered after "
+                         f"{envelope['attempts']} attempts: {error}")
+            pipeline.hdel(MESSAGES_KEY, message_id)
+            pipeline.zrem(SCHEDULE_KEY, message_id)
+            pipeline.lpush(DEAD_LETTER_KEY, json.dumps(envelope))
+            pipeline.ltrim(DEAD_LETTER_KEY, 0, DEAD_LETTER_MAX - 1)
+            metrics.incr("outbox.dead_lettered")
+        else:
+            delay = backoff_seconds(envelope["attempts"])
+            logger.warning(f"Message {message_id} for comp {envelope['comp_name']} failed "
+                           f"(attempt {envelope['attempts']}): {error}. Retrying in {delay}s")
+            pipeline.hset(MESSAGES_KEY, message_id, json.dumps(envelope))
+            pipeline.zadd(SCHEDULE_KEY, {message_id: time.time() + delay})
+        pipeline.execute()
+
+
+def dead_letters(count=50):
+    """The most recent dead-lettered messages, newest first."""
+    return [json.loads(item) for item in _client().lrange(DEAD_LETTER_KEY, 0, count - 1)]
+
+
+def requeue_dead_letters():
+    """Put every dead-lettered message back in the outbox with a fresh attempt count."""
+    client = _client()
+    requeued = 0
+    while True:
+        item = client.rpop(DEAD_LETTER_KEY)
+        if item is None:
+            return requeued
+        envelope = json.loads(item)
+        envelope["attempts"] = 0
+        pipeline = client.pipeline()
+        pipeline.hset(MESSAGES_KEY, envelope["id"], json.dumps(envelope))
+        pipeline.zadd(SCHEDULE_KEY, {envelope["id"]: time.time()})
+        pipeline.publish(WAKE_CHANNEL, envelope["id"])
+        pipeline.execute()
+        requeued += 1
+
+
+_deliverer = None
+_deliverer_lock = threading.Lock()
+_immediate = None
+_redis_client = None
+
+
+def _client():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = RedisContactManager().redis_client
+    return _redis_client
+
+
+def _immediate_sender(redis_client):
+    """An OutboxDeliverer that is never started; enqueue() uses it for immediate attempts."""
+    global _immediate
+    with _deliverer_lock:
+        if _immediate is None or _immediate.redis_client is not redis_client:
+            _immediate = OutboxDeliverer(redis_client)
+    return _immediate
+
+
+def start_outbox_delivery():
+    """Start the delivery thread for this worker (idempotent)."""
+    global _deliverer
+    with _deliverer_lock:
+        if _deliverer is None or not _deliverer.is_alive():
+            _deliverer = OutboxDeliverer()
+            _deliverer.start()
+    return _deliverer
@@ -0,0 +1,107 @@
+# PROMPT ASSEMBLY AND TOKEN BUDGETS FOR GPT CALLS.
+# Each prompt is built once at import: the static system message and instructions form
+# a fixed prefix and the transcript always goes last, so consecutive calls share the
+# longest possible identical prefix (provider side prompt caching applies to it).
+# Tokens are estimated locally and the transcript is cut, oldest part first, to keep
+# every call within its budget. Tokens sent per call are recorded as a metric.
+
+import importlib.util
+
+import metrics
+from logger import logger
+
+CHARS_PER_TOKEN = 4                   # estimate used when tiktoken is not installed
+MESSAGE_OVERHEAD_TOKENS = 4           # role/formatting tokens the API adds per message
+TRUNCATION_MARKER = "[... earlier transcript omitted ...]\n"
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and importlib.util.find_spec("tiktoken") is not None:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def estimate_tokens(text):
+    """Token count of text: exact with tiktoken installed, otherwise ~4 characters per token."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class Prompt:
+    """
+    A precompiled prompt: static prefix messages plus a transcript slot at the end.
+
+    Args:
+        name (str): Prompt name, used in metrics (llm.<name>.prompt_tokens).
+        system (str): Static system message.
+        instructions (str): Static instructions sent at the start of the user message.
+        transcript_header (str): Line put between the instructions and the transcript.
+        max_prompt_tokens (int): Budget for the whole prompt.
+    """
+
+    def __init__(self, name, system, instructions="", transcript_header="", max_prompt_tokens=6000):
+        self.name = name
+        self.max_prompt_tokens = max_prompt_tokens
+        self.prefix_messages = [{"role": "system", "content": system}] if system else []
+        self.user_prefix = "\n\n".join(part for part in (instructions.strip(), transcript_header.strip()) if part)
+        if self.user_prefix:
+            self.user_prefix += "\n"
+        self.prefix_tokens = (sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in self.prefix_messages)
+                              + estimate_tokens(self.user_prefix) + MESSAGE_OVERHEAD_TOKENS)
+        if self.prefix_tokens >= max_prompt_tokens:
+            raise ValueError(f"Prompt '{name}' static part ({self.prefix_tokens} tokens) exceeds its budget")
+
+    def fit_transcript(self, parts, budget):
+        """
+        Keep the newest transcript parts that fit in budget tokens.
+
+        Args:
+            parts (list): Transcript pieces, oldest first (e.g. one per chunk).
+
+        Returns:
+            tuple: (transcript text, number of parts dropped or cut)
+        """
+        kept, used = [], 0
+        for index in range(len(parts) - 1, -1, -1):
+            part = parts[index]
+            tokens = estimate_tokens(part)
+            if used + tokens <= budget:
+                kept.append(part)
+                used += tokens
+                continue
+            # Keep the newest end of the part that no longer fits whole.
+            room = budget - used - estimate_tokens(TRUNCATION_MARKER)
+            if room > 0:
+                kept.append(part[-room * CHARS_PER_TOKEN:])
+            kept.append(TRUNCATION_MARKER)
+            return "".join(reversed(kept)), index + 1
+        return "".join(reversed(kept)), 0
+
+    def messages(self, transcript, max_prompt_tokens=None):
+        """
+        Build the chat messages for one call.
+
+        Args:
+            transcript (str or list): The variable part; a list is treated as parts, oldest first.
+            max_prompt_tokens (int): Override the prompt's budget for this call.
+
+        Returns:
+            list: Chat messages; the static prefix is identical on every call.
+        """
+        parts = [transcript] if isinstance(transcript, str) else list(transcript)
+        budget = (max_prompt_tokens or self.max_prompt_tokens) - self.prefix_tokens
+        text, truncated = self.fit_transcript(parts, budget)
+        if truncated:
+            logger.info(f"Prompt '{self.name}': transcript cut to fit {budget} tokens ({truncated} oldest parts affected)")
+            metrics.incr(f"llm.{self.name}.truncated")
+        tokens = self.prefix_tokens + estimate_tokens(text)
+        metrics.observe(f"llm.{self.name}.prompt_tokens", tokens)
+        return self.prefix_messages + [{"role": "user", "content": self.user_prefix + text}]
@@ -1,60 +1,367 @@
 import redis
 import os
 import math
+import csv
+import json
+import threading
+import time
+import uuid
 from typing import List
 from logger import logger
+from constants import CONTACT_STORAGE
+from compact_contacts import CompactContactStore
+from delivery_state import DeliveryState, DEFAULT_CAMPAIGN, ALL_CONTACTS_KEY, INDEX_KEY, INDEX_COMPLETE_KEY
+
+BULK_BATCH_SIZE = 1000           # contacts per pipeline round trip in bulk loads
+BULK_PROGRESS_EVERY = 50         # batches between progress log lines
+CLAIM_LEASE_SECONDS = 300        # claimed contacts not acknowledged within this go back to contacts_set
+CLAIM_REQUEUE_LIMIT = 1000       # expired claims re-queued per claim call
+REQUEUE_BATCH_SIZE = 1000        # contacts re-queued per round trip after a reset
+
+# Re-queue expired claims, then pop up to ARGV[1] ids from contacts_set, record them as
+# processing under the caller's token and (hash mode) return their hashes, all atomically.
+# KEYS: contacts_set, processing_set, lease zset, owner hash
+# ARGV: count, now, lease deadline, token, fetch hashes (1/0), requeue limit
+CLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[2], 'LIMIT', 0, ARGV[6])
+for _, id in ipairs(expired) do
+    redis.call('SADD', KEYS[1], id)
+    redis.call('SREM', KEYS[2], id)
+    redis.call('ZREM', KEYS[3], id)
+    redis.call('HDEL', KEYS[4], id)
+end
+local ids = redis.call('SPOP', KEYS[1], ARGV[1])
+local claimed = {}
+for _, id in ipairs(ids) do
+    redis.call('SADD', KEYS[2], id)
+    redis.call('ZADD', KEYS[3], ARGV[3], id)
+    redis.call('HSET', KEYS[4], id, ARGV[4])
+    claimed[#claimed + 1] = id
+    if ARGV[5] == '1' then
+        claimed[#claimed + 1] = redis.call('HGETALL', 'contact:' .. id)
+    else
+        claimed[#claimed + 1] = {}
+    end
+end
+return {#expired, claimed}
+"""
+
+# Finish claims still held by ARGV[1]. ARGV[2] is 1 to set the contacts' sent bit in the
+# campaign's current generation (see delivery_state.py), 0 to put them back in contacts_set.
+# KEYS: contacts_set, processing_set, lease zset, owner hash, generation, offset index.
+# ARGV[3] is the campaign's sent bitmap prefix; ARGV[4..] are ids.
+FINISH_SCRIPT = """
+local finished = {}
+for i = 4, #ARGV do
+    local id = ARGV[i]
+    if redis.call('HGET', KEYS[4], id) == ARGV[1] then
+        local offset = redis.call('HGET', KEYS[6], id)
+        redis.call('SREM', KEYS[2], id)
+        redis.call('ZREM', KEYS[3], id)
+        redis.call('HDEL', KEYS[4], id)
+        if ARGV[2] == '0' then
+            redis.call('SADD', KEYS[1], id)
+        elseif offset then
+            redis.call('SETBIT', ARGV[3] .. (redis.call('GET', KEYS[5]) or '0'), offset, 1)
+        end
+        finished[#finished + 1] = id
+    end
+end
+return finished
+"""
+
+# Re-queue ARGV[3..] after a reset, skipping contacts already claimed or sent this round;
+# returns -1 (and adds nothing) once a newer reset bumped the generation past ARGV[1].
+# KEYS: contacts_set, processing_set, generation, offset index. ARGV[2]: sent bitmap prefix.
+REQUEUE_SCRIPT = """
+if (redis.call('GET', KEYS[3]) or '0') ~= ARGV[1] then
+    return -1
+end
+local sent_key = ARGV[2] .. ARGV[1]
+local added = 0
+for i = 3, #ARGV do
+    local id = ARGV[i]
+    local offset = redis.call('HGET', KEYS[4], id)
+    if redis.call('SISMEMBER', KEYS[2], id) == 0
+            and not (offset and redis.call('GETBIT', sent_key, offset) == 1) then
+        added = added + redis.call('SADD', KEYS[1], id)
+    end
+end
+return added
+"""
+
+
+def iter_contacts_csv(path):
+    """
+    Yield contacts from a CSV file with a header row (one of the columns must be 'id').
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+
+def iter_contacts_jsonl(path):
+    """
+    Yield contacts from a JSON Lines file, one contact object per line.
+    """
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
 
 
 class RedisContactManager:
-    def __init__(self, host='localhost', port=6379, db=0):
+    def __init__(self, host='localhost', port=6379, db=0, storage=None, campaign=DEFAULT_CAMPAIGN):
         """
         Initialize the Redis client.
+
+        storage is "hash" or "compact" (see compact_contacts.py); defaults to CONTACT_STORAGE.
+        campaign names the delivery state (sent flags) this manager reads and writes.
         """
         self.redis_client = redis.Redis(host=host, port=port, db=db)
         self.contacts_key = 'contacts_set'  # Redis set to store contact IDs
         self.processing_key = 'processing_set'  # Redis set to store contacts being processed
+        self.lease_key = 'processing_leases'  # sorted set: claimed contact ID -> lease deadline
+        self.owner_key = 'processing_owners'  # hash: claimed contact ID -> claim token
+        self.claim_token = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.compact = (storage or CONTACT_STORAGE) == 'compact'
+        self.delivery = DeliveryState(self.redis_client, campaign)
+        self._compact_store = None
+        self._claim_script = self.redis_client.register_script(CLAIM_SCRIPT)
+        self._finish_script = self.redis_client.register_script(FINISH_SCRIPT)
+        self._requeue_script = self.redis_client.register_script(REQUEUE_SCRIPT)
+
+    @property
+    def compact_store(self):
+        if self._compact_store is None:
+            self._compact_store = CompactContactStore(self.redis_client, self.delivery)
+        return self._compact_store
 
     def store_contacts(self, clients_info):
         """
         Store contacts in Redis and add their IDs to the contacts set.
         """
-        pipeline = self.redis_client.pipeline()
-        for contact in clients_info:
-            # Generate a unique ID for the contact
-            contact_id = contact["id"]
-            
-            # Initialize 'message_sent' to '0'
-            contact['message_sent'] = '0'
-            key = f"contact:{contact_id}"
-            # Store contact data
-            pipeline.hset(key, mapping=contact)
-            # Add contact ID to the contacts set
-            pipeline.sadd(self.contacts_key, contact_id)
-        pipeline.execute()
+        self.bulk_load_contacts(clients_info)
         print("Contacts have been stored in Redis and added to the contacts set.")
 
-    def reset_all_contacts(self):
+    def bulk_load_contacts(self, contacts, batch_size=BULK_BATCH_SIZE, progress_callback=None):
+        """
+        Store contacts from any iterable (a list, iter_contacts_csv(), iter_contacts_jsonl(), ...).
+
+        Contacts are pipelined in batches of batch_size, so only one batch of commands is
+        buffered at a time and Redis is never blocked by one huge burst. Input records are
+        neither copied nor modified. New contacts get a delivery-state offset; the sent flag
+        of a contact that is loaded again is kept for the current round.
+
+        Args:
+            contacts (iterable): Contact dicts, each with an 'id'.
+            batch_size (int): Contacts per pipeline execute().
+            progress_callback (callable): Called after every batch with (loaded, rate per second).
+
+        Returns:
+            dict: loaded, skipped, seconds and per_second.
+        """
+        started = time.monotonic()
+        loaded = skipped = batches = 0
+        pipeline = self.redis_client.pipeline(transaction=False)
+        pending = []
+        for contact in contacts:
+            contact_id = contact.get("id")
+            if contact_id in (None, ""):
+                skipped += 1
+                continue
+            if self.compact:
+                self.compact_store.queue_store(pipeline, str(contact_id), contact)
+            else:
+                key = f"contact:{contact_id}"
+                pipeline.hset(key, mapping=contact)
+            pipeline.sadd(self.contacts_key, contact_id)
+            pending.append(str(contact_id))
+            if len(pending) >= batch_size:
+                self.delivery.queue_assign(pipeline, pending)
+                pipeline.execute()
+                loaded += len(pending)
+                pending = []
+                batches += 1
+                rate = loaded / max(time.monotonic() - started, 1e-9)
+                if progress_callback:
+                    progress_callback(loaded, rate)
+                if batches % BULK_PROGRESS_EVERY == 0:
+                    logger.info(f"Bulk contact load: {loaded} contacts stored ({rate:.0f}/s)")
+        if pending:
+            self.delivery.queue_assign(pipeline, pending)
+            pipeline.execute()
+            loaded += len(pending)
+        seconds = time.monotonic() - started
+        rate = loaded / seconds if seconds > 0 else 0.0
+        if progress_callback and pending:
+            progress_callback(loaded, rate)
+        if skipped:
+            logger.warning(f"Bulk contact load skipped {skipped} records without an id")
+        logger.info(f"Bulk contact load finished: {loaded} contacts in {seconds:.2f}s ({rate:.0f}/s)")
+        return {"loaded": loaded, "skipped": skipped, "seconds": round(seconds, 3), "per_second": round(rate, 1)}
+
+    def claim_contacts(self, count, lease_seconds=CLAIM_LEASE_SECONDS, token=None):
+        """
+        Atomically take up to count contacts off contacts_set for sending.
+
+        The IDs move to processing_set under a lease; claims whose lease ran out (a worker
+        died mid-run) are put back in contacts_set first. Several workers can drain the
+        same run in parallel: an ID is only ever held by one claim at a time.
+
+        Args:
+            count (int): Maximum contacts to claim.
+            lease_seconds (float): Time allowed before ack_contacts().
+            token (str): Claim owner; defaults to this manager's claim_token.
+
+        Returns:
+            list: Claimed contacts (dicts with 'id'); deleted contacts are skipped.
+        """
+        token = token or self.claim_token
+        now = time.time()
+        requeued, claimed = self._claim_script(
+            keys=[self.contacts_key, self.processing_key, self.lease_key, self.owner_key],
+            args=[count, now, now + lease_seconds, token, 0 if self.compact else 1, CLAIM_REQUEUE_LIMIT])
+        if requeued:
+            logger.warning(f"Re-queued {requeued} contacts whose claims were never acknowledged")
+        ids = [claimed[i].decode('utf-8') for i in range(0, len(claimed), 2)]
+        if self.compact:
+            contacts = self.compact_store.get_many(ids)
+        else:
+            contacts = []
+            # Same message_sent as compact mode and get_contact_by_id(): the delivery state
+            # flag, never a stale field left in the hash.
+            for contact_id, fields, sent in zip(ids, claimed[1::2], self.delivery.sent_many(ids)):
+                if not fields:
+                    contacts.append(None)
+                    continue
+                contact = {fields[i].decode('utf-8'): self._decode_value(fields[i + 1])
+                           for i in range(0, len(fields), 2)}
+                contact['id'] = contact_id
+                contact['message_sent'] = '1' if sent else '0'
+                contacts.append(contact)
+        missing = [contact_id for contact_id, contact in zip(ids, contacts) if contact is None]
+        if missing:
+            self.ack_contacts(missing, token=token, sent=False, requeue=False)
+        return [contact for contact in contacts if contact is not None]
+
+    def ack_contacts(self, contact_ids, token=None, sent=True, requeue=True):
+        """
+        Finish claimed contacts: mark them sent, or (sent=False) put them back in contacts_set.
+
+        Only claims still held by token are finished; a claim that expired and was taken
+        by another worker is left alone.
+
+        Returns:
+            list: IDs whose claim was finished.
         """
-        Resets 'message_sent' to '0' for all contacts, re-adds them to contacts_set, and clears processing_set.
+        if not contact_ids:
+            return []
+        token = token or self.claim_token
+        if not sent and not requeue:
+            # Drop the claim without re-queueing (the contact no longer exists).
+            pipeline = self.redis_client.pipeline()
+            pipeline.srem(self.processing_key, *contact_ids)
+            pipeline.zrem(self.lease_key, *contact_ids)
+            pipeline.hdel(self.owner_key, *contact_ids)
+            pipeline.execute()
+            return list(contact_ids)
+        finished = self._finish_script(
+            keys=[self.contacts_key, self.processing_key, self.lease_key, self.owner_key,
+                  self.delivery.generation_key, INDEX_KEY],
+            args=[token, 1 if sent else 0, self.delivery.sent_prefix, *contact_ids])
+        finished = [contact_id.decode('utf-8') for contact_id in finished]
+        if len(finished) < len(contact_ids):
+            logger.warning(f"{len(contact_ids) - len(finished)} contact claims had expired before being acknowledged")
+        return finished
+
+    def release_contacts(self, contact_ids, token=None):
+        """Give claimed contacts back to contacts_set unsent (e.g. after a send failure)."""
+        return self.ack_contacts(contact_ids, token=token, sent=False)
+
+    def reset_all_contacts(self, wait=False):
+        """
+        Starts a new round: every contact reads as unsent, all contacts are re-queued in
+        contacts_set and processing_set is cleared.
+
+        The reset itself is O(1): the campaign generation is bumped (one INCR) and the old
+        queue and claims are UNLINKed. contacts_all is then copied back into contacts_set
+        in REQUEUE_BATCH_SIZE chunks (requeue_contacts(), in the background unless wait),
+        so Redis is never blocked by one O(N) command; contacts claimed meanwhile are not
+        re-queued behind the claimer's back. The first reset on a database holding contacts
+        stored before delivery state existed runs rebuild_delivery_index() first.
+        The message_sent field in contact hashes is not reset any more (see delivery_state.py).
         """
         pipeline = self.redis_client.pipeline()
+        self.delivery.queue_reset(pipeline)
+        # Clear the contacts_set, the processing_set and its claims
+        pipeline.unlink(self.contacts_key, self.processing_key, self.lease_key, self.owner_key)
+        generation = pipeline.execute()[0]
+        self.delivery.sweep_in_background()
+        if wait:
+            self.requeue_contacts(generation)
+        else:
+            threading.Thread(target=self.requeue_contacts, args=(generation,), name="contacts-requeue",
+                             daemon=True).start()
+        print("All contacts have been reset and are being re-queued. processing_set has been cleared.")
 
-        # Reset 'message_sent' and re-add contact IDs to contacts_set
-        contact_keys = self.redis_client.keys('contact:*')
-        for key in contact_keys:
-            # Reset 'message_sent' to '0'
-            pipeline.hset(key, 'message_sent', '0')
-            # Extract contact_id from the key
-            contact_id = key.decode('utf-8').split(':', 1)[1]
-            # Re-add contact_id to contacts_set
-            pipeline.sadd(self.contacts_key, contact_id)
+    def requeue_contacts(self, generation, batch_size=REQUEUE_BATCH_SIZE):
+        """
+        Add every contact of contacts_all that is neither claimed nor sent to contacts_set,
+        one SSCAN batch at a time; stops when a newer reset takes over.
 
-        # Clear the processing_set
-        pipeline.delete(self.processing_key)
+        Returns:
+            int: Contacts added.
+        """
+        try:
+            if not self.redis_client.exists(INDEX_COMPLETE_KEY):
+                self.rebuild_delivery_index()
+            keys = [self.contacts_key, self.processing_key, self.delivery.generation_key, INDEX_KEY]
+            added = 0
+            batch = []
+            for contact_id in self.redis_client.sscan_iter(ALL_CONTACTS_KEY, count=batch_size):
+                batch.append(contact_id)
+                if len(batch) < batch_size:
+                    continue
+                result = self._requeue_script(keys=keys, args=[generation, self.delivery.sent_prefix, *batch])
+                if result < 0:
+                    logger.info(f"Re-queue of round {generation} superseded by a newer reset after {added} contacts")
+                    return added
+                added += result
+                batch = []
+            if batch:
+                added += max(0, self._requeue_script(keys=keys, args=[generation, self.delivery.sent_prefix, *batch]))
+            logger.info(f"Re-queued {added} contacts for round {generation}")
+            return added
+        except Exception as e:
+            logger.error(f"Re-queueing contacts for round {generation} failed: {e}")
+            return 0
+
+    def rebuild_delivery_index(self, batch_size=BULK_BATCH_SIZE):
+        """
+        Give every stored contact a delivery-state offset and add it to contacts_all
+        (for contacts stored before delivery state existed). Safe to run repeatedly.
+        """
+        if self.compact:
+            ids = (contact['id'] for contact in self.compact_store.iter_all())
+        else:
+            ids = (key.decode('utf-8').split(':', 1)[1]
+                   for key in self.redis_client.scan_iter(match='contact:*', count=batch_size))
+        indexed = 0
+        batch = []
+        for contact_id in ids:
+            batch.append(contact_id)
+            if len(batch) >= batch_size:
+                self.delivery.queue_assign(self.redis_client, batch)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            self.delivery.queue_assign(self.redis_client, batch)
+            indexed += len(batch)
+        self.redis_client.set(INDEX_COMPLETE_KEY, 1)
+        logger.info(f"Delivery index rebuilt for {indexed} contacts")
+        return indexed
 
-        pipeline.execute()
-        print("All contacts have been reset and re-queued. processing_set has been cleared.")
-    
     def delete_contact_by_id(self, contact_id):
         """
         Deletes a contact from Redis by contact ID.
@@ -62,14 +369,19 @@ class RedisContactManager:
         Args:
             contact_id (str): The ID of the contact.
         """
-        key = f"contact:{contact_id}"
         pipeline = self.redis_client.pipeline()
-        # Delete the contact hash
-        pipeline.delete(key)
+        # Delete the contact hash (or its blob in compact mode)
+        if self.compact:
+            self.compact_store.queue_delete(pipeline, str(contact_id))
+        else:
+            pipeline.delete(f"contact:{contact_id}")
         # Remove from contacts_set
         pipeline.srem(self.contacts_key, contact_id)
         # Remove from processing_set if present
         pipeline.srem(self.processing_key, contact_id)
+        pipeline.zrem(self.lease_key, contact_id)
+        pipeline.hdel(self.owner_key, contact_id)
+        self.delivery.queue_forget(pipeline, contact_id)
         pipeline.execute()
         logger.info(f"Contact with ID {contact_id} deleted from Redis.")
 
@@ -79,6 +391,10 @@ class RedisContactManager:
         """
         Delete all contacts from Redis.
         """
+        if self.compact:
+            self.compact_store.delete_all()
+            print("All compact contact buckets have been deleted.")
+
         pipeline = self.redis_client.pipeline()
 
         # Delete contact hashes
@@ -91,8 +407,10 @@ class RedisContactManager:
 
         # Delete the contacts set
         pipeline.delete(self.contacts_key)
-        # Delete the processing set
-        pipeline.delete(self.processing_key)
+        # Delete the processing set and its claims
+        pipeline.delete(self.processing_key, self.lease_key, self.owner_key)
+        # Forget delivery offsets (the sequence is kept so old sent bits are never reused)
+        pipeline.delete(INDEX_KEY, ALL_CONTACTS_KEY)
         pipeline.execute()
         print("Contacts set and processing set have been deleted.")
 
@@ -110,13 +428,19 @@ class RedisContactManager:
     def get_all_contacts(self):
         """
         Retrieve all contacts from Redis.
+
+        In compact mode the contacts are read-only LazyContact mappings.
         """
+        if self.compact:
+            return list(self.compact_store.iter_all())
         keys = self.redis_client.keys('contact:*')
+        is_sent = self.delivery.sent_lookup()
         contacts = []
         for key in keys:
             contact_data = self.redis_client.hgetall(key)
             # Convert bytes to appropriate data types
             contact = {k.decode('utf-8'): self._decode_value(v) for k, v in contact_data.items()}
+            contact['message_sent'] = '1' if is_sent(key.decode('utf-8').split(':', 1)[1]) else '0'
             contacts.append(contact)
         return contacts
 
@@ -159,13 +483,16 @@ class RedisContactManager:
         Returns:
             dict: The contact information if found, None otherwise.
         """
+        if self.compact:
+            return self.compact_store.get(contact_id)
         key = f"contact:{contact_id}"
         contact_data = self.redis_client.hgetall(key)
         if contact_data:
             # Decode the bytes to strings
             contact = {k.decode('utf-8'): self._decode_value(v) for k, v in contact_data.items()}
-            # Include the contact ID in the returned data
+            # Include the contact ID and its sent flag for the current round
             contact['id'] = contact_id
+            contact['message_sent'] = '1' if self.delivery.is_sent(contact_id) else '0'
             return contact
         else:
             return None
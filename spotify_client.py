@@ -0,0 +1,197 @@
+# SPOTIFY ACCESS FOR THE COMPS (JANUARY JACKPOT ARTIST VERIFICATION).
+# Client-credentials tokens live for an hour, so one token is shared by every worker
+# through Redis and refreshed shortly before it expires. Track searches are cached in
+# process and in Redis because the same songs are played on air all day.
+
+import hashlib
+import json
+import threading
+import time
+from base64 import b64encode
+
+import requests
+
+from constants import SPOTIFY_API_URL, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_TOKEN_URL
+from logger import logger
+from redis_cache import RedisContactManager
+from utilites import LRUCache
+
+TOKEN_KEY = "spotify:access_token"            # hash: token, expires_at
+TOKEN_LOCK_KEY = "spotify:access_token:refresh_lock"
+REFRESH_MARGIN_SECONDS = 300                  # refresh this long before the token expires
+REFRESH_LOCK_TIMEOUT = 30
+
+SEARCH_KEY_PREFIX = "spotify:search:"
+SEARCH_CACHE_TTL = 6 * 60 * 60
+SEARCH_MISS_TTL = 10 * 60                     # "no match" answers are cached for less time
+SEARCH_LOCAL_CACHE_SIZE = 2048
+
+
+class SpotifyTokenError(Exception):
+    """Raised when no valid Spotify access token could be obtained."""
+
+
+class SpotifyTokenManager:
+    """
+    Hands out a valid Spotify access token.
+
+    Lookup order is in-process copy, then the shared Redis copy, then a new token from
+    Spotify. Only the worker holding the Redis refresh lock talks to Spotify; everyone
+    else keeps using the current token (proactive refresh) or waits for the lock holder
+    and re-reads Redis (expired token), so an expiry never causes a stampede.
+    """
+
+    def __init__(self, redis_client=None):
+        self.redis_client = redis_client or RedisContactManager().redis_client
+        self._token = None
+        self._expires_at = 0.0
+        self._local_lock = threading.Lock()
+        self._refreshing = False
+
+    def get_token(self):
+        now = time.time()
+        if self._token and now < self._expires_at - REFRESH_MARGIN_SECONDS:
+            return self._token
+
+        token, expires_at = self._read_shared()
+        if token and now < expires_at:
+            self._token, self._expires_at = token, expires_at
+            if now >= expires_at - REFRESH_MARGIN_SECONDS:
+                self._refresh_in_background()
+            return token
+
+        # No usable token anywhere: refresh now, holding the shared lock.
+        return self._refresh(blocking=True)
+
+    def invalidate(self):
+        """Forget the current token, e.g. after Spotify answered 401."""
+        self._token, self._expires_at = None, 0.0
+        self.redis_client.delete(TOKEN_KEY)
+
+    def _read_shared(self):
+        data = self.redis_client.hgetall(TOKEN_KEY)
+        if not data:
+            return None, 0.0
+        return data[b"token"].decode("utf-8"), float(data[b"expires_at"])
+
+    def _refresh_in_background(self):
+        with self._local_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self._refresh(blocking=False)
+            except Exception as e:
+                logger.warning(f"Background Spotify token refresh failed: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _refresh(self, blocking):
+        lock = self.redis_client.lock(TOKEN_LOCK_KEY, timeout=REFRESH_LOCK_TIMEOUT,
+                                      blocking_timeout=REFRESH_LOCK_TIMEOUT if blocking else None)
+        if not lock.acquire(blocking=blocking):
+            # Another worker is refreshing; use whatever it has published so far.
+            token, expires_at = self._read_shared()
+            if token and time.time() < expires_at:
+                self._token, self._expires_at = token, expires_at
+                return token
+            if blocking:
+                # We waited the whole lock timeout and the holder never published a token.
+                raise SpotifyTokenError("Spotify token refresh is held by another worker that did not finish")
+            return self._token
+        try:
+            # Someone may have refreshed while we waited for the lock.
+            token, expires_at = self._read_shared()
+            if token and time.time() < expires_at - REFRESH_MARGIN_SECONDS:
+                self._token, self._expires_at = token, expires_at
+                return token
+
+            token, expires_in = self._fetch_token()
+            expires_at = time.time() + expires_in
+            pipeline = self.redis_client.pipeline()
+            pipeline.hset(TOKEN_KEY, mapping={"token": token, "expires_at": expires_at})
+            pipeline.expire(TOKEN_KEY, int(expires_in))
+            pipeline.execute()
+            self._token, self._expires_at = token, expires_at
+            logger.info(f"Spotify access token refreshed, valid for {expires_in}s")
+            return token
+        finally:
+            try:
+                lock.release()
+            except Exception:
+                pass
+
+    def _fetch_token(self):
+        auth = b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
+        headers = {
+            "Authorization": f"Basic {auth}",
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        response = requests.post(SPOTIFY_TOKEN_URL, headers=headers,
+                                 data={"grant_type": "client_credentials"}, timeout=10)
+        response.raise_for_status()
+        payload = response.json()
+        return payload["access_token"], int(payload.get("expires_in", 3600))
+
+
+_token_manager = None
+_search_cache = LRUCache(max_size=SEARCH_LOCAL_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
+
+def get_token_manager():
+    global _token_manager
+    if _token_manager is None:
+        _token_manager = SpotifyTokenManager()
+    return _token_manager
+
+
+def search_spotify(query, token, search_type="track"):
+    """Search Spotify API (uncached)."""
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {
+        "q": query,
+        "type": search_type,
+        "limit": 1
+    }
+    return requests.get(f"{SPOTIFY_API_URL}/search", headers=headers, params=params, timeout=10)
+
+
+def _search_cache_key(title, artist):
+    normalized = f"{title.strip().lower()}|{artist.strip().lower()}"
+    return SEARCH_KEY_PREFIX + hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def search_track(title, artist):
+    """
+    Search Spotify for a track by title and artist, cached in process and in Redis.
+
+    Returns:
+        dict: The Spotify search response (possibly with no items).
+    """
+    key = _search_cache_key(title, artist)
+    result = _search_cache.get(key)
+    if result is not None:
+        return result
+
+    manager = get_token_manager()
+    cached = manager.redis_client.get(key)
+    if cached:
+        result = json.loads(cached)
+        _search_cache.set(key, result)
+        return result
+
+    response = search_spotify(f"track:{title} artist:{artist}", manager.get_token())
+    if response.status_code == 401:
+        manager.invalidate()
+        response = search_spotify(f"track:{title} artist:{artist}", manager.get_token())
+    response.raise_for_status()
+    result = response.json()
+
+    ttl = SEARCH_CACHE_TTL if result.get("tracks", {}).get("items") else SEARCH_MISS_TTL
+    manager.redis_client.set(key, json.dumps(result), ex=ttl)
+    _search_cache.set(key, result, ttl=ttl)
+    return result
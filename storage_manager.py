@@ -0,0 +1,255 @@
+# DISK HOUSEKEEPING FOR RECORDED AUDIO.
+# The comps leave audio behind: Splash session directories under CHUNK_DIR, every
+# processed recording moved to PROCESSED_DIR, and WAV/MP3/speech files in OUTPUT_DIR
+# whenever processing failed before its own cleanup. One worker (leader-elected, like the
+# ACR poller) sweeps them every STORAGE_SWEEP_MINUTES:
+#   - files no process has touched for ORPHAN_MINUTES in the working directories are
+#     leftovers of a crashed or failed run and are deleted (first sweep runs at startup);
+#   - kept audio older than TRANSCODE_AFTER_MINUTES is re-encoded with the
+#     STORAGE_ARCHIVE_PROFILE audio profile (low-bitrate speech) in place;
+#   - each directory is held to its retention: files past the age limit go first, then the
+#     oldest files until the directory is under its size limit;
+#   - directory sizes and free disk space are published as storage.* gauges.
+# The audio archive (audio_archive.py) prunes its own segments and is not managed here.
+
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+import metrics
+from audio_profile import PROFILES, encode_file
+from constants import (STORAGE_MANAGER_ENABLED, STORAGE_SWEEP_MINUTES, STORAGE_CHUNK_RETENTION_HOURS,
+                       STORAGE_CHUNK_MAX_MB, STORAGE_PROCESSED_RETENTION_DAYS, STORAGE_PROCESSED_MAX_MB,
+                       STORAGE_ARCHIVE_PROFILE, CHUNK_DIR, OUTPUT_DIR, PROCESSED_DIR)
+from logger import logger
+from redis_cache import RedisContactManager
+
+ORPHAN_MINUTES = 60               # longer than any recording + processing run leaves a file untouched
+TRANSCODE_AFTER_MINUTES = 60
+TEMP_MARKER = ".tmp."             # transcodes are written as name.tmp.ext, then renamed
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".ogg", ".opus", ".m4a", ".aac", ".flac")
+KEEP_FILES = ("splash_gptmessage.txt",)    # session results survive orphan cleanup
+LEADER_KEY = "storage_manager:leader"
+LEADER_RETRY_SECONDS = 120
+
+
+class RetentionPolicy:
+    """
+    What is kept in one directory.
+
+    Args:
+        name (str): Metric name of the directory.
+        directory (str): Directory to manage.
+        max_age_seconds (float): Delete files older than this (None: no age limit).
+        max_bytes (int): Delete the oldest files while the directory is larger (None: no limit).
+        recursive (bool): Include subdirectories (e.g. Splash session directories).
+        orphans (bool): The directory holds work in progress; untouched files are leftovers.
+        transcode (bool): Re-encode kept audio with the archive profile.
+    """
+
+    def __init__(self, name, directory, max_age_seconds=None, max_bytes=None, recursive=False,
+                 orphans=False, transcode=False):
+        self.name = name
+        self.directory = directory
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.recursive = recursive
+        self.orphans = orphans
+        self.transcode = transcode
+
+    def files(self):
+        """(path, size, mtime) of every file, oldest first."""
+        found = []
+        pending = [self.directory]
+        while pending:
+            try:
+                entries = list(os.scandir(pending.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive:
+                            pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        found.append((entry.path, stat.st_size, stat.st_mtime))
+                except FileNotFoundError:
+                    continue            # removed while we looked
+        found.sort(key=lambda item: item[2])
+        return found
+
+
+def default_policies():
+    return [
+        RetentionPolicy("output", OUTPUT_DIR, orphans=True),
+        RetentionPolicy("processed", PROCESSED_DIR, max_age_seconds=STORAGE_PROCESSED_RETENTION_DAYS * 86400,
+                        max_bytes=STORAGE_PROCESSED_MAX_MB * 1024 * 1024, transcode=True),
+        RetentionPolicy("chunks", CHUNK_DIR, max_age_seconds=STORAGE_CHUNK_RETENTION_HOURS * 3600,
+                        max_bytes=STORAGE_CHUNK_MAX_MB * 1024 * 1024, recursive=True, orphans=True),
+    ]
+
+
+class StorageManager:
+    """Applies the retention policies; sweep() is one pass over every directory."""
+
+    def __init__(self, policies=None, archive_profile=STORAGE_ARCHIVE_PROFILE):
+        self.policies = policies if policies is not None else default_policies()
+        self.archive_profile = PROFILES.get(archive_profile)
+        if self.archive_profile is None:
+            logger.warning(f"Unknown STORAGE_ARCHIVE_PROFILE '{archive_profile}'; kept audio is not re-encoded")
+
+    def sweep(self):
+        """Returns {policy name: {"files", "bytes", "deleted", "deleted_bytes"}}."""
+        report = {}
+        for policy in self.policies:
+            try:
+                report[policy.name] = self._apply(policy)
+            except Exception as e:
+                logger.error(f"Storage sweep of {policy.directory} failed: {e}")
+        self._publish_disk_usage()
+        return report
+
+    def _apply(self, policy):
+        now = time.time()
+        deleted = deleted_bytes = 0
+        kept = []
+        for path, size, mtime in policy.files():
+            age = now - mtime
+            if (TEMP_MARKER in os.path.basename(path) and age > ORPHAN_MINUTES * 60
+                    or policy.orphans and age > ORPHAN_MINUTES * 60 and os.path.basename(path) not in KEEP_FILES
+                    or policy.max_age_seconds is not None and age > policy.max_age_seconds):
+                if self._remove(path):
+                    deleted, deleted_bytes = deleted + 1, deleted_bytes + size
+                continue
+            if policy.transcode and age > TRANSCODE_AFTER_MINUTES * 60:
+                path, size = self._transcode(path, size)
+            kept.append((path, size))
+
+        total = sum(size for _, size in kept)
+        if policy.max_bytes is not None:
+            while kept and total > policy.max_bytes:
+                path, size = kept.pop(0)    # oldest first
+                if self._remove(path):
+                    deleted, deleted_bytes = deleted + 1, deleted_bytes + size
+                total -= size
+        if policy.recursive:
+            self._remove_empty_directories(policy.directory)
+
+        if deleted:
+            logger.info(f"Storage: removed {deleted} files ({deleted_bytes} bytes) from {policy.directory}")
+            metrics.incr("storage.deleted_files", deleted)
+            metrics.incr("storage.deleted_bytes", deleted_bytes)
+        metrics.gauge(f"storage.{policy.name}.bytes", total)
+        metrics.gauge(f"storage.{policy.name}.files", len(kept))
+        return {"files": len(kept), "bytes": total, "deleted": deleted, "deleted_bytes": deleted_bytes}
+
+    def _transcode(self, path, size):
+        """Re-encode one kept recording with the archive profile; returns the (path, size) kept."""
+        profile = self.archive_profile
+        stem, extension = os.path.splitext(path)
+        if profile is None or extension.lower() not in AUDIO_EXTENSIONS or extension == f".{profile.extension}":
+            return path, size
+        target = f"{stem}.{profile.extension}"
+        temp = f"{stem}{TEMP_MARKER}{profile.extension}"
+        try:
+            encode_file(path, temp, profile)
+            os.replace(temp, target)
+            os.remove(path)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning(f"Storage: could not re-encode {path}: {e}")
+            self._remove(temp)
+            return path, size
+        new_size = os.path.getsize(target)
+        metrics.incr("storage.transcoded_bytes_saved", max(0, size - new_size))
+        return target, new_size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"Storage: could not remove {path}: {e}")
+            return False
+
+    @staticmethod
+    def _remove_empty_directories(root):
+        for directory, subdirectories, files in os.walk(root, topdown=False):
+            if directory != root and not subdirectories and not files:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass            # a session started writing into it again
+
+    def _publish_disk_usage(self):
+        try:
+            usage = shutil.disk_usage(".")
+        except OSError:
+            return
+        metrics.gauge("storage.disk_free_bytes", usage.free)
+        metrics.gauge("storage.disk_used_ratio", round(usage.used / usage.total, 4))
+
+
+class StorageManagerThread(threading.Thread):
+    """Background thread; only the worker holding LEADER_KEY sweeps."""
+
+    def __init__(self, manager=None, redis_client=None):
+        super().__init__(name="storage-manager", daemon=True)
+        self.manager = manager or StorageManager()
+        self.redis_client = redis_client or RedisContactManager().redis_client
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # Held across the pause between sweeps, so it outlives one interval.
+        self.leader_lock = self.redis_client.lock(LEADER_KEY, timeout=STORAGE_SWEEP_MINUTES * 60 + LEADER_RETRY_SECONDS)
+        self.is_leader = False
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                if self._hold_leadership():
+                    self.manager.sweep()
+                self.stopped.wait(STORAGE_SWEEP_MINUTES * 60 if self.is_leader else LEADER_RETRY_SECONDS)
+        finally:
+            if self.is_leader:
+                try:
+                    self.leader_lock.release()
+                except Exception:
+                    pass
+
+    def _hold_leadership(self):
+        if self.is_leader:
+            try:
+                self.leader_lock.reacquire()
+                return True
+            except Exception:
+                logger.warning("Storage manager lost leadership")
+                self.is_leader = False
+        if self.leader_lock.acquire(blocking=False):
+            self.is_leader = True
+            logger.info(f"Worker {self.worker_id} is now the storage manager")
+        return self.is_leader
+
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def start_storage_manager():
+    """Start the storage manager thread for this worker (idempotent; no-op unless STORAGE_MANAGER_ENABLED)."""
+    global _thread
+    if not STORAGE_MANAGER_ENABLED:
+        return None
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = StorageManagerThread()
+            _thread.start()
+    return _thread
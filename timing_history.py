@@ -0,0 +1,303 @@
+# TIMING HISTORY AND SELF-TUNING COMP TIMINGS.
+# The comps' timing constants (how long to wait after the alarm, chunk length, when to
+# start analysing, how long to record) were set by hand. Every session now records when
+# things actually happened, in seconds after the alarm, in a local SQLite file
+# (TIMING_HISTORY_DB, one row per session, safe to share between workers):
+#   splash:      segment start, recording start, first call-initiation phrase in the
+#                transcript (stage 1) or that the call had already begun when recording
+#                started (censored), outcome chunk and time, analysis latency, and
+#                whether the confirmation pass changed the outcome;
+#   recordings:  where the comp's speech ended (first long music stretch) in
+#                millionaire/xcraker recordings, and whether it ran to the end.
+# TimingTuner turns the distributions into a recommended value per constant once a comp
+# has MIN_SESSIONS sessions. With TIMING_AUTOTUNE the comps use the recommendations
+# (timing_profile()); otherwise they are only reported:
+#
+#   python timing_history.py                 # recommendations for every comp
+#   python timing_history.py splash --days 30
+
+import argparse
+import json
+import math
+import queue
+import sqlite3
+import threading
+import time
+
+from constants import TIMING_HISTORY_DB, TIMING_AUTOTUNE
+from logger import logger
+
+MIN_SESSIONS = 10
+HISTORY_DAYS = 60
+PROFILE_CACHE_SECONDS = 600
+START_MARGIN_SECONDS = 60          # start recording this long before the earliest observed call
+DEADLINE_MARGIN_SECONDS = 30       # wait this long past the latest observed segment start
+RECORDING_MARGIN_SECONDS = 15      # record this long past the latest observed end of speech
+NOTIFY_TARGET_SECONDS = 120        # Splash: outcome to SMS (TARGET_NOTIFICATION_MINUTES)
+MUSIC_GAP_SECONDS = 15             # non-speech this long means the comp handed over to music
+TRUNCATED_SHARE = 0.05             # more recordings than this ending mid-speech: record longer
+STAGE1_CENSOR_SECONDS = 30         # a call phrase this early in the recording may have begun before it
+STAGE1_PHRASES = ("make the call", "making the call", "dialing", "dialling", "got a number", "calling now")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    comp TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    alarm_at REAL NOT NULL,
+    timings TEXT NOT NULL,
+    PRIMARY KEY (comp, session_id)
+)
+"""
+
+
+def quantile(values, q):
+    """Linear-interpolated quantile of a non-empty list."""
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    low, high = math.floor(position), math.ceil(position)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def speech_end_seconds(regions):
+    """End of the first run of speech regions (SpeechRegions or (start, end) pairs) before a long music stretch."""
+    end = None
+    for start, region_end in regions:
+        if end is not None and start - end >= MUSIC_GAP_SECONDS:
+            break
+        end = region_end
+    return end
+
+
+def recording_timings(regions, preroll=0.0):
+    """Timings of a fixed-length comp recording from its SpeechRegions, in seconds after the trigger."""
+    end = speech_end_seconds(regions)
+    if end is None:
+        return {}
+    return {"speech_end_seconds": round(end - preroll, 2),
+            "speech_truncated": regions.source_duration - end < MUSIC_GAP_SECONDS,
+            "recording_seconds": round(regions.source_duration - preroll, 2)}
+
+
+def first_phrase_seconds(segments, phrases=STAGE1_PHRASES):
+    """Start of the first transcript segment containing one of phrases (None if none does)."""
+    for segment in segments:
+        text = segment["text"].lower()
+        if any(phrase in text for phrase in phrases):
+            return segment["start"]
+    return None
+
+
+class TimingHistory:
+    """Per-session event timings of every comp, in a SQLite file."""
+
+    def __init__(self, path=None):
+        self.path = path or TIMING_HISTORY_DB
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def record(self, comp, session_id, alarm_at, **timings):
+        """
+        Store (or replace) one session's timings.
+
+        Args:
+            alarm_at (float): Epoch of the alarm.
+            timings: Seconds after the alarm (or other per-session facts); None values are dropped.
+        """
+        timings = {name: value for name, value in timings.items() if value is not None}
+        try:
+            with self._connect() as connection:
+                connection.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                                   (comp, str(session_id), alarm_at, json.dumps(timings)))
+        except sqlite3.Error as e:
+            logger.error(f"Could not record timings of {comp} session {session_id}: {e}")
+
+    def sessions(self, comp, days=HISTORY_DAYS):
+        """Timings dicts of comp's sessions in the last `days`, oldest first."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT alarm_at, timings FROM sessions WHERE comp = ? AND alarm_at >= ? ORDER BY alarm_at",
+                (comp, time.time() - days * 86400)).fetchall()
+        return [dict(json.loads(timings), alarm_at=alarm_at) for alarm_at, timings in rows]
+
+    def comps(self):
+        with self._connect() as connection:
+            return [comp for comp, in connection.execute("SELECT DISTINCT comp FROM sessions ORDER BY comp")]
+
+
+class TimingTuner:
+    """Recommends timing constants per comp from the recorded distributions."""
+
+    def __init__(self, history=None, min_sessions=MIN_SESSIONS):
+        self.history = history or TimingHistory()
+        self.min_sessions = min_sessions
+
+    def recommend(self, comp, days=HISTORY_DAYS):
+        """
+        Returns:
+            dict: constant name -> {"value", "sessions", "basis"}; constants without enough
+            observations are left out.
+        """
+        sessions = self.history.sessions(comp, days)
+        rules = self._splash if comp == "splash" else self._recording
+        return rules(sessions)
+
+    def _values(self, sessions, name):
+        values = [session[name] for session in sessions if isinstance(session.get(name), (int, float))]
+        return values if len(values) >= self.min_sessions else None
+
+    def _splash(self, sessions):
+        recommended = {}
+        segment_starts = self._values(sessions, "segment_start_seconds")
+        # Calls that began before the recording started are never observed, so the first
+        # call phrases seen are biased late; censored sessions only say "start earlier".
+        stage1 = self._values([session for session in sessions if not session.get("stage1_censored")],
+                              "stage1_seconds")
+        censored = [session["recording_start_seconds"] for session in sessions
+                    if session.get("stage1_censored") and "recording_start_seconds" in session]
+        uncensored = sum(1 for session in sessions
+                         if not session.get("stage1_censored") and isinstance(session.get("stage1_seconds"), (int, float)))
+        observed = uncensored + len(censored)
+        if segment_starts:
+            # The segment start is being heard: the delay is only the give-up deadline.
+            recommended["INITIAL_DELAY_MINUTES"] = {
+                "value": _minutes((quantile(segment_starts, 0.95) + DEADLINE_MARGIN_SECONDS) / 60, up=True),
+                "sessions": len(segment_starts), "basis": "95th percentile segment start + margin"}
+        elif observed >= self.min_sessions and len(censored) > TRUNCATED_SHARE * observed:
+            recommended["INITIAL_DELAY_MINUTES"] = {
+                "value": _minutes(max(0.0, min(censored) - START_MARGIN_SECONDS) / 60),
+                "sessions": observed, "basis": f"call already under way at recording start in {len(censored)}/{observed} sessions"}
+        elif stage1:
+            recommended["INITIAL_DELAY_MINUTES"] = {
+                "value": _minutes(max(0.0, quantile(stage1, 0.05) - START_MARGIN_SECONDS) / 60),
+                "sessions": len(stage1), "basis": "5th percentile first call phrase - margin"}
+
+        stage1_recording = self._values(sessions, "stage1_recording_seconds")
+        if stage1_recording:
+            recommended["OUTCOME_CHECK_MINUTES"] = {
+                "value": _minutes(quantile(stage1_recording, 0.05) / 60),
+                "sessions": len(stage1_recording), "basis": "5th percentile first call phrase, recording time"}
+
+        latency = self._values(sessions, "analysis_seconds")
+        if latency:
+            # An outcome waits on average half a chunk to be recorded, then for analysis.
+            chunk = 2 * max(0.0, NOTIFY_TARGET_SECONDS - quantile(latency, 0.9)) / 60
+            recommended["CHUNK_DURATION_MINUTES"] = {
+                "value": min(4.0, max(1.0, _minutes(chunk))),
+                "sessions": len(latency), "basis": "notification target - 90th percentile analysis time"}
+
+        # The extra recording after an outcome only pays off if the confirmation pass ever
+        # changes the outcome; if it never has, one confirmation chunk is enough.
+        confirmations = [session["confirmation_changed"] for session in sessions if "confirmation_changed" in session]
+        if len(confirmations) >= self.min_sessions and not any(confirmations):
+            recommended["NEXT_ROUND_WAIT_MINUTES"] = {
+                "value": 0, "sessions": len(confirmations),
+                "basis": f"confirmation pass changed 0/{len(confirmations)} outcomes"}
+        return recommended
+
+    def _recording(self, sessions):
+        ends = self._values(sessions, "speech_end_seconds")
+        if not ends:
+            return {}
+        # A recording that ends mid-speech only says the comp ran at least that long.
+        truncated = [session["recording_seconds"] for session in sessions
+                     if session.get("speech_truncated") and "recording_seconds" in session]
+        if len(truncated) > TRUNCATED_SHARE * len(ends):
+            return {"RECORDING_DURATION": {
+                "value": int(math.ceil(max(truncated) + 2 * RECORDING_MARGIN_SECONDS)),
+                "sessions": len(ends), "basis": f"speech ran to the end of {len(truncated)}/{len(ends)} recordings"}}
+        return {"RECORDING_DURATION": {
+            "value": int(math.ceil(quantile(ends, 0.95) + RECORDING_MARGIN_SECONDS)),
+            "sessions": len(ends), "basis": "95th percentile end of speech + margin"}}
+
+
+def _minutes(value, up=False):
+    """Round minutes to the half minute (down unless up)."""
+    return (math.ceil if up else math.floor)(value * 2) / 2
+
+
+_history = None
+_profiles = {}
+_lock = threading.Lock()
+_pending = queue.SimpleQueue()
+_writer = None
+
+
+def get_timing_history():
+    """The process wide TimingHistory."""
+    global _history
+    with _lock:
+        if _history is None:
+            _history = TimingHistory()
+    return _history
+
+
+def record_timings(comp, session_id, alarm_at, **timings):
+    """
+    Record a session's timings without ever failing or delaying the comp: the SQLite
+    write (which may wait on the file lock) happens on a background thread.
+    """
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_forever, name="timing-history", daemon=True)
+            _writer.start()
+    _pending.put((comp, session_id, alarm_at, timings))
+
+
+def _write_forever():
+    while True:
+        comp, session_id, alarm_at, timings = _pending.get()
+        try:
+            get_timing_history().record(comp, session_id, alarm_at, **timings)
+        except Exception as e:
+            logger.error(f"Could not record timings of {comp} session {session_id}: {e}")
+
+
+def timing_profile(comp, defaults):
+    """
+    The timing constants a comp should use: defaults, overridden by the tuner's
+    recommendations when TIMING_AUTOTUNE is on (cached for PROFILE_CACHE_SECONDS).
+    """
+    if not TIMING_AUTOTUNE:
+        return dict(defaults)
+    with _lock:
+        cached = _profiles.get(comp)
+    if cached is None or time.monotonic() - cached[0] > PROFILE_CACHE_SECONDS:
+        try:
+            recommended = TimingTuner(get_timing_history()).recommend(comp)
+        except Exception as e:
+            logger.error(f"Timing tuner failed for {comp}, using defaults: {e}")
+            recommended = {}
+        cached = (time.monotonic(), {name: item["value"] for name, item in recommended.items()})
+        with _lock:
+            _profiles[comp] = cached
+        if cached[1]:
+            logger.info(f"Tuned timings for {comp}: {cached[1]}")
+    profile = dict(defaults)
+    profile.update({name: value for name, value in cached[1].items() if name in defaults})
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend comp timing constants from the timing history")
+    parser.add_argument("comps", nargs="*", help="comps to report (default: all recorded)")
+    parser.add_argument("--days", type=int, default=HISTORY_DAYS)
+    parser.add_argument("--db", default=TIMING_HISTORY_DB)
+    args = parser.parse_args()
+    history = TimingHistory(args.db)
+    tuner = TimingTuner(history)
+    for comp in args.comps or history.comps():
+        print(f"{comp} ({len(history.sessions(comp, args.days))} sessions)")
+        recommended = tuner.recommend(comp, args.days)
+        if not recommended:
+            print(f"  not enough sessions yet (need {MIN_SESSIONS})")
+        for name, item in recommended.items():
+            print(f"  {name} = {item['value']}  ({item['basis']}, {item['sessions']} sessions)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# STITCHING OVERLAPPING CHUNK TRANSCRIPTS.
+# Consecutive recording chunks overlap (the tail of one chunk is repeated at the start of
+# the next) so no utterance is cut in half at a chunk boundary, which means the overlap is
+# transcribed twice. TranscriptStitcher places each chunk's timed segments on the
+# recording's timeline and returns only what has not been emitted before: the new chunk's
+# words that start before the end of the emitted speech are aligned with the emitted words
+# (difflib on normalised words) and only the words after the last aligned run are new.
+# When the two transcriptions of the overlap do not align at all, the time boundary alone
+# decides which segments are new.
+
+import difflib
+import re
+
+import metrics
+
+MIN_ALIGNED_WORDS = 2          # a shared run of this many words anchors the overlap
+
+_WORD = re.compile(r"[\w']+")
+
+
+def _words(text):
+    """(normalised word, character offset) for every word of text."""
+    return [(match.group().lower(), match.start()) for match in _WORD.finditer(text)]
+
+
+class TranscriptStitcher:
+    """
+    Turns the timed segments of overlapping chunks into one transcript without repeats.
+
+    Segments are dicts with start/end (seconds) and text, as returned by
+    TranscriptionBackend.transcribe_segments().
+    """
+
+    def __init__(self):
+        self.emitted = []              # segments on the recording timeline
+        self.emitted_until = None      # end of the last emitted segment
+        self.duplicate_words = 0
+
+    def add(self, segments, offset=0.0, end=None):
+        """
+        Add one chunk's segments.
+
+        Args:
+            segments (list): Segments with times relative to the chunk start.
+            offset (float): Recording time at which the chunk starts.
+            end (float): Recording time at which the chunk ends (for segments without an end).
+
+        Returns:
+            list: The new segments, in recording time.
+        """
+        placed = [{"start": offset + segment["start"],
+                   "end": offset + segment["end"] if segment.get("end") is not None else end,
+                   "text": segment["text"]}
+                  for segment in segments if segment["text"].strip()]
+        if self.emitted_until is None:
+            new = placed
+        else:
+            overlap = [segment for segment in placed if segment["start"] < self.emitted_until]
+            new = self._dedupe(overlap, offset) + placed[len(overlap):]
+        self.emitted.extend(new)
+        ends = [segment["end"] for segment in new if segment["end"] is not None]
+        if ends:
+            self.emitted_until = max(ends + ([self.emitted_until] if self.emitted_until is not None else []))
+        return new
+
+    def _dedupe(self, overlap, offset):
+        """The parts of the overlap segments not already emitted."""
+        if not overlap:
+            return []
+        previous = [word for segment in self.emitted
+                    if segment["end"] is None or segment["end"] > offset
+                    for word, _ in _words(segment["text"])]
+        # Every word of the overlap as (segment index, character offset).
+        positions, words = [], []
+        for index, segment in enumerate(overlap):
+            for word, at in _words(segment["text"]):
+                positions.append((index, at))
+                words.append(word)
+
+        matcher = difflib.SequenceMatcher(None, previous, words, autojunk=False)
+        anchors = [block for block in matcher.get_matching_blocks()
+                   if block.size >= min(MIN_ALIGNED_WORDS, len(words)) and block.size]
+        if anchors:
+            cut = anchors[-1].b + anchors[-1].size
+        else:
+            # No common wording: keep the segments that mostly lie after the emitted speech.
+            cut = 0
+            for index, segment in enumerate(overlap):
+                middle = (segment["start"] + (segment["end"] if segment["end"] is not None else segment["start"])) / 2
+                if middle >= self.emitted_until:
+                    break
+                cut = sum(1 for position in positions if position[0] <= index)
+
+        self.duplicate_words += cut
+        if cut:
+            metrics.incr("transcript_stitcher.duplicate_words", cut)
+        new = []
+        for index, segment in enumerate(overlap):
+            kept = [at for number, (segment_index, at) in enumerate(positions) if segment_index == index and number >= cut]
+            if not kept:
+                continue
+            if kept[0] == _words(segment["text"])[0][1]:
+                new.append(segment)
+                continue
+            start = max(segment["start"], self.emitted_until)
+            if segment["end"] is not None:
+                start = min(start, segment["end"])
+            new.append({"start": start, "end": segment["end"], "text": segment["text"][kept[0]:]})
+        return new
@@ -0,0 +1,105 @@
+# APPEND-ONLY TRANSCRIPT STORAGE FOR DETECTION SESSIONS.
+# Every transcribed chunk is appended once to a Redis stream (one per session) together
+# with its position in the transcript and in the recording. Nothing is ever rewritten;
+# the text handed to the analysis is assembled from the segments only when asked for,
+# and the stream outlives the session so its transcript can be queried afterwards.
+
+import time
+
+from logger import logger
+from redis_cache import RedisContactManager
+
+STREAM_KEY = "transcript:{session_id}"
+STREAM_TTL_SECONDS = 7 * 24 * 60 * 60
+CHUNK_HEADER = "\n--- Chunk {chunk} ---\n"
+
+
+class TranscriptStore:
+    """
+    Transcript of one session as a list of segments.
+
+    Each segment is a dict with chunk, text, offset (characters into the assembled
+    transcript), start/end (seconds into the recording) and recorded_at.
+    """
+
+    def __init__(self, session_id, redis_client=None):
+        self.session_id = session_id
+        self.key = STREAM_KEY.format(session_id=session_id)
+        self.redis_client = redis_client or RedisContactManager().redis_client
+        self._segments = None
+        self._length = 0
+
+    def append(self, chunk, text, start=None, end=None):
+        """Append one chunk's transcript. Returns the stored segment."""
+        segments = self.segments()
+        segment = {
+            "chunk": chunk,
+            "text": text,
+            "offset": self._length,
+            "start": start,
+            "end": end,
+            "recorded_at": time.time(),
+        }
+        fields = {name: "" if value is None else value for name, value in segment.items()}
+        try:
+            pipeline = self.redis_client.pipeline()
+            pipeline.xadd(self.key, fields)
+            pipeline.expire(self.key, STREAM_TTL_SECONDS)
+            pipeline.execute()
+        except Exception as e:
+            # The in-process copy still serves this session's analysis.
+            logger.error(f"Could not store transcript segment {chunk} of session {self.session_id}: {e}")
+        segments.append(segment)
+        self._length += len(CHUNK_HEADER.format(chunk=chunk)) + len(text)
+        return segment
+
+    def segments(self):
+        """All segments, loaded from Redis the first time (e.g. for a finished session)."""
+        if self._segments is None:
+            self._segments = [self._decode(fields) for _, fields in self.redis_client.xrange(self.key)]
+            if self._segments:
+                last = self._segments[-1]
+                self._length = last["offset"] + len(CHUNK_HEADER.format(chunk=last["chunk"])) + len(last["text"])
+        return self._segments
+
+    @staticmethod
+    def _decode(fields):
+        fields = {key.decode("utf-8"): value.decode("utf-8") for key, value in fields.items()}
+        return {
+            "chunk": int(fields["chunk"]),
+            "text": fields["text"],
+            "offset": int(fields["offset"]),
+            "start": float(fields["start"]) if fields.get("start") else None,
+            "end": float(fields["end"]) if fields.get("end") else None,
+            "recorded_at": float(fields["recorded_at"]),
+        }
+
+    def window(self, last_chunks=None, since_seconds=None):
+        """
+        Assemble transcript text for analysis.
+
+        Args:
+            last_chunks (int): Only the last N segments.
+            since_seconds (float): Only segments ending after this point of the recording.
+        """
+        segments = self.segments()
+        if since_seconds is not None:
+            segments = [segment for segment in segments if segment["end"] is None or segment["end"] > since_seconds]
+        if last_chunks is not None:
+            segments = segments[-last_chunks:]
+        return "".join(self.parts(segments))
+
+    def parts(self, segments=None):
+        """Each segment as header + text, oldest first (what prompts.Prompt budgets over)."""
+        segments = self.segments() if segments is None else segments
+        return [CHUNK_HEADER.format(chunk=segment["chunk"]) + segment["text"] for segment in segments]
+
+    def text(self):
+        """The full transcript."""
+        return self.window()
+
+    def __len__(self):
+        return len(self.segments())
+
+    def __bool__(self):
+        return True
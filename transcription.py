@@ -0,0 +1,292 @@
+# TRANSCRIPTION BACKENDS USED BY EVERY COMP THAT TURNS AUDIO INTO TEXT.
+# "http"  -> Whisper compatible HTTP API (OpenAI or WHISPER_API_URL).
+# "local" -> faster-whisper models in a parallel CPU process pool (one job per chunk).
+
+import abc
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+import requests
+
+from constants import (
+    OPENAI_API_KEY,
+    WHISPER_API_URL,
+    TRANSCRIPTION_BACKEND,
+    LOCAL_WHISPER_MODEL,
+    LOCAL_WHISPER_COMPUTE_TYPE,
+    LOCAL_WHISPER_WORKERS,
+)
+from logger import logger
+import metrics
+
+DEFAULT_WHISPER_API_URL = "https://api.openai.com/v1/audio/transcriptions"
+
+
+class TranscriptionError(Exception):
+    """Raised when a backend could not produce a transcript."""
+
+
+class TranscriptionBackend(abc.ABC):
+    """Base class for all transcription backends."""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def transcribe(self, file_path, language=None, timeout=None):
+        """
+        Transcribe an audio file.
+
+        Args:
+            file_path (str): Path of the audio file to transcribe.
+            language (str): Optional ISO language hint, e.g. 'en'.
+            timeout (float): Maximum seconds to wait for the transcript.
+
+        Returns:
+            str: The transcript text.
+        """
+
+    async def transcribe_async(self, file_path, language=None, timeout=None):
+        """Coroutine version of transcribe() for the comp runtime (see comp_runtime.py)."""
+        return await asyncio.to_thread(self.transcribe, file_path, language, timeout)
+
+    def transcribe_segments(self, file_path, language=None, timeout=None):
+        """
+        Transcribe an audio file into timed segments.
+
+        Returns:
+            list: {"start": seconds, "end": seconds, "text": str} dicts in order. Backends
+            without timestamps return the whole transcript as one segment.
+        """
+        text = self.transcribe(file_path, language, timeout)
+        return [{"start": 0.0, "end": None, "text": text}] if text else []
+
+    async def transcribe_segments_async(self, file_path, language=None, timeout=None):
+        """Coroutine version of transcribe_segments()."""
+        return await asyncio.to_thread(self.transcribe_segments, file_path, language, timeout)
+
+    def close(self):
+        """Release any resources held by the backend."""
+
+
+def _segments_from_verbose_json(body):
+    """Segments of a Whisper response_format=verbose_json body."""
+    segments = [{"start": float(segment["start"]), "end": float(segment["end"]), "text": segment["text"].strip()}
+                for segment in body.get("segments") or []]
+    if not segments and body.get("text"):
+        segments = [{"start": 0.0, "end": body.get("duration"), "text": body["text"].strip()}]
+    return [segment for segment in segments if segment["text"]]
+
+
+class HTTPTranscriptionBackend(TranscriptionBackend):
+    """Uploads audio to a Whisper compatible HTTP endpoint."""
+
+    name = "http"
+
+    def __init__(self, api_url=None, api_key=None, model="whisper-1"):
+        self.api_url = api_url or WHISPER_API_URL or DEFAULT_WHISPER_API_URL
+        self.api_key = (api_key or OPENAI_API_KEY or "").strip()
+        self.model = model
+        # Keep-alive session so consecutive chunks reuse the TLS connection.
+        self.session = requests.Session()
+
+    def transcribe(self, file_path, language=None, timeout=None):
+        return self._post(file_path, language, timeout).get("text", "")
+
+    def transcribe_segments(self, file_path, language=None, timeout=None):
+        return _segments_from_verbose_json(self._post(file_path, language, timeout, response_format="verbose_json"))
+
+    def _post(self, file_path, language, timeout, response_format=None):
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        data = {"model": self.model}
+        if language:
+            data["language"] = language
+        if response_format:
+            data["response_format"] = response_format
+
+        upload_bytes = os.path.getsize(file_path)
+        started = time.monotonic()
+        with open(file_path, "rb") as audio_file:
+            response = self.session.post(
+                self.api_url,
+                headers=headers,
+                files={"file": audio_file},
+                data=data,
+                timeout=timeout or 120,
+            )
+        # Time until Whisper answered: the upload plus any API queueing/processing.
+        upload_seconds = time.monotonic() - started
+
+        logger.info(f"Uploaded {os.path.basename(file_path)}: {upload_bytes} bytes in {upload_seconds:.2f}s")
+        metrics.observe("transcription.upload_bytes", upload_bytes)
+        metrics.observe("transcription.upload_seconds", round(upload_seconds, 3))
+
+        if response.status_code != 200:
+            raise TranscriptionError(f"Whisper API error: {response.status_code} - {response.text}")
+        return response.json()
+
+    async def transcribe_async(self, file_path, language=None, timeout=None):
+        return (await self._post_async(file_path, language, timeout)).get("text", "")
+
+    async def transcribe_segments_async(self, file_path, language=None, timeout=None):
+        return _segments_from_verbose_json(
+            await self._post_async(file_path, language, timeout, response_format="verbose_json"))
+
+    async def _post_async(self, file_path, language, timeout, response_format=None):
+        from comp_runtime import get_runtime
+
+        form = aiohttp.FormData()
+        form.add_field("model", self.model)
+        if language:
+            form.add_field("language", language)
+        if response_format:
+            form.add_field("response_format", response_format)
+        with open(file_path, "rb") as audio_file:
+            audio = audio_file.read()
+        form.add_field("file", audio, filename=os.path.basename(file_path))
+
+        session = await get_runtime().http()
+        started = time.monotonic()
+        async with session.post(self.api_url, data=form, headers={"Authorization": f"Bearer {self.api_key}"},
+                                timeout=aiohttp.ClientTimeout(total=timeout or 120)) as response:
+            status = response.status
+            body = await response.json(content_type=None) if status == 200 else await response.text()
+        upload_seconds = time.monotonic() - started
+
+        logger.info(f"Uploaded {os.path.basename(file_path)}: {len(audio)} bytes in {upload_seconds:.2f}s")
+        metrics.observe("transcription.upload_bytes", len(audio))
+        metrics.observe("transcription.upload_seconds", round(upload_seconds, 3))
+
+        if status != 200:
+            raise TranscriptionError(f"Whisper API error: {status} - {body}")
+        return body
+
+    def close(self):
+        self.session.close()
+
+
+# ============= LOCAL (IN-PROCESS) BACKEND =============
+# The model lives in the pool worker processes, one copy per worker, loaded once by
+# the pool initializer so no request ever pays the model load time.
+_worker_model = None
+
+
+def _init_local_worker(model_name, compute_type):
+    global _worker_model
+    from faster_whisper import WhisperModel
+    _worker_model = WhisperModel(model_name, device="cpu", compute_type=compute_type, cpu_threads=1)
+
+
+def _transcribe_job(file_path, language, timed):
+    """
+    Runs inside a pool worker. Timed jobs get segment dicts back instead of the joined text.
+    """
+    segments, _info = _worker_model.transcribe(file_path, language=language, beam_size=1)
+    if timed:
+        return [{"start": segment.start, "end": segment.end, "text": segment.text.strip()}
+                for segment in segments if segment.text.strip()]
+    return "".join(segment.text for segment in segments).strip()
+
+
+class LocalTranscriptionBackend(TranscriptionBackend):
+    """
+    Runs faster-whisper in a parallel CPU process pool; chunks are not batched.
+
+    Every chunk is its own pool job, so concurrent chunks (for example from different
+    comps at the same time) are transcribed in parallel on the idle workers; beyond
+    LOCAL_WHISPER_WORKERS they queue in the pool. A job that times out while still
+    queued is cancelled so it never takes a worker.
+    """
+
+    name = "local"
+
+    def __init__(self, model_name=None, compute_type=None, workers=None):
+        if importlib.util.find_spec("faster_whisper") is None:
+            raise TranscriptionError("faster-whisper is not installed; pip install faster-whisper")
+        self.model_name = model_name or LOCAL_WHISPER_MODEL
+        self.compute_type = compute_type or LOCAL_WHISPER_COMPUTE_TYPE
+        self.workers = workers or LOCAL_WHISPER_WORKERS
+
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_local_worker,
+            initargs=(self.model_name, self.compute_type),
+        )
+        self.closed = False
+        logger.info(f"Local transcription backend started: model={self.model_name}, workers={self.workers}")
+
+    def _submit(self, file_path, language, timed):
+        if self.closed:
+            raise TranscriptionError("Local transcription backend is closed")
+        try:
+            return self.pool.submit(_transcribe_job, os.path.abspath(file_path), language, timed)
+        except Exception as e:
+            raise TranscriptionError(f"Could not submit transcription job: {e}") from e
+
+    def transcribe(self, file_path, language=None, timeout=None, timed=False):
+        started = time.monotonic()
+        future = self._submit(file_path, language, timed)
+        try:
+            transcript = future.result(timeout=timeout)
+        except Exception as e:
+            future.cancel()
+            raise TranscriptionError(f"Local transcription failed: {type(e).__name__}: {e}") from e
+        metrics.observe("transcription.local_seconds", round(time.monotonic() - started, 3))
+        return transcript
+
+    async def transcribe_async(self, file_path, language=None, timeout=None, timed=False):
+        started = time.monotonic()
+        future = self._submit(file_path, language, timed)
+        try:
+            transcript = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except Exception as e:
+            future.cancel()
+            raise TranscriptionError(f"Local transcription failed: {type(e).__name__}: {e}") from e
+        metrics.observe("transcription.local_seconds", round(time.monotonic() - started, 3))
+        return transcript
+
+    def transcribe_segments(self, file_path, language=None, timeout=None):
+        return self.transcribe(file_path, language, timeout, timed=True)
+
+    async def transcribe_segments_async(self, file_path, language=None, timeout=None):
+        return await self.transcribe_async(file_path, language, timeout, timed=True)
+
+    def close(self):
+        self.closed = True
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+BACKENDS = {
+    HTTPTranscriptionBackend.name: HTTPTranscriptionBackend,
+    LocalTranscriptionBackend.name: LocalTranscriptionBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_transcription_backend():
+    """
+    Returns the process wide transcription backend selected by TRANSCRIPTION_BACKEND.
+    Falls back to the HTTP backend when the local model cannot be started.
+    """
+    global _backend
+    if _backend is not None:
+        return _backend
+    with _backend_lock:
+        if _backend is None:
+            backend_name = (TRANSCRIPTION_BACKEND or "http").lower()
+            backend_class = BACKENDS.get(backend_name)
+            if backend_class is None:
+                logger.warning(f"Unknown TRANSCRIPTION_BACKEND '{backend_name}', using http")
+                backend_class = HTTPTranscriptionBackend
+            try:
+                _backend = backend_class()
+            except Exception as e:
+                logger.error(f"Could not start '{backend_name}' transcription backend: {e}. Falling back to http.")
+                _backend = HTTPTranscriptionBackend()
+    return _backend
@@ -1,9 +1,10 @@
 # ALL THE REQUIRED UNTILITY FUNCTIONS WILL BE ADDED HERE.
-import requests
-from constants import AUTH, URL
 from logger import logger
+from outbox import enqueue
 import json
 import time
+import threading
+from collections import OrderedDict
 
             
 def get_compname_alerts(data):
@@ -39,33 +40,74 @@ def get_compname_alerts(data):
     return None
 
 
-def return_data_to_message_server(data):
+def return_data_to_message_server(data, idempotency_key=None):
+    """
+    Send (comp_name, message_data) to the messaging server.
+
+    The first attempt is made right away; retries and dead-lettering are handled by the
+    outbox (see outbox.py), so a failing messaging server no longer loses the result.
+
+    Returns:
+        bool: True once the message is stored in the outbox.
+    """
     comp_name = data[0]
     message_data = data[1]
 
-    # Convert bytes to string if needed
-    if isinstance(message_data, bytes):
-        message_data = message_data.decode('utf-8')  # or 'ascii' depending on encoding
-
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': AUTH
-    }
-    data = {
-        'comp_name': comp_name,
-        'message_data': message_data
-    }
-
-    logger.info("Data Sent to messaging server")
-
-    response = requests.post(URL, headers=headers, json=data)
-    logger.info(f"Message server response: {response}")
-    if response.status_code == 200:
-        logger.info(f"Successfully sent data to message server for comp DATA: {data}")
-        return True
-    else:
-        logger.error(f"Failed to send data to message server for comp DATA: {data}, Status Code: {response.status_code}, Response: {response.text}")
-        logger.error("Error sending data to message server")
+    try:
+        message_id = enqueue(comp_name, message_data, idempotency_key=idempotency_key, immediate=True)
+    except Exception as e:
+        logger.error(f"Could not queue data for message server for comp {comp_name}: {e}")
         return False
+    logger.info(f"Data queued for messaging server (message {message_id})")
+    return True
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Small thread-safe in-process LRU cache with an optional per-entry TTL.
+    Used in front of Redis/HTTP lookups that repeat many times a day.
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
 
-    
\ No newline at end of file
+    def __len__(self):
+        return len(self._data)